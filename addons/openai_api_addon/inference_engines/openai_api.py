@@ -690,7 +690,7 @@ class LLM(base_LLM):
                         with open(self.config.api_log_dir+"/"+log_id+".log", "w") as f:
                             f.write(prompt)
                     
-                    return self.client.completions.create(prompt=prompt,
+                    generator = self.client.completions.create(prompt=prompt,
                         model=self.config.openai_model, 
                         max_tokens=self.config.max_tokens,
                         **sampler_kwargs,
@@ -698,6 +698,12 @@ class LLM(base_LLM):
                         stream=True,
                         logit_bias=self.logit_bias,
                     )
+                    try:
+                        for chunk in generator:
+                            yield chunk
+                    finally:
+                        generator.close() # release the HTTP connection if the stream is stopped early
+                    retries = 0
                 else:
                     messages = self.convert_to_standard_messages(messages)
                     if self.config.log_all_api_requests:
@@ -724,19 +730,22 @@ class LLM(base_LLM):
                     logging.info(f"Streaming response...")
                     reasoning = ""
                     first_chunk = True
-                    for chunk in generator:
-                        if len(chunk.choices) == 0:
-                            continue
-                        if hasattr(chunk.choices[0].delta, "reasoning") and chunk.choices[0].delta.reasoning is not None:
-                            if first_chunk:
-                                logging.info(f"Please wait, this is a reasoning model and it may take a moment for the reasoning to finish...")
-                                first_chunk = False
-                            reasoning += chunk.choices[0].delta.reasoning
-                        else:
-                            if reasoning != "":
-                                logging.info(f"Reasoning: {reasoning}")
-                                reasoning = ""
-                            yield chunk
+                    try:
+                        for chunk in generator:
+                            if len(chunk.choices) == 0:
+                                continue
+                            if hasattr(chunk.choices[0].delta, "reasoning") and chunk.choices[0].delta.reasoning is not None:
+                                if first_chunk:
+                                    logging.info(f"Please wait, this is a reasoning model and it may take a moment for the reasoning to finish...")
+                                    first_chunk = False
+                                reasoning += chunk.choices[0].delta.reasoning
+                            else:
+                                if reasoning != "":
+                                    logging.info(f"Reasoning: {reasoning}")
+                                    reasoning = ""
+                                yield chunk
+                    finally:
+                        generator.close() # release the HTTP connection if the stream is stopped early
                     retries = 0
             except Exception as e:
                 logging.warning('Could not connect to LLM API, retrying in 5 seconds...')
@@ -0,0 +1,112 @@
+print("Loading benchmarks/character_db.py")
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # run from the Pantella folder: python benchmarks/character_db.py
+from src.logging import logging
+import argparse
+import timeit
+import types
+from src.character_dbs.base_character_db import CharacterDB
+logging.info("Imported required libraries in benchmarks/character_db.py")
+
+# The linear scans CharacterDB used before its views and indexes were cached, kept here to compare against
+
+def baseline_characters(db):
+    filtered = []
+    for character in db._characters:
+        if character['name'] != None and character['name'] != "" and str(character['name']).lower() != "nan":
+            filtered.append(character)
+    return sorted(filtered, key=lambda x: str(x['name']))
+
+def baseline_all_voice_models(db):
+    models = []
+    for character in baseline_characters(db):
+        if character["voice_model"] != "":
+            if character["voice_model"] not in models:
+                models.append(character["voice_model"])
+    models = [model for model in models if model != "" and model != "nan" and model != None]
+    return sorted(list(set(models)))
+
+def baseline_voice_folders(db):
+    folders = {}
+    for character in baseline_characters(db):
+        if character['voice_model'] != "":
+            if character['voice_model'] not in folders:
+                if character['voice_folder'] != "":
+                    folders[character['voice_model']] = [character['voice_folder']]
+                else:
+                    folders[character['voice_model']] = [character['voice_model']]
+            else:
+                if character["voice_folder"] not in folders[character['voice_model']]:
+                    if character['voice_folder'] != "":
+                        folders[character['voice_model']].append(character['voice_folder'])
+                    else:
+                        folders[character['voice_model']].append(character['voice_model'])
+    return folders
+
+def baseline_get_voice_folder_by_voice_model(db, voice_model):
+    folder = None
+    voice_folders = baseline_voice_folders(db)
+    for voice_folder in voice_folders:
+        if voice_model == voice_folder:
+            folder = voice_folders[voice_folder]
+        if voice_model.replace(' ', '') == voice_folder:
+            folder = voice_folders[voice_folder]
+    if folder == None:
+        folder = voice_model.replace(' ', '')
+    if type(folder) == list:
+        folder = folder[0]
+    return folder
+
+def baseline_get_character_by_voice_folder(db, voice_folder):
+    for character in baseline_characters(db):
+        if character['voice_model'].lower() == voice_folder.lower():
+            return character
+    return None
+
+def load_db(game_id):
+    """Load a shipped character database without a conversation manager or TTS engine"""
+    config = types.SimpleNamespace(
+        character_database_file=os.path.join(".", "characters"),
+        game_id=game_id,
+        voice_model_ref_ids_file=os.path.join(".", "skyrim_voice_model_ids.json"), # only read into a dict, any game's file will do
+        config_path="benchmark",
+        addons={},
+    )
+    synthesizer = types.SimpleNamespace(voices=lambda: [], get_valid_voice_model=lambda voice_model, crashable=False, log=False: None)
+    return CharacterDB(types.SimpleNamespace(config=config, synthesizer=synthesizer))
+
+def milliseconds(function, number):
+    return min(timeit.repeat(function, number=number, repeat=3)) / number * 1000
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare CharacterDB lookups against the linear scans they replaced')
+    parser.add_argument('--game', default='skyrim', help='Character database to load from the characters folder')
+    parser.add_argument('--number', type=int, default=20, help='Calls per timing')
+    args = parser.parse_args()
+
+    db = load_db(args.game)
+    voice_models = sorted(set(db.all_voice_models + db.all_voice_folders))
+    lookups = voice_models + [voice_model.replace(' ', '') for voice_model in voice_models] + [voice_model.lower() for voice_model in voice_models]
+
+    # the cached views and indexes have to give the same answers as the scans
+    assert db.characters == baseline_characters(db)
+    assert db.all_voice_models == baseline_all_voice_models(db)
+    assert db.voice_folders == baseline_voice_folders(db)
+    mismatches = [voice_model for voice_model in lookups if db.get_voice_folder_by_voice_model(voice_model) != baseline_get_voice_folder_by_voice_model(db, voice_model)]
+    assert len(mismatches) == 0, f"get_voice_folder_by_voice_model differs for: {mismatches}"
+    mismatches = [voice_model for voice_model in lookups if db.get_character_by_voice_folder(voice_model) is not baseline_get_character_by_voice_folder(db, voice_model)]
+    assert len(mismatches) == 0, f"get_character_by_voice_folder differs for: {mismatches}"
+    print(f"{args.game}: {len(db._characters)} characters, {len(lookups)} voice model lookups checked against the linear scans")
+
+    sample = lookups[len(lookups) // 2] if len(lookups) > 0 else ""
+    rows = [
+        ("characters", lambda: baseline_characters(db), lambda: db.characters),
+        ("all_voice_models", lambda: baseline_all_voice_models(db), lambda: db.all_voice_models),
+        ("voice_folders", lambda: baseline_voice_folders(db), lambda: db.voice_folders),
+        ("get_voice_folder_by_voice_model", lambda: baseline_get_voice_folder_by_voice_model(db, sample), lambda: db.get_voice_folder_by_voice_model(sample)),
+        ("get_character_by_voice_folder", lambda: baseline_get_character_by_voice_folder(db, sample), lambda: db.get_character_by_voice_folder(sample)),
+    ]
+    print(f"{'':32} {'scan ms':>10} {'cached ms':>10}")
+    for name, scan, cached in rows:
+        print(f"{name:32} {milliseconds(scan, args.number):10.4f} {milliseconds(cached, args.number):10.4f}")
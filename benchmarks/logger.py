@@ -0,0 +1,79 @@
+print("Loading benchmarks/logger.py")
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # run from the Pantella folder: python benchmarks/logger.py
+from src.logging import logging, Logger, bcolors
+import argparse
+import contextlib
+import inspect
+import io
+import tempfile
+import time
+logging.info("Imported required libraries in benchmarks/logger.py")
+
+class BaselineLogger:
+    """How Logger.info() worked before the logging backend was replaced - inspect.stack() and an open/close of the log file on every call"""
+    def __init__(self, log_file):
+        self.format = '{time} [{location}] [{level}] {message}'
+        self.log_file = log_file
+
+    def info(self, *args):
+        frame_info = inspect.stack()[1]
+        filepath = frame_info[1]
+        del frame_info
+        filepath = os.path.relpath(filepath)
+        line = inspect.currentframe().f_back.f_lineno
+        message = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
+            'level': 'INFO',
+            'location': filepath+":"+str(line),
+            'message': ' '.join([str(arg) for arg in args])
+        }
+        message = self.format.format(**message)
+        print(message)
+        with open(self.log_file, 'a') as f:
+            remove_colors = message
+            for color in bcolors.values():
+                remove_colors = remove_colors.replace(color, '')
+            f.write(remove_colors + '\n')
+
+def log_from_depth(logger, depth, calls):
+    """Call logger.info() calls times from depth frames down, like a log call deep inside a conversation would be"""
+    if depth > 0:
+        return log_from_depth(logger, depth - 1, calls)
+    for i in range(calls):
+        logger.info("Benchmark message", i)
+
+def microseconds(logger, depth, calls):
+    with contextlib.redirect_stdout(io.StringIO()): # console output is captured so the terminal doesn't dominate the timings
+        start = time.perf_counter()
+        log_from_depth(logger, depth, calls)
+        if isinstance(logger, Logger):
+            logger.flush() # count the time to get the lines into the file too
+        elapsed = time.perf_counter() - start
+    return elapsed / calls * 1000000
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the cost of a logging call against the logger it replaced')
+    parser.add_argument('--calls', type=int, default=2000, help='Log calls per timing')
+    parser.add_argument('--depth', type=int, default=30, help='Stack frames between the benchmark and the log calls')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        log_file = os.path.join(folder, "benchmark.log")
+        baseline = BaselineLogger(log_file)
+        written = Logger(log_file=log_file)
+        filtered_by_level = Logger(log_file=log_file, level="WARNING")
+        filtered_by_module = Logger(log_file=log_file)
+        filtered_by_module.set_level("WARNING", "benchmarks/")
+        rows = [
+            ("before (inspect.stack, open per line)", baseline),
+            ("written", written),
+            ("filtered by level", filtered_by_level),
+            ("filtered per module", filtered_by_module),
+        ]
+        print(f"{args.calls} logging.info calls from {args.depth} frames deep, console output captured")
+        for name, logger in rows:
+            print(f"{name:40} {microseconds(logger, args.depth, args.calls):10.2f} us per call")
+        for logger in (written, filtered_by_level, filtered_by_module):
+            logger.writer.close()
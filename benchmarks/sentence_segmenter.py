@@ -0,0 +1,68 @@
+print("Loading benchmarks/sentence_segmenter.py")
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # run from the Pantella folder: python benchmarks/sentence_segmenter.py
+from src.logging import logging
+from src.sentence_segmenter import ReplyBuilder
+from test_sentence_segmenter import CORPUS, split_stream, reference_stream, segmenter_stream
+import argparse
+import random
+import time
+logging.info("Imported required libraries in benchmarks/sentence_segmenter.py")
+
+def recorded_stream(tokens, rng):
+    """A long reply in token sized chunks, built from the corpus lines with their EOS/stop strings removed so the stream runs to the end"""
+    body = []
+    for reply in CORPUS:
+        text = reply.split(":", 1)[1]
+        for stop in ["<turn|>", "<TURN|>", "<channel|>", "\n\n", "<|turn>"]:
+            text = text.split(stop)[0]
+        body.append(text)
+    reply = ["Lydia:"]
+    length = 0
+    while length < tokens * 12: # split_stream's longest chunk, so there's always enough text
+        reply.append(rng.choice(body))
+        length += len(reply[-1])
+    return split_stream("".join(reply), rng)[:tokens] + ["<turn|>"]
+
+def time_stream(stream_function, chunks, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        stream_function(chunks)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def reference_full_reply(sentences):
+    full_reply = ''
+    for sentence in sentences:
+        full_reply = full_reply.strip() + "[s0] " + sentence.strip()
+    return full_reply.strip()
+
+def builder_full_reply(sentences):
+    full_reply = ReplyBuilder()
+    for sentence in sentences:
+        full_reply.append("[s0] ", sentence.strip())
+    return str(full_reply)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the sentence segmenter against the whole-reply rescans process_response() did before it')
+    parser.add_argument('--tokens', type=int, nargs='+', default=[500, 2000, 20000], help='Stream lengths to time')
+    parser.add_argument('--repeats', type=int, default=3, help='Timings per stream, the fastest is reported')
+    args = parser.parse_args()
+    logging.set_level("WARNING") # the segmenter's EOS/replacement log lines would otherwise be timed too
+
+    rng = random.Random(0)
+    print(f"{'tokens':>8} {'before':>12} {'segmenter':>12} {'full reply before':>18} {'ReplyBuilder':>14}")
+    for tokens in args.tokens:
+        chunks = recorded_stream(tokens, rng)
+        reference = reference_stream(chunks)
+        assert segmenter_stream(chunks) == reference, "the segmenter disagrees with the old token loop"
+        sentences = reference[1]
+        assert builder_full_reply(sentences) == reference_full_reply(sentences), "ReplyBuilder disagrees with string concatenation"
+        before = time_stream(reference_stream, chunks, args.repeats)
+        after = time_stream(segmenter_stream, chunks, args.repeats)
+        full_reply_before = time_stream(reference_full_reply, sentences, args.repeats)
+        full_reply_after = time_stream(builder_full_reply, sentences, args.repeats)
+        print(f"{tokens:>8} {before*1000:>10.2f}ms {after*1000:>10.2f}ms {full_reply_before*1000:>16.2f}ms {full_reply_after*1000:>12.2f}ms")
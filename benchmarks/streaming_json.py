@@ -0,0 +1,188 @@
+print("Loading benchmarks/streaming_json.py")
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # run from the Pantella folder: python benchmarks/streaming_json.py
+from src.logging import logging
+from src.streaming_json import StreamingJSONParser
+import argparse
+import json
+import random
+import time
+logging.info("Imported required libraries in benchmarks/streaming_json.py")
+
+WORDS = "the jarl dragon guard blade of whiterun I think we should not trust him yet but the road north is long and cold and my sword arm grows tired".split()
+
+def sentences(rng, count):
+    return " ".join(" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 16))).capitalize() + "." for _ in range(count))
+
+def freudian_response(rng, paragraphs):
+    """A response shaped like the freudian thought process schema, about paragraphs * 4 sentences long per field"""
+    return {
+        "freudian_thought": {
+            "id_response": sentences(rng, paragraphs * 4),
+            "ego_response": sentences(rng, paragraphs * 4),
+            "super_ego_response": sentences(rng, paragraphs * 4),
+        },
+        "thought_branches": [{"idea": sentences(rng, 2), "thought_steps": [sentences(rng, 4) for _ in range(rng.randint(2, 5))]} for _ in range(3)],
+        "questions": [{"question": sentences(rng, 1), "answer": sentences(rng, 2), "counter_point": sentences(rng, 2)} for _ in range(3)],
+        "response_to_user": sentences(rng, paragraphs * 6),
+    }
+
+def token_chunks(text, rng):
+    chunks = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 6)
+        chunks.append(text[i:i+size])
+        i += size
+    return chunks
+
+def parse_list(new_json, orig_json):
+    res_json = {}
+    for i in range(len(new_json)):
+        if type(new_json[i]) == list and len(new_json[i]) > 0:
+            if i < len(orig_json):
+                if new_json[i] != orig_json[i]:
+                    res_json[i] = parse_list(new_json[i], orig_json[i])
+            else:
+                res_json[i] = new_json[i]
+        elif type(new_json[i]) == dict:
+            if i < len(orig_json):
+                if new_json[i] != orig_json[i]:
+                    res_json[i] = parse_dict(new_json[i], orig_json[i])
+            else:
+                res_json[i] = {}
+                for key in new_json[i]:
+                    if key not in orig_json[i]:
+                        res_json[i][key] = new_json[i][key]
+        else:
+            if i < len(orig_json):
+                string_new = str(new_json[i])
+                string_orig = str(orig_json[i])
+                string_diff = string_new[len(string_orig):]
+                if string_diff != "":
+                    res_json[i] = string_diff if type(new_json[i]) == str else type(orig_json[i])(string_diff)
+            else:
+                res_json[i] = new_json[i]
+    return res_json
+
+def parse_dict(new_json, orig_json):
+    res_json = {}
+    for key in new_json:
+        if type(new_json[key]) == list and len(new_json[key]) > 0:
+            if key in orig_json:
+                if new_json[key] != orig_json[key]:
+                    res_json[key] = parse_list(new_json[key], orig_json[key])
+            else:
+                res_json[key] = new_json[key]
+        elif type(new_json[key]) == dict:
+            if key in orig_json:
+                if new_json[key] != orig_json[key]:
+                    res_json[key] = parse_dict(new_json[key], orig_json[key])
+            else:
+                res_json[key] = {}
+                for sub_key in new_json[key]:
+                    res_json[key][sub_key] = new_json[key][sub_key]
+        else:
+            if key in orig_json:
+                if type(new_json[key]) == str:
+                    res_json[key] = new_json[key][len(orig_json[key]):]
+                    if res_json[key] == "":
+                        del res_json[key]
+                else:
+                    string_diff = str(new_json[key])[len(str(orig_json[key])):]
+                    if string_diff != "":
+                        res_json[key] = type(orig_json[key])(string_diff)
+            else:
+                res_json[key] = new_json[key]
+    return res_json
+
+def baseline_stream(chunks):
+    """How generate_response() handled CoT chunks before StreamingJSONParser - rescan the whole response for brackets, json.loads it again and diff-walk the whole object, on every chunk"""
+    raw_response = ""
+    response_json = {}
+    last_diff_json = {}
+    response_to_user = ""
+    for formatted_chunk in chunks:
+        raw_response += formatted_chunk
+        raw_special_character_list = ""
+        for character in raw_response:
+            if character in ["{", "}", "[", "]"]:
+                raw_special_character_list += character
+        response_ending = ""
+        left_bracket_ignore = 0
+        left_square_bracket_ignore = 0
+        for character in reversed(raw_special_character_list):
+            if character == "{":
+                if left_bracket_ignore > 0:
+                    left_bracket_ignore -= 1
+                else:
+                    response_ending = response_ending + "}"
+            elif character == "}":
+                left_bracket_ignore += 1
+            elif character == "[":
+                if left_square_bracket_ignore > 0:
+                    left_square_bracket_ignore -= 1
+                else:
+                    response_ending = response_ending + "]"
+            elif character == "]":
+                left_square_bracket_ignore += 1
+        diff_json = {}
+        reference_response = str(raw_response).strip()
+        if reference_response.endswith(","):
+            reference_response = reference_response[:-1]
+        try:
+            new_response_json = json.loads(reference_response)
+        except:
+            try:
+                new_response_json = json.loads(reference_response+response_ending)
+            except:
+                try:
+                    new_response_json = json.loads(reference_response+"\""+response_ending)
+                except:
+                    new_response_json = {}
+        if new_response_json != response_json:
+            diff_json = parse_dict(new_response_json, response_json)
+        response_json = new_response_json
+        if diff_json != {} and diff_json != last_diff_json:
+            last_diff_json = diff_json
+            response_to_user += diff_json.get("response_to_user", "")
+    return response_json, response_to_user
+
+def parser_stream(chunks):
+    """How generate_response() handles CoT chunks now"""
+    parser = StreamingJSONParser()
+    response_to_user = ""
+    for formatted_chunk in chunks:
+        diff_json = parser.feed(formatted_chunk)
+        if diff_json != {}:
+            response_to_user += diff_json.get("response_to_user", "")
+    return parser.value, response_to_user
+
+def best_time(stream_function, chunks, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        stream_function(chunks)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare StreamingJSONParser against re-parsing the whole CoT response on every chunk')
+    parser.add_argument('--paragraphs', type=int, nargs='+', default=[1, 4, 16], help='Length of the generated freudian responses')
+    parser.add_argument('--repeats', type=int, default=3, help='Timings per response, the fastest is reported')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'paragraphs':>10} {'characters':>10} {'chunks':>8} {'before':>12} {'streaming':>12}")
+    for paragraphs in args.paragraphs:
+        response = freudian_response(rng, paragraphs)
+        chunks = token_chunks(json.dumps(response, indent=4), rng)
+        before_json, before_text = baseline_stream(chunks)
+        after_json, after_text = parser_stream(chunks)
+        assert before_json == after_json == response, "the parsers disagree on the finished response"
+        assert after_text == response["response_to_user"], "the streamed response_to_user text doesn't match the response" # not checked for the old loop, it drops a delta that repeats the one before it
+        before = best_time(baseline_stream, chunks, args.repeats)
+        after = best_time(parser_stream, chunks, args.repeats)
+        print(f"{paragraphs:>10} {sum(len(chunk) for chunk in chunks):>10} {len(chunks):>8} {before*1000:>10.2f}ms {after*1000:>10.2f}ms")
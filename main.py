@@ -116,6 +116,10 @@ if __name__ == "__main__":
 
     logging.info("Loading blocked logging paths -- No logs will be generated from these files")
     logging.block_logs_from = config.block_logs_from # block logs from certain files
+    logging.block_log_types = config.block_log_types # block logs of certain levels
+    logging.set_level(config.log_level)
+    for module, module_level in config.module_log_levels.items():
+        logging.set_level(module_level, module)
 
     utils.cleanup_mei(config.remove_mei_folders) # clean up old instances of exe runtime files
 
@@ -0,0 +1,131 @@
+print("Importing audio_buffer.py")
+from src.logging import logging
+import io
+import numpy as np
+import soundfile as sf
+logging.info("Imported required libraries in audio_buffer.py")
+
+class AudioBuffer:
+    """Synthesized audio held in memory until it's written out as the 16-bit PCM wav the games play.
+
+    A buffer is either samples (a numpy array shaped (frames,) or (frames, channels), float in the -1.0 to 1.0 range or int16) plus a sample rate, or the bytes of an encoded audio file, like an HTTP response from a TTS server. Encoded bytes are only decoded if they aren't already a 16-bit PCM wav, so audio that's already in the right format is written to disk exactly as it was received."""
+    def __init__(self, samples=None, sample_rate=None, encoded=None):
+        self._samples = samples
+        self.sample_rate = sample_rate
+        self.encoded = encoded # bytes of an encoded audio file, or None
+
+    @classmethod
+    def from_bytes(cls, data, override_sample_rate=None):
+        """Wrap the bytes of an encoded audio file - only the header is read until the samples are needed"""
+        info = sf.info(io.BytesIO(data))
+        buffer = cls(sample_rate=info.samplerate, encoded=data)
+        if info.format != 'WAV' or info.subtype != 'PCM_16' or (override_sample_rate is not None and override_sample_rate != info.samplerate):
+            buffer._decode()
+        if override_sample_rate is not None:
+            buffer.sample_rate = override_sample_rate
+        return buffer
+
+    @classmethod
+    def from_file(cls, input_file, override_sample_rate=None):
+        """Read an audio file from a path or file-like object"""
+        if hasattr(input_file, "read"):
+            data = input_file.read()
+        else:
+            with open(input_file, "rb") as f:
+                data = f.read()
+        return cls.from_bytes(data, override_sample_rate)
+
+    def _decode(self):
+        self._samples, _ = sf.read(io.BytesIO(self.encoded))
+        self.encoded = None
+
+    @property
+    def samples(self):
+        if self._samples is None:
+            self._decode()
+        return self._samples
+
+    def pcm16(self):
+        """Get the samples as 16-bit PCM"""
+        data = self.samples
+        if np.issubdtype(data.dtype, np.floating): # assumed to be in the -1.0 to 1.0 range
+            return np.int16(data.astype(np.float64) * 32767) # scaled in double precision so float32 samples round the same way they did when they were read back from a float wav
+        elif not np.issubdtype(data.dtype, np.int16): # not floating-point or int16, converted without scaling
+            return data.astype(np.int16)
+        return data
+
+    def write(self, output_file):
+        """Write the audio to output_file as a 16-bit PCM wav - audio that's already encoded that way is written as is"""
+        if self.encoded is not None:
+            with open(output_file, "wb") as f:
+                f.write(self.encoded)
+        else:
+            sf.write(output_file, self.pcm16(), self.sample_rate, subtype='PCM_16')
+
+def remove_silence(samples, sample_rate, min_silence_len=1000, silence_thresh=-50, keep_silence=500, seek_step=10):
+    """Cut every stretch of silence at least min_silence_len ms long out of float samples, keeping keep_silence ms of it on each side of the audio around it - returns float32 samples.
+
+    Gives the same result as splitting a 16-bit wav of the samples with pydub's split_on_silence() and joining the pieces back together (what f5_tts's remove_silence_for_generated_wav() does through a temp file), without the samples ever leaving memory."""
+    wav = io.BytesIO() # quantized by libsndfile in memory, so the samples are rounded exactly the way writing them to a 16-bit wav file would
+    sf.write(wav, samples, sample_rate, format='WAV', subtype='PCM_16')
+    wav.seek(0)
+    pcm, _ = sf.read(wav, dtype='int16')
+    frame_count = pcm.shape[0]
+    length = round(1000 * frame_count / sample_rate) # length in ms
+    def frame(ms):
+        return int(min(ms, length) * (sample_rate / 1000.0))
+    if frame(length) > frame_count: # rounding the length to whole ms can land past the last sample, pydub reads silence there
+        pcm = np.concatenate((pcm, np.zeros((frame(length) - frame_count,) + pcm.shape[1:], dtype=np.int16)))
+    nonsilent_ranges = [[0, length]]
+    if length >= min_silence_len:
+        # RMS of every min_silence_len window, from a running sum of squares instead of one pass over the samples per window
+        squares = pcm.astype(np.int64) ** 2
+        if squares.ndim > 1: # channels are interleaved, so every sample of every channel counts
+            squares = squares.sum(axis=1)
+            channels = pcm.shape[1]
+        else:
+            channels = 1
+        running_sum = np.concatenate(([0], np.cumsum(squares)))
+        last_window_start = length - min_silence_len
+        window_starts = list(range(0, last_window_start + 1, seek_step))
+        if last_window_start % seek_step:
+            window_starts.append(last_window_start)
+        window_starts = np.array(window_starts)
+        start_frames = np.array([frame(ms) for ms in window_starts])
+        end_frames = np.array([frame(ms + min_silence_len) for ms in window_starts])
+        sample_counts = (end_frames - start_frames) * channels
+        sums = (running_sum[end_frames] - running_sum[start_frames]).astype(np.float64)
+        rms = np.floor(np.sqrt(sums / np.maximum(sample_counts, 1)))
+        silent = (rms <= 10 ** (silence_thresh / 20) * 32768) & (sample_counts > 0)
+        silence_starts = window_starts[silent].tolist()
+        if silence_starts:
+            # merge overlapping silent windows into silent ranges
+            silent_ranges = []
+            previous = current_start = silence_starts[0]
+            for silence_start in silence_starts[1:]:
+                if silence_start != previous + seek_step and silence_start > previous + min_silence_len:
+                    silent_ranges.append([current_start, previous + min_silence_len])
+                    current_start = silence_start
+                previous = silence_start
+            silent_ranges.append([current_start, previous + min_silence_len])
+            if silent_ranges[0][0] == 0 and silent_ranges[0][1] == length:
+                nonsilent_ranges = []
+            else:
+                nonsilent_ranges = []
+                previous_end = 0
+                for start, end in silent_ranges:
+                    nonsilent_ranges.append([previous_end, start])
+                    previous_end = end
+                if previous_end != length:
+                    nonsilent_ranges.append([previous_end, length])
+                if nonsilent_ranges[0] == [0, 0]:
+                    nonsilent_ranges.pop(0)
+    kept_ranges = [[start - keep_silence, end + keep_silence] for start, end in nonsilent_ranges]
+    for previous_range, next_range in zip(kept_ranges, kept_ranges[1:]): # overlapping padding is split down the middle
+        if next_range[0] < previous_range[1]:
+            previous_range[1] = (previous_range[1] + next_range[0]) // 2
+            next_range[0] = previous_range[1]
+    pieces = [pcm[frame(max(start, 0)):frame(min(end, length))] for start, end in kept_ranges]
+    if len(pieces) == 0:
+        return np.zeros((0,) + pcm.shape[1:], dtype=np.float32)
+    return np.concatenate(pieces).astype(np.float32) / 32768 # scaled the way reading a 16-bit wav back with torchaudio does
@@ -3,6 +3,7 @@ import src.utils as utils
 import json
 import os
 import pandas as pd
+from src.name_matcher import NameMatcher
 logging.info("Imported required libraries in base_character_db.py")
 
 db_slug = "base_db"
@@ -21,6 +22,8 @@ class CharacterDB():
         self.valid = []
         self.invalid = []
         self.db_type = None
+        self.version = 0 # bumped every time the characters in the database change, so anything built from them knows when to rebuild
+        self._views = {} # cached views of the character database, cleared by invalidate()
         # make sure voice_model_ref_ids_file exists
         if not os.path.exists(self.config.voice_model_ref_ids_file):
             logging.error(f"Could not find voice_model_ref_ids_file at {self.config.voice_model_ref_ids_file}. Please download the correct file for your game, or correct the filepath in your {self.config.config_path} and try again.")
@@ -101,6 +104,7 @@ class CharacterDB():
             self.db_type = 'mixed'
         else:
             self.db_type = 'json'
+        self.invalidate()
         logging.info(f"Loaded {len(self._characters)-count_before} characters from json files {path}")
     
     def load_characters_csv(self, path=None):
@@ -127,6 +131,7 @@ class CharacterDB():
             self.db_type = 'mixed'
         else:
             self.db_type = 'csv'
+        self.invalidate()
         logging.info(f"Loaded {len(self.characters)} characters from csv {path}")
 
     def format_character(self, character):
@@ -179,8 +184,22 @@ class CharacterDB():
     def get_unique_ref_index(self,character):
         return self.unique_ref_index[f"{character['name']}({character['ref_id']})[{character['base_id']}]"]
 
+    def invalidate(self): # Call whenever self._characters changes
+        """Drop the cached views of the character database so they're rebuilt on next access"""
+        self.version += 1
+        self._views = {}
+
+    def cached_view(self, name, build):
+        """Return a cached view of the character database, building it first if the database changed since it was last built"""
+        if name not in self._views:
+            self._views[name] = build()
+        return self._views[name]
+
     @property
-    def characters(self):
+    def characters(self): # Named characters sorted by name - shared between callers, so don't modify the returned list
+        return self.cached_view("characters", self._build_characters)
+
+    def _build_characters(self):
         filtered = []
         for character in self._characters:
             if character['name'] != None and character['name'] != "" and str(character['name']).lower() != "nan":
@@ -188,13 +207,45 @@ class CharacterDB():
         sorted_characters = sorted(filtered, key=lambda x: str(x['name']))
         return sorted_characters
 
+    @property
+    def lower_named_index(self): # lowercase name -> character
+        return self.cached_view("lower_named_index", lambda: {str(character['name']).lower(): character for character in reversed(self.characters)}) # reversed so the first character with a name wins, like a search through self.characters would
+
+    @property
+    def name_matcher(self): # finds the names of characters in this database in a message
+        return self.cached_view("name_matcher", lambda: NameMatcher([character['name'] for character in self.characters]))
+
+    @property
+    def voice_model_index(self): # lowercase voice model -> characters using it, sorted by name
+        return self.cached_view("voice_model_index", lambda: self._build_lower_index('voice_model'))
+
+    @property
+    def voice_index(self): # lowercase voice folder or voice model -> characters using it as either, sorted by name
+        return self.cached_view("voice_index", lambda: self._build_lower_index('voice_folder', 'voice_model'))
+
+    @property
+    def voice_folder_order(self): # voice model -> its position in self.voice_folders
+        return self.cached_view("voice_folder_order", lambda: {voice_model: position for position, voice_model in enumerate(self.voice_folders)})
+
+    def _build_lower_index(self, *keys):
+        index = {}
+        for character in self.characters:
+            for key in keys:
+                value = str(character[key]).lower()
+                if value not in index:
+                    index[value] = []
+                if len(index[value]) == 0 or index[value][-1] is not character: # a character whose keys match each other is only listed once
+                    index[value].append(character)
+        return index
+
     def patch_character_info(self,info): # Patches information about a character into the character database and if db_type is json, saves the changes to the json file
         info = self.format_character(info)
         if info['name'] != None and info['name'] != "" and info['name'] != "nan":
             self._characters.append(info)
-            self.named_index[info['name']] = self.characters[-1]
-            self.base_id_index[info['base_id']] = self.characters[-1] 
-            self.ref_id_index[info['ref_id']] = self.characters[-1]
+            self.invalidate()
+            self.named_index[info['name']] = info
+            self.base_id_index[info['base_id']] = info
+            self.ref_id_index[info['ref_id']] = info
             if self.db_type == 'json':
                 if not os.path.exists(self.character_database_path): # If the directory doesn't exist, create it
                     os.makedirs(self.character_database_path) 
@@ -214,19 +265,18 @@ class CharacterDB():
             return None
         
     def get_character_by_voice_folder(self, voice_folder): # Look through non-generic characters for a character with the given voice folder
-        for character in self.characters:
-            if character['voice_model'].lower() == voice_folder.lower(): # If the voice model matches, return the character
-                return character
+        characters = self.voice_model_index.get(voice_folder.lower()) # If the voice model matches, return the character
+        if characters:
+            return characters[0]
         return None # If no character is found, return None
     
     def get_voice_folder_by_voice_model(self, voice_model):
         # logging.info(f"voice_model_ids: {voice_model}/{voice_model.replace(' ', '')}")
+        voice_folders = self.voice_folders
         folder = None
-        for voice_folder in self.voice_folders:
-            if voice_model == voice_folder:
-                folder = self.voice_folders[voice_folder]
-            if voice_model.replace(' ', '') == voice_folder:
-                folder = self.voice_folders[voice_folder]
+        matches = [key for key in (voice_model, voice_model.replace(' ', '')) if key in voice_folders]
+        if len(matches) > 0: # if both spellings have folders, the one listed last in self.voice_folders wins, same as scanning through it and keeping the last match
+            folder = voice_folders[max(matches, key=lambda key: self.voice_folder_order[key])]
         # logging.info(f"folder:",folder)
         if folder == None:
             folder = voice_model.replace(' ', '')
@@ -323,7 +373,7 @@ class CharacterDB():
         #         new_valid.append(voice)
         # self.valid = new_valid
         for voice in self.unused_voices:
-            for character in self.characters:
+            for character in self.voice_index.get(voice.lower(), []):
                 if character['voice_folder'] == voice or character['voice_model'] == voice:
                     logging.info(f"Character '{character['name']}' uses unused voice model '{voice}'")
         self.valid = list(set(self.valid)) # Bandaid fix for duplicate voice models
@@ -654,6 +704,9 @@ class CharacterDB():
         
     @property
     def male_voice_models(self):
+        return self.cached_view("male_voice_models", self._build_male_voice_models)
+
+    def _build_male_voice_models(self):
         valid = {}
         for character in self._characters:
             if character["gender"].capitalize() == "Male" and "Female" not in character["voice_model"]:
@@ -678,6 +731,9 @@ class CharacterDB():
     
     @property
     def female_voice_models(self):
+        return self.cached_view("female_voice_models", self._build_female_voice_models)
+
+    def _build_female_voice_models(self):
         valid = {}
         for character in self._characters:
             if character["gender"].capitalize() == "Female" and "Male" not in character["voice_model"]:
@@ -702,11 +758,13 @@ class CharacterDB():
     
     @property
     def all_voice_models(self):
-        models = []
+        return self.cached_view("all_voice_models", self._build_all_voice_models)
+
+    def _build_all_voice_models(self):
+        models = set()
         for character in self.characters:
             if character["voice_model"] != "":
-                if character["voice_model"] not in models:
-                    models.append(character["voice_model"])
+                models.add(character["voice_model"])
         models = [model for model in models if model != "" and model != "nan" and model != None]
         models = list(set(models))
         models = sorted(models)
@@ -714,11 +772,13 @@ class CharacterDB():
     
     @property
     def all_voice_formatted_models(self):
-        models = []
+        return self.cached_view("all_voice_formatted_models", self._build_all_voice_formatted_models)
+
+    def _build_all_voice_formatted_models(self):
+        models = set()
         for character in self.characters:
             if character["voice_model"] != "":
-                if character["voice_model"] not in models:
-                    models.append(character["voice_model"])
+                models.add(character["voice_model"])
         models = [model.replace(" ","") for model in models if model != "" and model != "nan" and model != None]
         models = list(set(models))
         models = sorted(models)
@@ -726,6 +786,9 @@ class CharacterDB():
         
     @property
     def voice_folders(self): # Returns a dictionary of voice models and their corresponding voice folders
+        return self.cached_view("voice_folders", self._build_voice_folders)
+
+    def _build_voice_folders(self):
         folders = {} 
         for character in self.characters:
             if character['voice_model'] != "":
@@ -744,11 +807,13 @@ class CharacterDB():
     
     @property
     def all_voice_folders(self):
-        folders = []
+        return self.cached_view("all_voice_folders", self._build_all_voice_folders)
+
+    def _build_all_voice_folders(self):
+        folders = set()
         for character in self.characters:
             if character['voice_folder'] != "":
-                if character['voice_folder'] not in folders:
-                    folders.append(character['voice_folder'])
+                folders.add(character['voice_folder'])
         folders = [folder for folder in folders if folder != "" and folder != "nan" and folder != None]
         folders = list(set(folders))
         folders = sorted(folders)
@@ -4,6 +4,7 @@ import os
 import src.memory_manager as mm
 import json
 import random
+from src.name_matcher import contains_name
 logging.info("Imported required libraries in base_character.py")
 
 manager_slug = "base"
@@ -312,17 +313,12 @@ class Character:
 
     def check_for_new_knows(self, msg, add_game_events=True):
         """Check if the message contains a new character that the character has met"""
-        valid_names = [character["name"] for character in self.conversation_manager.character_database.characters]
-        valid_names.append(self.conversation_manager.player_name)
-        valid_names = [name for name in valid_names if name != None]
-        valid_names = [name for name in valid_names if name not in self.language["banned_learnable_names"]]
-        lower_case_versions = [name.lower() for name in valid_names]
-        pairs = list(zip(valid_names, lower_case_versions))
-        msg_words = msg.split(" ")
-        for char in self.prompt_style["end_of_sentence_chars"] + [",", ":", ";"]:
-            msg_words = [word.replace(char, "") for word in msg_words]
-        for name, lower_case_name in pairs:
-            if name in msg_words or lower_case_name in msg_words:
+        found_names = self.conversation_manager.character_database.name_matcher.find(msg) # rebuilt only when the character database changes
+        player_name = self.conversation_manager.player_name
+        if player_name != None and player_name not in found_names and contains_name(msg, player_name):
+            found_names.append(player_name)
+        for name in found_names:
+            if name not in self.language["banned_learnable_names"]:
                 self.meet(name, add_game_events)
 
     def __str__(self):
@@ -812,6 +812,17 @@ class ConfigLoader:
                 "tts_engine": None, # ["piper_binary"]
                 "end_conversation_wait_time": 1,
                 "sentences_per_voiceline": 2,
+                "synthesis_workers": 1,
+                "synthesis_queue_depth": 2,
+                "voiceline_cache_enabled": True,
+                "voiceline_cache_max_size_mb": 1024,
+                "lip_sync_backend": "facefx",
+                "lip_sync_workers": 1,
+                "lip_cache_max_size_mb": 64,
+                "tts_http_connect_timeout": 5.0,
+                "tts_http_read_timeout": 600.0,
+                "tts_http_retries": 2,
+                "tts_http_list_cache_ttl": 60.0,
                 "narrator_voice": None,
                 "narrator_volume": 0.5, # 50% volume
                 "narrator_delay": 0.2, # 200ms delay
@@ -825,7 +836,9 @@ class ConfigLoader:
                 "play_audio_from_script": False,
                 "tts_boot_annoncements": True,
                 "add_voicelines_to_all_voice_folders": False,
-                "play_startup_announcement": True
+                "play_startup_announcement": True,
+                "log_level": "DEBUG",
+                "module_log_levels": {},
             },
             "Errors": {
                 "block_logs_from": [],
@@ -1008,6 +1021,17 @@ class ConfigLoader:
                 "tts_engine": self.tts_engine,
                 "end_conversation_wait_time": self.end_conversation_wait_time,
                 "sentences_per_voiceline": self.sentences_per_voiceline,
+                "synthesis_workers": self.synthesis_workers,
+                "synthesis_queue_depth": self.synthesis_queue_depth,
+                "voiceline_cache_enabled": self.voiceline_cache_enabled,
+                "voiceline_cache_max_size_mb": self.voiceline_cache_max_size_mb,
+                "lip_sync_backend": self.lip_sync_backend,
+                "lip_sync_workers": self.lip_sync_workers,
+                "lip_cache_max_size_mb": self.lip_cache_max_size_mb,
+                "tts_http_connect_timeout": self.tts_http_connect_timeout,
+                "tts_http_read_timeout": self.tts_http_read_timeout,
+                "tts_http_retries": self.tts_http_retries,
+                "tts_http_list_cache_ttl": self.tts_http_list_cache_ttl,
                 "narrator_voice": self.narrator_voice,
                 "narrator_volume": self.narrator_volume,
                 "narrator_delay": self.narrator_delay,
@@ -1022,6 +1046,8 @@ class ConfigLoader:
                 "tts_boot_annoncements": self.tts_boot_annoncements,
                 "add_voicelines_to_all_voice_folders": self.add_voicelines_to_all_voice_folders,
                 "play_startup_announcement": self.play_startup_announcement,
+                "log_level": self.log_level,
+                "module_log_levels": self.module_log_levels,
             },
             "Errors": {
                 "block_logs_from": self.block_logs_from,
@@ -8,6 +8,7 @@ import src.language_model as language_models
 import src.thought_process as thought_process
 import src.character_generator as character_generator
 import src.tts as tts
+from src.synthesis_executor import SynthesisExecutor
 from src.game_interfaces.base_interface import BaseGameInterface as GameInterface
 # from src.inference_engines.base_llm import base_LLM
 # import src.stt as stt
@@ -29,6 +30,7 @@ class BaseConversationManager:
         if self.config.ready:
             self.game_interface: GameInterface = game_interface.create_game_interface(self) # Create Game Interface based on config
             self.synthesizer = tts.create_Synthesizer(self, self.config.tts_engine) # Create Synthesizer object based on config - required by scripts for checking voice models, so is left out of self.pre_initialization() and self.post_initialization() intentionally
+            self.synthesis_executor = SynthesisExecutor(self) # Create the worker pool that synthesizes voicelines while the LLM keeps generating
             # self.character_database = character_db.CharacterDB(self) # Create Character Database Manager based on config - required by scripts for merging, patching and converting character databases, so is left out of self.pre_initialization() and self.post_initialization() intentionally
             self.character_database = character_db.create_DB(self) # Create Character Database Manager based on config - required by scripts for merging, patching and converting character databases, so is left out of self.pre_initialization() and self.post_initialization() intentionally
             self.character_manager: characters_manager.Characters = characters_manager.Characters(self) # Reset character manager
@@ -72,6 +74,7 @@ class BaseConversationManager:
             self.conversation_ended = True
             self.conversation_step = 0 # reset conversation step count
             self.game_interface.end_conversation() # end conversation in game with current active character
+            self.synthesis_executor.shutdown() # don't keep synthesizing or lip syncing lines nobody will hear
             logging.info('Conversation ended')
 
     def setup_character(self, character_info):
@@ -156,6 +159,8 @@ class BaseConversationManager:
         # self.config.set_prompt_style(self.inference_engine, self.tokenizer) # Set prompt based on LLM and config settings
         self.tokenizer.set_prompt_style(self.config._prompt_style)
         self.behavior_manager = behavior_manager.create_manager(self) # Create Behavior Manager based on config
+        if self.inference_engine is not None:
+            self.inference_engine.post_initialization() # Let the LLM prepare anything that depends on the thought process or character generator schemas
         
     def get_context(self): # Returns the current context(in the form of a list of messages) for the given active characters in the ongoing conversation
         if self.inference_engine is None:
@@ -176,6 +176,12 @@ class BaseGameInterface:
         duration = frames / float(rate) + self.wait_time_buffer
         return duration
 
+    def speaking_character(self, queue_output):
+        """Get the character who says a line from the sentence queue - lines are synthesized ahead of playback, so this can be someone other than the current active_character"""
+        if len(queue_output) > 2 and queue_output[2] is not None:
+            return queue_output[2]
+        return self.active_character
+
     async def send_audio_to_external_software(self, queue_output):
         """Send audio file to external software e.g. Skyrim, Fallout 4, etc."""
         logging.info(f"Dialogue to play: {queue_output[0]}")
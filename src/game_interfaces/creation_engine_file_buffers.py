@@ -217,7 +217,8 @@ class GameInterface(BaseGameInterface):
     @utils.time_it
     def save_files_to_voice_folders(self, queue_output):
         """Save voicelines and subtitles to the correct game folders"""
-        audio_file, subtitle = queue_output
+        audio_file, subtitle = queue_output[:2]
+        character = self.speaking_character(queue_output)
         if audio_file is None or subtitle is None or audio_file == '' or subtitle == '':
             logging.error(f"Error saving voiceline to voice folders. Audio file: {audio_file}, subtitle: {subtitle}")
             return
@@ -233,32 +234,42 @@ class GameInterface(BaseGameInterface):
                 subtitle += " Pantella2"
                 self.f4_use_wav_file1 = True
         if self.config.linux_mode:
-            wav_file_path = f"{self.mod_voice_dir}/{self.active_character.info['in_game_voice_model']}/{self.wav_file}"
-            lip_file_path = f"{self.mod_voice_dir}/{self.active_character.info['in_game_voice_model']}/{self.lip_file}"
+            wav_file_path = f"{self.mod_voice_dir}/{character.info['in_game_voice_model']}/{self.wav_file}"
+            lip_file_path = f"{self.mod_voice_dir}/{character.info['in_game_voice_model']}/{self.lip_file}"
             if self.game_id == "fallout4":
                 wav_file_path = f"{self.mod_voice_dir}/{wav_file_to_use}" # TODO: Find out why this is a single file??
         else:
-            wav_file_path = f"{self.mod_voice_dir}\\{self.active_character.info['in_game_voice_model']}\\{self.wav_file}"
-            lip_file_path = f"{self.mod_voice_dir}\\{self.active_character.info['in_game_voice_model']}\\{self.lip_file}"
+            wav_file_path = f"{self.mod_voice_dir}\\{character.info['in_game_voice_model']}\\{self.wav_file}"
+            lip_file_path = f"{self.mod_voice_dir}\\{character.info['in_game_voice_model']}\\{self.lip_file}"
             if self.game_id == "fallout4":
                 wav_file_path = f"{self.mod_voice_dir}\\{wav_file_to_use}" # TODO: Find out why this is a single file??
         if self.add_voicelines_to_all_voice_folders:
             logging.info(f"Adding voicelines to all voice folders")
+            # the files are copied out of Pantella's data folder once, every other voice folder gets a hard link to that copy (or a copy of it where hard links aren't supported)
+            shared_wav_file = None
+            shared_lip_file = None
             for sub_folder in os.scandir(self.mod_voice_dir):
                 if sub_folder.is_dir():
                     #copy both the wav file and lip file if the game isn't Fallout4
                     if self.config.linux_mode:
-                        logging.info(f"Copying voiceline to {sub_folder.path}/{self.wav_file}")
-                        shutil.copyfile(audio_file, f"{sub_folder.path}/{self.wav_file}")
+                        sub_wav_file = f"{sub_folder.path}/{self.wav_file}"
+                        sub_lip_file = f"{sub_folder.path}/{self.lip_file}"
+                        sub_f4_lip_file = f"{sub_folder.path}/{self.f4_lip_file}"
                     else:
-                        logging.info(f"Copying voiceline to {sub_folder.path}\\{self.wav_file}")
-                        shutil.copyfile(audio_file, f"{sub_folder.path}\\{self.wav_file}")
-                    if self.config.linux_mode:
-                        shutil.copyfile(audio_file.replace(".wav", ".lip"), f"{sub_folder.path}/{self.lip_file}")
-                        shutil.copyfile(audio_file.replace(".wav", ".lip"), f"{sub_folder.path}/{self.f4_lip_file}")
+                        sub_wav_file = f"{sub_folder.path}\\{self.wav_file}"
+                        sub_lip_file = f"{sub_folder.path}\\{self.lip_file}"
+                        sub_f4_lip_file = f"{sub_folder.path}\\{self.f4_lip_file}"
+                    if shared_wav_file is None:
+                        logging.info(f"Copying voiceline to {sub_wav_file}")
+                        utils.copy_file(audio_file, sub_wav_file)
+                        utils.copy_file(audio_file.replace(".wav", ".lip"), sub_lip_file)
+                        shared_wav_file = sub_wav_file
+                        shared_lip_file = sub_lip_file
                     else:
-                        shutil.copyfile(audio_file.replace(".wav", ".lip"), f"{sub_folder.path}\\{self.lip_file}")
-                        shutil.copyfile(audio_file.replace(".wav", ".lip"), f"{sub_folder.path}\\{self.f4_lip_file}")
+                        logging.info(f"Linking voiceline to {sub_wav_file}")
+                        utils.link_or_copy(shared_wav_file, sub_wav_file)
+                        utils.link_or_copy(shared_lip_file, sub_lip_file)
+                    utils.link_or_copy(shared_lip_file, sub_f4_lip_file)
         else:
             logging.info(f"Copying voiceline to {wav_file_path}")
             shutil.copyfile(audio_file, wav_file_path)
@@ -270,8 +281,8 @@ class GameInterface(BaseGameInterface):
                 default_lip_file = utils.resolve_path()+'/data/default.lip'
                 shutil.copyfile(default_lip_file, f"{lip_file_path}")
 
-        logging.info(f"{self.active_character.name} should speak")
-        actor_number = self.active_character.info['actor_number']
+        logging.info(f"{character.name} should speak")
+        actor_number = character.info['actor_number']
         say_line_file = '_pantella_say_line_'+str(actor_number)
         logging.info(f"Voiceline File Buffer: _pantella_say_line_{actor_number}")
         self.write_game_info(say_line_file, subtitle.strip())
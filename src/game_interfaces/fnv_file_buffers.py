@@ -69,32 +69,46 @@ class GameInterface(CreationEngineFileBuffersInterface):
     @utils.time_it
     def save_files_to_voice_folders(self, queue_output):
         """Save voicelines and subtitles to the correct game folders"""
-        audio_file, subtitle = queue_output
+        audio_file, subtitle = queue_output[:2]
+        character = self.speaking_character(queue_output)
         if audio_file is None or subtitle is None or audio_file == '' or subtitle == '':
             logging.error(f"Error saving voiceline to voice folders. Audio file: {audio_file}, subtitle: {subtitle}")
             return
-        # logging.debug(f"Saving files to voice folders for character:", self.active_character.info)
+        # logging.debug(f"Saving files to voice folders for character:", character.info)
         if self.config.linux_mode:
-            ogg_file_path = f"{self.mod_voice_dir}/{self.active_character.info['in_game_voice_model']}/{self.ogg_file}"
-            lip_file_path = f"{self.mod_voice_dir}/{self.active_character.info['in_game_voice_model']}/{self.lip_file}"
+            ogg_file_path = f"{self.mod_voice_dir}/{character.info['in_game_voice_model']}/{self.ogg_file}"
+            lip_file_path = f"{self.mod_voice_dir}/{character.info['in_game_voice_model']}/{self.lip_file}"
         else:
-            ogg_file_path = f"{self.mod_voice_dir}\\{self.active_character.info['in_game_voice_model']}\\{self.ogg_file}"
-            lip_file_path = f"{self.mod_voice_dir}\\{self.active_character.info['in_game_voice_model']}\\{self.lip_file}"
+            ogg_file_path = f"{self.mod_voice_dir}\\{character.info['in_game_voice_model']}\\{self.ogg_file}"
+            lip_file_path = f"{self.mod_voice_dir}\\{character.info['in_game_voice_model']}\\{self.lip_file}"
         if self.add_voicelines_to_all_voice_folders:
             logging.info(f"Adding voicelines to all voice folders")
+            # the voiceline is only encoded to ogg once, every other voice folder gets a hard link to it (or a copy of it where hard links aren't supported)
+            shared_ogg_file = None
+            shared_lip_file = None
             for sub_folder in os.scandir(self.mod_voice_dir):
                 if sub_folder.is_dir():
                     #copy both the wav file and lip file if the game isn't Fallout4
                     out_path = f"{sub_folder.path}\\{self.ogg_file}"
+                    out_lip_path = f"{sub_folder.path}\\{self.lip_file}"
                     if self.config.linux_mode:
                         out_path = f"{sub_folder.path}/{self.ogg_file}"
-                    logging.info(f"Copying voiceline to {out_path}")
-                    # shutil.copyfile(audio_file, out_path)
-                    convert_wav_to_ogg(audio_file, out_path)
-                    if self.config.linux_mode:
-                        shutil.copyfile(audio_file.replace(".wav", ".lip"), f"{sub_folder.path}/{self.lip_file}")
+                        out_lip_path = f"{sub_folder.path}/{self.lip_file}"
+                    if shared_ogg_file is None:
+                        logging.info(f"Converting and sending voiceline to {out_path}")
+                        if os.path.exists(out_path): # don't write through a link left by the last voiceline
+                            os.remove(out_path)
+                        convert_wav_to_ogg(audio_file, out_path)
+                        if os.path.exists(out_path): # if the conversion failed, try again for the next folder
+                            shared_ogg_file = out_path
+                    else:
+                        logging.info(f"Linking voiceline to {out_path}")
+                        utils.link_or_copy(shared_ogg_file, out_path)
+                    if shared_lip_file is None:
+                        utils.copy_file(audio_file.replace(".wav", ".lip"), out_lip_path)
+                        shared_lip_file = out_lip_path
                     else:
-                        shutil.copyfile(audio_file.replace(".wav", ".lip"), f"{sub_folder.path}\\{self.lip_file}")
+                        utils.link_or_copy(shared_lip_file, out_lip_path)
         else:
             logging.info(f"Converting and sending voiceline to {ogg_file_path}")
             # shutil.copyfile(audio_file, ogg_file_path)
@@ -107,8 +121,8 @@ class GameInterface(CreationEngineFileBuffersInterface):
                 default_lip_file = utils.resolve_path()+'/data/default.lip'
                 shutil.copyfile(default_lip_file, f"{lip_file_path}")
 
-        logging.info(f"{self.active_character.name} should speak")
-        actor_number = self.active_character.info['actor_number']
+        logging.info(f"{character.name} should speak")
+        actor_number = character.info['actor_number']
         say_line_file = '_pantella_say_line_'+str(actor_number)
         logging.info(f"Voiceline File Buffer: _pantella_say_line_{actor_number}")
         self.write_game_info(say_line_file, subtitle.strip())
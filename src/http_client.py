@@ -0,0 +1,90 @@
+print("Importing http_client.py")
+from src.logging import logging, time
+import threading
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+logging.info("Imported required libraries in http_client.py")
+
+class HTTPClient:
+    """A pooled requests session for talking to one TTS server.
+
+    Connections are kept alive between requests instead of a new one being opened for every sentence, every request has a timeout, requests that fail to connect are retried with a short backoff (only failures to connect, so a synthesis request is never sent twice), and the latency of every request is counted per endpoint. Small responses that rarely change, like voice and model lists, can be kept for a few seconds with cached()."""
+    def __init__(self, name, config, pool_size=4):
+        self.name = name
+        self.timeout = (config.tts_http_connect_timeout, config.tts_http_read_timeout)
+        self.list_cache_ttl = config.tts_http_list_cache_ttl
+        retries = max(0, int(config.tts_http_retries))
+        retry = Retry(total=retries, connect=retries, read=0, status=0, other=0, backoff_factor=0.25, allowed_methods=None, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, int(pool_size)), max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.latencies = {} # "METHOD /path" -> [requests, errors, total seconds, slowest seconds]
+        self.cache = {} # key -> (expiry time, value)
+        self.lock = threading.Lock()
+
+    def request(self, method, url, timeout=None, **kwargs):
+        start = time.time()
+        try:
+            response = self.session.request(method, url, timeout=timeout if timeout is not None else self.timeout, **kwargs)
+        except Exception:
+            self._record(method, url, time.time() - start, True)
+            raise
+        self._record(method, url, time.time() - start, response.status_code >= 400)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def _record(self, method, url, elapsed, error):
+        endpoint = f"{method} {urlparse(url).path}"
+        with self.lock:
+            counter = self.latencies.setdefault(endpoint, [0, 0, 0.0, 0.0])
+            counter[0] += 1
+            counter[1] += 1 if error else 0
+            counter[2] += elapsed
+            counter[3] = max(counter[3], elapsed)
+        logging.debug(f"{self.name} - {endpoint} took {round(elapsed * 1000, 1)} ms")
+
+    def cached(self, key, fetch, ttl=None):
+        """Get the value fetch() returned for key less than ttl seconds ago (tts_http_list_cache_ttl by default), or call fetch() again - values that are None aren't kept, so failed requests are retried next time"""
+        ttl = self.list_cache_ttl if ttl is None else ttl
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and entry[0] > time.time():
+                return entry[1]
+        value = fetch()
+        if value is not None and ttl > 0:
+            with self.lock:
+                self.cache[key] = (time.time() + ttl, value)
+        return value
+
+    def invalidate(self, *keys):
+        """Forget cached values, or all of them if no keys are given"""
+        with self.lock:
+            if len(keys) == 0:
+                self.cache.clear()
+            for key in keys:
+                self.cache.pop(key, None)
+
+    def stats(self):
+        """Request count, error count, and average and slowest latency in milliseconds for every endpoint used so far"""
+        with self.lock:
+            return {endpoint: {
+                "requests": counter[0],
+                "errors": counter[1],
+                "average_ms": round(counter[2] / counter[0] * 1000, 1),
+                "slowest_ms": round(counter[3] * 1000, 1),
+            } for endpoint, counter in self.latencies.items()}
+
+    def log_stats(self):
+        for endpoint, stats in self.stats().items():
+            logging.info(f"{self.name} - {endpoint}: {stats['requests']} requests, {stats['errors']} errors, {stats['average_ms']} ms average, {stats['slowest_ms']} ms slowest")
+
+    def close(self):
+        self.session.close()
@@ -1,6 +1,8 @@
 print("Importing base_LLM.py")
 from src.logging import logging, time
 import src.utils as utils
+from src.sentence_segmenter import SentenceSegmenter, ReplyBuilder
+from src.streaming_json import StreamingJSONParser
 import re
 import unicodedata
 import time
@@ -9,6 +11,9 @@ import traceback
 import base64
 import json
 import urllib.request
+import asyncio
+import threading
+import concurrent.futures
 import numpy as np
 from PIL import Image
 from pydantic import BaseModel, Field
@@ -72,6 +77,71 @@ def image_to_base64(image: Image) -> str:
     image_base64 = base64.b64encode(image_bytes).decode("utf-8")
     return image_base64
 
+class AsyncTokenIterator():
+    """Runs a blocking token generator on a worker thread and exposes it as an async iterator, so the event loop stays free while the LLM decodes.
+
+    At most `max_buffered_tokens` tokens are buffered before the worker waits for the consumer to catch up. aclose() stops the worker after the token it's currently decoding, closes the generator and waits for the worker to exit."""
+    _end_of_stream = object()
+
+    def __init__(self, generator, max_buffered_tokens=64):
+        self.generator = generator
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_buffered_tokens)
+        self.cancelled = threading.Event()
+        self.finished = False
+        self.thread = threading.Thread(target=self._run, name="pantella_llm_stream", daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        """Hand an item to the event loop, waiting while the queue is full - returns False if the stream was cancelled first"""
+        future = asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop)
+        while True:
+            try:
+                future.result(timeout=0.1)
+                return True
+            except concurrent.futures.TimeoutError:
+                if self.cancelled.is_set():
+                    future.cancel()
+                    return False
+
+    def _run(self):
+        error = None
+        try:
+            for token in self.generator:
+                if self.cancelled.is_set() or not self._put((token, None)):
+                    break
+        except Exception as e:
+            error = e
+            logging.error(f"Error streaming tokens from LLM: {e}")
+        finally:
+            if hasattr(self.generator, "close"):
+                self.generator.close() # runs the generator's cleanup on the thread that was driving it
+        if not self.cancelled.is_set():
+            self._put((self._end_of_stream, error))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.finished:
+            raise StopAsyncIteration
+        token, error = await self.queue.get()
+        if token is self._end_of_stream:
+            self.finished = True
+            if error is not None:
+                raise error
+            raise StopAsyncIteration
+        return token
+
+    async def aclose(self):
+        """Stop generating and wait for the worker thread to exit, so nothing the generator yielded is still being changed by it afterwards - safe to call more than once"""
+        self.finished = True
+        self.cancelled.set()
+        while not self.queue.empty(): # unblock a worker waiting on a full queue
+            self.queue.get_nowait()
+        if self.thread.is_alive():
+            await asyncio.to_thread(self.thread.join) # the worker can be in the middle of decoding a token, wait for it without blocking the event loop
+
 class TestCoT(BaseModel):
     """A simple test request for CoT support"""
     test: bool
@@ -214,6 +284,10 @@ class base_LLM():
         #     "notes": "null"
         # }
 
+    def post_initialization(self):
+        """Called once the conversation manager has created the thought process and character generator schemas - override to prepare anything that depends on them"""
+        pass
+
     def get_cot_supported(self):
         """Check if the LLM supports CoT (Chain of Thought) completions"""
         return self.cot_supported
@@ -279,6 +353,10 @@ class base_LLM():
     def game_interface(self):
         return self.conversation_manager.game_interface
 
+    @property
+    def synthesis_executor(self):
+        return self.conversation_manager.synthesis_executor
+
     @property
     def maximum_local_tokens(self):
         return self.config.maximum_local_tokens
@@ -640,8 +718,6 @@ class base_LLM():
         logging.info(f"Getting messages from conversation manager")
         system_prompt = self.character_manager.get_system_prompt() # get system prompt
         system_prompt_message = {'role': "system", 'content': system_prompt, "type":"prompt"}
-        system_prompt_message_token_count = self.conversation_manager.tokenizer.get_token_count_of_message(system_prompt_message)
-        system_prompt_message["token_count"] = system_prompt_message_token_count
         msgs = [system_prompt_message] # add system prompt to context
         msgs.extend(self.messages) # add messages to context
 
@@ -663,9 +739,13 @@ class base_LLM():
                 "content": schema_description,
                 "type": "prompt"
             }
-            schema_message_token_count = self.conversation_manager.tokenizer.get_token_count_of_message(schema_message)
-            schema_message["token_count"] = schema_message_token_count
             msgs.append(schema_message) # add schema description to context at the end of the messages
+
+        uncounted_msgs = [msg for msg in msgs if "token_count" not in msg] # count the tokens of the prompts and any messages missing a count in one batch
+        if len(uncounted_msgs) > 0:
+            token_counts = self.conversation_manager.tokenizer.get_token_counts_of_messages(uncounted_msgs)
+            for msg, token_count in zip(uncounted_msgs, token_counts):
+                msg["token_count"] = token_count
         
         logging.debug("Messages List:", json.dumps(msgs, indent=4))
         logging.info(f"Messages: {len(msgs)}")
@@ -864,169 +944,28 @@ class base_LLM():
                 formatted_messages = formatted_messages[:depth] + [image_message] + formatted_messages[depth:] # Add the image message to the context
         return formatted_messages
     
+    def astream(self, generator):
+        """Wrap a blocking token generator (e.g. the one returned by acreate()) in an async iterator that's driven from a worker thread - must be called from inside the running event loop"""
+        return AsyncTokenIterator(generator)
+
+    def agenerate_response(self, message_prefix="", force_speaker=None):
+        """Async version of generate_response() - building the context, streaming from acreate() and parsing CoT JSON all happen off of the event loop"""
+        return self.astream(self.generate_response(message_prefix=message_prefix, force_speaker=force_speaker))
+
     def generate_response(self, message_prefix="", force_speaker=None):
         """Generate response from LLM one text chunk at a time"""
         logging.info(f"Generating response from LLM with message prefix '{message_prefix}' and force speaker '{force_speaker}'")
         if self.cot_supported and self.cot_enabled and self.conversation_manager.thought_process is not None:
             print("Generating CoT response...")
-            raw_response = ""
-            response_json = {}
-            last_diff_json = {}
+            parser = StreamingJSONParser()
             for chunk in self.acreate(self.get_context(), message_prefix=message_prefix, force_speaker=force_speaker):
                 # logging.debug(f"Raw Chunk:",chunk)
                 formatted_chunk = self.format_content(chunk)
-                raw_response += formatted_chunk
-
-                special_characters = [
-                    "{",
-                    "}",
-                    "[",
-                    "]",
-                ]
-                raw_special_character_list = ""
-                for character in raw_response:
-                    if character in special_characters:
-                        raw_special_character_list += character
-                
-                reflection_characters = list(raw_special_character_list)
-                reflection_characters.reverse()
-                response_ending = ""
-                left_bracket_ignore = 0 
-                left_square_bracket_ignore = 0
-                for character in reflection_characters:
-                    if character == "{":
-                        if left_bracket_ignore > 0:
-                            left_bracket_ignore -= 1
-                        else:
-                            response_ending = response_ending + "}"
-                    elif character == "}":
-                        left_bracket_ignore += 1
-                    elif character == "[":
-                        if left_square_bracket_ignore > 0:
-                            left_square_bracket_ignore -= 1
-                        else:
-                            response_ending = response_ending + "]"
-                    elif character == "]":
-                        left_square_bracket_ignore += 1
-
-                diff_json = {}
-
-                def parse_list(new_json, orig_json):
-                    res_json = {}
-                    for i in range(len(new_json)):
-                        if type(new_json[i]) == list and len(new_json[i]) > 0:
-                            if i < len(orig_json):
-                                if new_json[i] != orig_json[i]:
-                                    # res_json.append(parse_list(new_json[i], orig_json[i]))
-                                    res_json[i] = parse_list(new_json[i], orig_json[i])
-                            else:
-                                # res_json.append(new_json[i])
-                                res_json[i] = new_json[i]
-                        elif type(new_json[i]) == dict:
-                            if i < len(orig_json):
-                                if new_json[i] != orig_json[i]:
-                                    # res_json.append(parse_dict(new_json[i], orig_json[i]))
-                                    res_json[i] = parse_dict(new_json[i], orig_json[i])
-                            else:
-                                # res_json.append(new_json[i])
-                                # res_json[i] = new_json[i]
-                                res_json[i] = {}
-                                for key in new_json[i]:
-                                    if key not in orig_json[i]:
-                                        res_json[i][key] = new_json[i][key]
-                        else:
-                            if i < len(orig_json):
-                                if type(new_json[i]) == str:
-                                    # res_json.append(new_json[i][len(orig_json[i]):])
-                                    # if res_json[-1] == "":
-                                    #     res_json.pop()
-                                    string_new = str(new_json[i])
-                                    string_orig = str(orig_json[i])
-                                    string_diff = string_new[len(string_orig):]
-                                    if string_diff != "":
-                                        res_json[i] = string_diff
-                                else:
-                                    string_new = str(new_json[i])
-                                    string_orig = str(orig_json[i])
-                                    string_diff = string_new[len(string_orig):]
-                                    # if string_diff != "":
-                                    #     res_json.append(type(orig_json[i])(string_diff))
-                                    # else:
-                                    #     res_json.append(orig_json[i])
-                                    if string_diff != "":
-                                        res_json[i] = type(orig_json[i])(string_diff)
-                            else:
-                                # res_json.append(new_json[i])
-                                res_json[i] = new_json[i]
-                    return res_json
-
-                def parse_dict(new_json, orig_json):
-                    # print("New JSON:",new_json)
-                    # print("Orig JSON:",orig_json)
-                    res_json = {}
-                    for key in new_json:
-                        if type(new_json[key]) == list and len(new_json[key]) > 0:
-                            if key in orig_json: # key in orig_json
-                                if new_json[key] != orig_json[key]:
-                                    res_json[key] = parse_list(new_json[key], orig_json[key])
-                            else: # key not in orig_json
-                                res_json[key] = new_json[key]
-                        elif type(new_json[key]) == dict: # key is a dictionary
-                            if key in orig_json: # key in orig_json
-                                if new_json[key] != orig_json[key]:
-                                    res_json[key] = parse_dict(new_json[key], orig_json[key])
-                            else: # key not in orig_json
-                                res_json[key] = {}
-                                for sub_key in new_json[key]:
-                                    if key not in orig_json:
-                                        res_json[key][sub_key] = new_json[key][sub_key]
-
-                        else:
-                            if key in orig_json: # key in orig_json
-                                if type(new_json[key]) == str: # key is a string 
-                                    res_json[key] = new_json[key][len(orig_json[key]):]
-                                    if res_json[key] == "":
-                                        del res_json[key]
-                                else: # key is a number
-                                    string_new = str(new_json[key])
-                                    string_orig = str(orig_json[key])
-                                    string_diff = string_new[len(string_orig):]
-                                    if string_diff != "":
-                                        res_json[key] = type(orig_json[key])(string_diff)
-                                    else:
-                                        del res_json[key]
-                            else: # key not in orig_json
-                                res_json[key] = new_json[key]
-                    return res_json
-
-                reference_response = str(raw_response).strip()
-
-                if reference_response.endswith(","):
-                    reference_response = reference_response[:-1]
-                try:
-                    new_response_json = json.loads(reference_response)
-                except:
-                    try:
-                        new_response_json = json.loads(reference_response+response_ending)
-                    except:
-                        try:
-                            new_response_json = json.loads(reference_response+"\""+response_ending)
-                        except:
-                            # logging.error(f"Could not parse JSON from response: {reference_response}")
-                            # logging.debug(f"Response Ending: {response_ending}")
-                            new_response_json = {}
-                
-                if new_response_json != response_json:
-                    diff_json = parse_dict(new_response_json, response_json)
-                # else:
-                #     logging.info("No new JSON found.")
-                response_json = new_response_json
-                        
-                if diff_json != {} and diff_json != last_diff_json:
-                    last_diff_json = diff_json
+                diff_json = parser.feed(formatted_chunk) # only the fields that changed in this chunk, e.g. {"response_to_user": " Hello"}
+                if diff_json != {}:
                     yield {
                         "chunk": diff_json,
-                        "complete_json": new_response_json,
+                        "complete_json": parser.value, # updated in place as the response streams in, only read it after the stream is closed
                     }
         else:
             print("Generating normal response...")
@@ -1200,6 +1139,8 @@ class base_LLM():
         logging.info(f"Bad Author Retries Available: {bad_author_retries}")
         logging.info(f"System Loops Available: {system_loop}")
 
+        self.synthesis_executor.start(sentence_queue, event) # voicelines are synthesized on worker threads from here on while the LLM keeps generating
+
         symbol_insert=""
         if self.conversation_manager.conversation_step == 1:
             first_message_hidden_symbol = self.conversation_manager.character_manager.language["first_message_hidden_symbol"]
@@ -1213,6 +1154,9 @@ class base_LLM():
                 logging.info(f"Symbol to Insert: {symbol_insert}")
 
 
+        roleplay_symbols = [self._prompt_style["roleplay_prefix"],self._prompt_style["roleplay_suffix"]]+self._prompt_style["roleplay_prefix_aliases"]+self._prompt_style["roleplay_suffix_aliases"]
+        segmenter = SentenceSegmenter(self.end_of_sentence_chars, roleplay_symbols, self.replacements, self.stop, self.EOS_token, self.message_signifier) # scans each chunk for end of sentence characters, roleplay symbols, stop strings and the EOS token
+        token_stream = None
         while retries >= 0: # keep trying to connect to the API until it works
             # if full_reply != '': # if the full reply is not empty, then the LLM has generated a response and the next_author should be extracted from the start of the generation
             #     self.conversation_manager.new_message({"role": next_author, "content": full_reply})
@@ -1225,7 +1169,7 @@ class base_LLM():
             #     retries = 5
             try:
                 # Reset variables every retry
-                proposed_next_author = '' # used to store the proposed next author
+                segmenter.reset() # clears the raw reply and the proposed next author
                 if not self.prefill_supported:
                     logging.warning(f"Completions are not supported by the current LLM. There might be more regenerations and errors because of this as we don't have full control over the exact prompt that is sent to the LLM.")
                     force_speaker = None
@@ -1236,7 +1180,7 @@ class base_LLM():
                         if force_speaker is not None: # Force speaker to a specific character
                             logging.info(f"Forcing speaker to: {force_speaker.name}")
                             next_author = force_speaker.name
-                            proposed_next_author = next_author
+                            segmenter.proposed_next_author = next_author
                             verified_author = True
                         elif self.conversation_manager.character_manager.active_character_count() == 1: # if there is only one active character, then the next author should most likely always be the only active character
                             default_author = list(self.conversation_manager.character_manager.active_characters.values())[0]
@@ -1244,7 +1188,7 @@ class base_LLM():
                                 default_author = self.conversation_manager.game_interface.active_character
                             logging.info(f"Only one active character. Attempting to force speaker to: {default_author.name}")
                             next_author = default_author.name
-                            proposed_next_author = next_author
+                            segmenter.proposed_next_author = next_author
                             verified_author = True
                             force_speaker = default_author
                 start_time = time.time()
@@ -1252,14 +1196,12 @@ class base_LLM():
                 last_chunk = None
                 same_chunk_count = 0
                 new_speaker = False
-                eos = False 
                 typing_roleplay = self._prompt_style["roleplay_inverted"]
                 if symbol_insert == self._prompt_style["roleplay_prefix"] or symbol_insert == self._prompt_style["roleplay_suffix"] or symbol_insert in self._prompt_style["roleplay_prefix_aliases"] or symbol_insert in self._prompt_style["roleplay_suffix_aliases"]:
                     typing_roleplay = not typing_roleplay
                 was_typing_roleplay = typing_roleplay
         
-                raw_reply = '' # used to store the raw reply
-                full_reply = '' # used to store the full reply
+                full_reply = ReplyBuilder() # used to store the full reply
 
                 voice_line = '' # used to store the current voice line being generated
                 sentence = '' # used to store the current sentence being generated
@@ -1279,7 +1221,8 @@ class base_LLM():
                 logging.debug(f"was_typing_roleplay: {was_typing_roleplay}")
                 logging.debug(f"currently_typing_roleplay: {typing_roleplay}")
                 logging.info(f"Starting response generation...")
-                for chunk in self.generate_response(message_prefix=symbol_insert, force_speaker=force_speaker):
+                token_stream = self.agenerate_response(message_prefix=symbol_insert, force_speaker=force_speaker)
+                async for chunk in token_stream:
                     if self.cot_enabled and self.cot_supported and self.conversation_manager.thought_process is not None:
                         if self.cot_enabled and self.cot_supported and self.conversation_manager.thought_process is not None:
                             full_json = chunk["complete_json"]
@@ -1312,19 +1255,11 @@ class base_LLM():
                     last_chunk = content
                     if content is None:
                         continue
-                    if eos: # if the EOS token has been detected, then the generation should stop
+                    if segmenter.eos: # if the EOS token has been detected, then the generation should stop
                         logging.info(f"EOS token detected. Stopping generation.")
                         break
 
-                    raw_reply += content
-
-                    # EOS token detection
-                    if self.EOS_token in raw_reply:
-                        logging.info(f"Sentence contains EOS token. Stopping generation.")
-                        eos = True
-                    elif self.EOS_token.lower() in raw_reply.lower():
-                        logging.info(f"Sentence probably contains EOS token(determined by lower() checking.). Stopping generation.")
-                        eos = True
+                    chunk_event = segmenter.feed(content) # adds the content to the raw reply and checks the new characters for the EOS token, end of sentence characters and roleplay symbols
 
                     def raise_invalid_author(retries, bad_author_retries):
                         logging.info(f"Next author is None. Failed to extract author from: {sentence}")
@@ -1339,40 +1274,19 @@ class base_LLM():
                             raise Exception('Invalid author')
                         return next_author, retries, bad_author_retries
 
-                    contains_end_of_sentence_character = any(char in unicodedata.normalize('NFKC', content) for char in self.end_of_sentence_chars)
-                    contains_roleplay_symbol = any(char in unicodedata.normalize('NFKC', content) for char in [self._prompt_style["roleplay_prefix"],self._prompt_style["roleplay_suffix"]]+self._prompt_style["roleplay_prefix_aliases"]+self._prompt_style["roleplay_suffix_aliases"])
-                    for replacement in self.replacements:
-                        char, replacement_char = replacement["char"], replacement["replacement"]
-                        if char in content:
-                            logging.debug(f"Replacement character '{char}' found in sentence: '{content}'")
-                            logging.debug("Replacement Characters:",self.replacements)
-                            content = content.replace(char, replacement_char)
+                    contains_end_of_sentence_character = chunk_event.end_of_sentence
+                    contains_roleplay_symbol = chunk_event.roleplay_symbol
+                    content = chunk_event.content # content with replacements applied
                     # Propose Author or Write their response
                     if next_author is None: # if next_author is None after generating a chunk of content, then the LLM didn't choose a character to speak next yet.
-                        proposed_next_author += content
-                        if self.message_signifier in proposed_next_author: # if the proposed next author contains the message signifier, then the next author has been chosen
-                            sentence, next_author, verified_author, retries, bad_author_retries, system_loop = self.check_author(proposed_next_author, next_author, verified_author, possible_players, retries, bad_author_retries, system_loop)
+                        if segmenter.propose_author(content): # if the proposed next author contains the message signifier, then the next author has been chosen
+                            sentence, next_author, verified_author, retries, bad_author_retries, system_loop = self.check_author(segmenter.proposed_next_author, next_author, verified_author, possible_players, retries, bad_author_retries, system_loop)
                             if next_author is not None:
-                                raw_reply = raw_reply.split(self.message_signifier, 1)[1]
+                                segmenter.author_found()
                         if (contains_end_of_sentence_character or contains_roleplay_symbol) and next_author is None:
                             next_author, retries, bad_author_retries = raise_invalid_author(retries, bad_author_retries)
                     else: # if the next author is already chosen, then the LLM is generating the response for the next author
-                        sentence += content # add the content to the sentence in progress
-                        logging.debug(f"Sentence in progress: {sentence}")
-                        for replacement in self.replacements:
-                            char, replacement_char = replacement["char"], replacement["replacement"]
-                            if char in sentence:
-                                logging.debug(f"Replacement character '{char}' found in sentence: {sentence}")
-                                logging.debug("Replacement Characters:",self.replacements)
-                                sentence = sentence.replace(char, replacement_char)
-                        for char in self.stop:
-                            if char in sentence:
-                                logging.debug(f"Banned character '{char}' found in sentence: {sentence}")
-                                logging.debug("Banned Characters:",self.stop)
-                                eos = True
-                                sentence = sentence.split(char)[0]
-                                raw_reply = raw_reply.split(char)[0]
-                                logging.info(f"Trimming last sentence to: {sentence}")
+                        sentence = segmenter.append_to_sentence(sentence, content) # add the content to the sentence in progress, applying replacements and stopping at stop strings
                         if self.config.assist_check and 'assist' in sentence and num_sentences > 0: # if remote, check if the response contains the word assist for some reason. Probably some OpenAI nonsense.# Causes problems if asking a follower if you should "assist" someone, if they try to say something along the lines of "Yes, we should assist them." it will cut off the sentence and basically ignore the player. TODO: fix this with a more robust solution
                             logging.info(f"'assist' keyword found. Ignoring sentence which begins with: {sentence}") 
                             break # stop generating response
@@ -1380,9 +1294,9 @@ class base_LLM():
                             logging.info(f"Breaking on time announcement")
                             break
 
+                    eos = segmenter.eos
                     if eos: # remove the EOS token from the sentence and trim the sentence to the EOS token's position
-                        sentence = sentence.split(self.EOS_token)[0]
-                        raw_reply = raw_reply.split(self.EOS_token)[0]
+                        sentence = segmenter.trim_to_eos(sentence)
                         
                     # contains_banned_character = any(char in content for char in self.stop)
                     effective_voice_line_sentences = int(voice_line_sentences)
@@ -1431,7 +1345,7 @@ class base_LLM():
                         logging.debug(f"toggled currently_typing_roleplay: {typing_roleplay}")
                         
                         if typing_roleplay:
-                            full_reply = full_reply.strip() +"[ns-1]"+ self._prompt_style["roleplay_prefix"]
+                            full_reply.append("[ns-1]", self._prompt_style["roleplay_prefix"])
                         
                         if effective_voice_line_sentences > 0 or len(voice_line) > 0: # if the sentence is not empty and the number of sentences is greater than 0, then the narrator is speaking
                             logging.info(f"Speaker changed")
@@ -1487,31 +1401,30 @@ class base_LLM():
                                 logging.info(f"Behavior(s) triggered: {behavior.keyword}")
                         if not new_speaker:
                             sentence = self.clean_sentence(sentence) # clean the sentence
-                        logging.info(f"Full Reply Before: {full_reply}")
+                        logging.info(f"Full Reply Before:", full_reply) # not an f-string, so the full reply is only joined together if the log is shown
                         logging.info(f"Sentence: {sentence}")
 
                         voice_line = voice_line.strip() + " " + sentence.strip() # add the sentence to the voice line in progress
-                        full_reply = full_reply.strip()
-                        if len(full_reply) > 0 and (not full_reply.endswith(self._prompt_style["roleplay_suffix"]) and not full_reply.endswith(self._prompt_style["roleplay_prefix"])): # if the full reply is not empty and the last character is not a roleplay symbol, then just add the sentence with a space
-                            full_reply = full_reply.strip() + "[s0] " + sentence.strip() # add the sentence to the full reply
+                        if not full_reply.is_empty() and (not full_reply.endswith(self._prompt_style["roleplay_suffix"]) and not full_reply.endswith(self._prompt_style["roleplay_prefix"])): # if the full reply is not empty and the last character is not a roleplay symbol, then just add the sentence with a space
+                            full_reply.append("[s0] ", sentence.strip()) # add the sentence to the full reply
                         else: # if the full reply is empty or ends with a roleplay symbol, then figure out if the sentence should be added with or without a space
                             if same_roleplay_symbol:
                                 if not was_typing_roleplay and typing_roleplay: # If just started roleplay, add the sentence without a space
-                                    full_reply = full_reply.strip() + "[ns1]" + sentence.strip()
+                                    full_reply.append("[ns1]", sentence.strip())
                                 elif was_typing_roleplay and not typing_roleplay: # If just stopped roleplaying, or if you're still actively/not actively roleplaying, add the sentence with a space
-                                    full_reply = full_reply.strip() + sentence.strip()
+                                    full_reply.append(sentence.strip())
                                 elif was_typing_roleplay and typing_roleplay:
                                     if num_sentences == 1:
-                                        full_reply = full_reply.strip() + "[ns3] " + sentence.strip()
+                                        full_reply.append("[ns3] ", sentence.strip())
                                     else:
-                                        full_reply = full_reply.strip() + "[s1] " + sentence.strip()
+                                        full_reply.append("[s1] ", sentence.strip())
                                 else:
-                                    full_reply = full_reply.strip() + "[s2] " +  sentence.strip()
+                                    full_reply.append("[s2] ", sentence.strip())
                             else:
                                 if full_reply.endswith(self._prompt_style["roleplay_suffix"]):
-                                    full_reply = full_reply.strip() + "[s3] " + sentence.strip()
+                                    full_reply.append("[s3] ", sentence.strip())
                                 else:
-                                    full_reply = full_reply.strip() + "[ns4]" + sentence.strip()
+                                    full_reply.append("[ns4]", sentence.strip())
                             # if len(full_reply) > 0:
                             #     if typing_roleplay:
                             #         full_reply = full_reply.strip() + sentence.strip()
@@ -1519,10 +1432,9 @@ class base_LLM():
                             #         full_reply = full_reply.strip() + " " + sentence.strip()
                             # else:
                             #     full_reply = sentence.strip()
-                        full_reply = full_reply.strip()
                         if new_speaker:
                             if not typing_roleplay:
-                                full_reply = full_reply.strip() + "[ns5]" + self._prompt_style["roleplay_suffix"]
+                                full_reply.append("[ns5]", self._prompt_style["roleplay_suffix"])
                             # else:
                             #     full_reply = full_reply.strip() + "[ns6]" + self._prompt_style["roleplay_prefix"]
                         num_sentences += 1 # increment the total number of sentences generated
@@ -1530,7 +1442,7 @@ class base_LLM():
                         
 
                         logging.debug(f"Parsed sentence: {sentence}")
-                        logging.debug(f"Parsed full reply: {full_reply}")
+                        logging.debug(f"Parsed full reply:", full_reply)
                         logging.debug(f"Parsed voice line: {voice_line}")
                         logging.debug(f"Number of sentences: {num_sentences}")
                         logging.debug(f"Number of sentences in voice line: {voice_line_sentences}")
@@ -1580,6 +1492,7 @@ class base_LLM():
                                 logging.info(f"Voice line: \"{voice_line}\" is definitely not empty.")
                                 self.conversation_manager.behavior_manager.pre_sentence_evaluate(self.conversation_manager.game_interface.active_character, sentence) # check if the sentence contains any behavior keywords for NPCs
                                 if use_narrator: # if the asterisk is open, then the narrator is speaking
+                                    await self.synthesis_executor.flush() # let queued NPC lines reach the game before the narrator speaks
                                     time.sleep(self.config.narrator_delay)
                                     voice_lines.append((voice_line.strip(), "narrator"))
                                     voiceline_path = self.conversation_manager.synthesizer._say(voice_line.strip(), self.config.narrator_voice, self.config.narrator_volume)
@@ -1630,12 +1543,13 @@ class base_LLM():
                             logging.info(f"Response generation complete. Stopping generation.")
                             break
 
+                await token_stream.aclose() # stop the LLM if generation ended early
                 if self.cot_enabled and self.cot_supported and self.conversation_manager.thought_process is not None:
                     print(f"Full Thought Process:",json.dumps(full_json, indent=4))
 
                 # input("Press enter to continue...") # For pausing after attempt at generating a response
                 logging.info(f"LLM response took {time.time() - start_time} seconds to execute")
-                if full_reply.strip() == "":
+                if full_reply.is_empty():
                     if self.config.error_on_empty_full_reply:
                         raise Exception('Empty full reply')
                 if self.config.must_generate_a_sentence:
@@ -1645,18 +1559,20 @@ class base_LLM():
                         continue
                 break
             except Exception as e:
+                if token_stream is not None:
+                    await token_stream.aclose()
                 if force_speaker is not None:
                     next_author = force_speaker.name
-                    proposed_next_author = next_author
+                    segmenter.proposed_next_author = next_author
                 else:
                     next_author = None
-                    proposed_next_author = ''
+                    segmenter.proposed_next_author = ''
                 verified_author = False
                 sentence = ''
                 next_sentence = ''
                 next_speaker_sentence = ''
                 voice_line = ''
-                full_reply = ''
+                full_reply = ReplyBuilder()
                 num_sentences = 0
                 voice_line_sentences = 0
                 send_voiceline = False
@@ -1692,6 +1608,7 @@ class base_LLM():
         if voice_line_sentences > 0 and len(voice_line.strip()) > 0: # if the voice line is not empty, then generate the audio for the voice line
             logging.info(f"Generating voiceline: \"{voice_line.strip()}\" for {self.conversation_manager.game_interface.active_character.name}.")
             if typing_roleplay: # if the asterisk is open, then the narrator is speaking
+                await self.synthesis_executor.flush()
                 time.sleep(self.config.narrator_delay)
                 voiceline_path = self.conversation_manager.synthesizer._say(voice_line.strip(), self.config.narrator_voice, self.config.narrator_volume)
                 voice_lines.append((voice_line.strip(), "narrator"))
@@ -1706,6 +1623,7 @@ class base_LLM():
 
         if len(sentence.strip()) > 0: # if the sentence is not empty, then have the character speak the sentence
             logging.info(f"Final sentence: {sentence}")
+            await self.synthesis_executor.flush() # the final sentence is sent straight to the game, so everything queued has to go first
             if typing_roleplay: # if the asterisk is open, then the narrator is speaking
                 time.sleep(self.config.narrator_delay)
                 voiceline_path = self.conversation_manager.synthesizer._say(sentence.strip(), self.config.narrator_voice, self.config.narrator_volume)
@@ -1715,9 +1633,11 @@ class base_LLM():
                 await self.conversation_manager.game_interface.active_character.say(sentence)
             sentence = ''
 
+        await self.synthesis_executor.finish() # deliver any voicelines still being synthesized
         await sentence_queue.put(None) # Mark the end of the response for self.conversation_manager.game_interface.send_response() and self.conversation_manager.game_interface.send_response()
 
-        raw_reply = raw_reply.strip()
+        full_reply = str(full_reply)
+        raw_reply = segmenter.raw_reply.strip()
 
         raw_reply_found_behaviors = []
         if self.behavior_style["prefix"] in raw_reply:
@@ -1858,20 +1778,6 @@ class base_LLM():
         return sentence, next_author, verified_author, retries, bad_author_retries, system_loop
 
     async def generate_voiceline(self, string, sentence_queue, event):
-        """Generate audio for a voiceline"""
-        # Generate the audio and return the audio file path
-        try:
-            audio_file = self.conversation_manager.synthesizer.synthesize(string, self.conversation_manager.game_interface.active_character)
-        except Exception as e:
-            logging.error(f"TTS Error: {e}")
-            logging.error(e)
-            tb = traceback.format_exc()
-            logging.error(tb)
-            input('Press enter to continue...')
-            raise e
-
-        await sentence_queue.put([audio_file, string]) # Put the audio file path in the sentence_queue
-        event.clear() # clear the event for the next iteration
-        logging.debug("Waiting for event to be set before generating the next line")
-        await event.wait() # wait for the event to be set before generating the next line
-        logging.debug("Event Triggered, continuing generation...")
\ No newline at end of file
+        """Queue a voiceline for synthesis - the synthesis executor puts the audio file in the sentence_queue once it's ready and it's this line's turn to play"""
+        await self.synthesis_executor.submit(string, self.conversation_manager.game_interface.active_character) # only waits if the synthesis queue is full
+        logging.debug("Voiceline queued, continuing generation...")
\ No newline at end of file
@@ -5,6 +5,8 @@ import io
 import traceback
 import json
 import os
+import hashlib
+import threading
 from typing import Optional, Iterator, Union, List, Dict, Sequence, Literal
 from tqdm import tqdm
 from pydantic import BaseModel
@@ -28,6 +30,115 @@ except Exception as e:
 class ResponseFormat(BaseModel):
     type: str
     json_schema: Union[dict, str]
+
+class GrammarCache():
+    """Compiled GBNF grammars, keyed by a hash of the JSON schema or GBNF string they were made from.
+
+    Converting a JSON schema to a grammar isn't free and the thought process and character generator schemas never change during a session, so each one is only compiled once. The GBNF for each schema can also be saved to a JSON file so restarts skip the conversion as well."""
+    def __init__(self):
+        self.grammars = {} # key -> LlamaGrammar
+        self.gbnf = {} # schema key -> GBNF string, saved to cache_path if it's set
+        self.model_keys = {} # pydantic model -> (schema key, schema json), model_json_schema() rebuilds the schema on every call
+        self.cache_path = None
+        self.lock = threading.Lock()
+
+    def load(self, cache_path):
+        """Load the GBNF strings saved by a previous session, and save new ones to cache_path from now on"""
+        self.cache_path = cache_path
+        if cache_path is None or cache_path == "" or not os.path.exists(cache_path):
+            return
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get("llama_cpp_version") != getattr(llama_cpp, "__version__", None): # a different version of llama-cpp-python might convert schemas differently
+                logging.info(f"Grammar cache at {cache_path} was made by a different version of llama-cpp-python, ignoring it")
+                return
+            with self.lock:
+                self.gbnf.update(saved["grammars"])
+            logging.info(f"Loaded {len(saved['grammars'])} grammar(s) from {cache_path}")
+        except Exception as e:
+            logging.warning(f"Could not load grammar cache from {cache_path}: {e}")
+
+    def save(self):
+        if self.cache_path is None or self.cache_path == "":
+            return
+        with self.lock:
+            saved = {
+                "llama_cpp_version": getattr(llama_cpp, "__version__", None),
+                "grammars": dict(self.gbnf),
+            }
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+            temp_path = self.cache_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(saved, f, indent=4)
+            os.replace(temp_path, self.cache_path) # replace the old file in one step so a crash can't leave a half written cache behind
+        except Exception as e:
+            logging.warning(f"Could not save grammar cache to {self.cache_path}: {e}")
+
+    def from_string(self, gbnf):
+        """Get the compiled grammar for a GBNF string"""
+        key = "gbnf-" + hashlib.sha256(gbnf.encode('utf-8')).hexdigest()
+        with self.lock:
+            grammar = self.grammars.get(key)
+        if grammar is None:
+            grammar = llama_cpp.LlamaGrammar.from_string(gbnf)
+            with self.lock:
+                self.grammars[key] = grammar
+        return grammar
+
+    def from_json_schema(self, json_schema, key=None):
+        """Get the compiled grammar for a JSON schema, either as a dict or already dumped to a string"""
+        if type(json_schema) != str:
+            json_schema = json.dumps(json_schema) # not sorted, the order of the properties is the order the grammar makes the LLM generate them in
+        if key is None:
+            key = "schema-" + hashlib.sha256(json_schema.encode('utf-8')).hexdigest()
+        with self.lock:
+            grammar = self.grammars.get(key)
+            gbnf = self.gbnf.get(key)
+        if grammar is not None:
+            return grammar
+        new_gbnf = gbnf is None
+        if new_gbnf:
+            start = time.time()
+            gbnf = llama_cpp.llama_grammar.json_schema_to_gbnf(json_schema)
+            logging.info(f"Converted JSON schema to GBNF grammar in {round(time.time() - start, 5)} seconds")
+        grammar = llama_cpp.LlamaGrammar.from_string(gbnf)
+        with self.lock:
+            self.grammars[key] = grammar
+            self.gbnf[key] = gbnf
+        if new_gbnf:
+            self.save()
+        return grammar
+
+    def from_model(self, model):
+        """Get the compiled grammar for a pydantic model's JSON schema"""
+        with self.lock:
+            model_key = self.model_keys.get(model)
+        if model_key is None:
+            json_schema = json.dumps(model.model_json_schema())
+            model_key = ("schema-" + hashlib.sha256(json_schema.encode('utf-8')).hexdigest(), json_schema)
+            with self.lock:
+                self.model_keys[model] = model_key
+        key, json_schema = model_key
+        return self.from_json_schema(json_schema, key=key)
+
+    def get(self, grammar):
+        """Get a compiled grammar from a JSON schema dict, a GBNF string or an already compiled grammar"""
+        if grammar is None:
+            return None
+        if type(grammar) == dict:
+            return self.from_json_schema(grammar)
+        if type(grammar) == str:
+            return self.from_string(grammar)
+        if isinstance(grammar, type) and issubclass(grammar, BaseModel):
+            return self.from_model(grammar)
+        if isinstance(grammar, llama_cpp.LlamaGrammar):
+            return grammar
+        print("Error: Grammar is not a valid type")
+        return None
+
+grammar_cache = GrammarCache() # Shared by every LlamaCPP and LLM object, the schemas are the same for all of them
     
 class LlamaCPP():
     def __init__(
@@ -234,22 +345,13 @@ class LlamaCPP():
             dry_seq_breakers = []
         print("Using sampling options: temperature",temperature,"top_p",top_p,"top_k",top_k,"min_p",min_p,"repeat_penalty",repeat_penalty,"frequency_penalty",frequency_penalty,"presence_penalty",presence_penalty,"typical_p",typical_p,"xtc_probability",xtc_probability,"xtc_threshold",xtc_threshold,"dry_multiplier",dry_multiplier,"dry_allowed_length",dry_allowed_length,"dry_base",dry_base,"dry_penalty_last_n",dry_penalty_last_n,"dry_seq_breakers",dry_seq_breakers)
         
-        grammar = None
-        if grammar and type(grammar) == dict: # original format 1
-            print("Grammar:",grammar)
-            grammar = llama_cpp.LlamaGrammar.from_json_schema(json.dumps(grammar))
-        elif grammar and type(grammar) == str: # original format 2
+        if grammar: # original format 1 (JSON schema dict), 2 (GBNF string) or an already compiled grammar
             print("Grammar:",grammar)
-            grammar = llama_cpp.LlamaGrammar.from_string(grammar)
+            grammar = grammar_cache.get(grammar)
         elif response_format and type(response_format) != None:
             print("Response format:",response_format)
             if response_format.type == "json_schema":
-                if type(response_format.json_schema) == dict:
-                    grammar = llama_cpp.LlamaGrammar.from_json_schema(json.dumps(response_format.json_schema))
-                elif type(response_format.json_schema) == str:
-                    grammar = llama_cpp.LlamaGrammar.from_string(response_format.json_schema)
-                else:
-                    print("Error: Grammar is not a valid type")
+                grammar = grammar_cache.get(response_format.json_schema)
         else:
             print("No grammar found")
         print("Grammar:",grammar)
@@ -404,24 +506,13 @@ class LlamaCPP():
         
         if grammar:
             print("Legacy grammar format detected")
-            if type(grammar) == dict:
-                response_grammar = llama_cpp.LlamaGrammar.from_json_schema(json.dumps(grammar))
-            elif type(grammar) == str:
-                response_grammar = llama_cpp.LlamaGrammar.from_string(grammar)
+            response_grammar = grammar_cache.get(grammar)
         elif response_grammar:
             print("Response grammar detected")
-            if type(response_grammar) == dict:
-                response_grammar = llama_cpp.LlamaGrammar.from_json_schema(json.dumps(response_grammar))
-            elif type(response_grammar) == str:
-                response_grammar = llama_cpp.LlamaGrammar.from_string(response_grammar)
+            response_grammar = grammar_cache.get(response_grammar)
         elif response_format and type(response_format) != None:
             print("OpenRouter style response_format detected")
-            if type(response_format.json_schema) == dict:
-                response_grammar = llama_cpp.LlamaGrammar.from_json_schema(json.dumps(response_format.json_schema))
-            elif type(response_format.json_schema) == str:
-                response_grammar = llama_cpp.LlamaGrammar.from_string(response_format.json_schema)
-            else:
-                print("Error: Grammar is not a valid type")
+            response_grammar = grammar_cache.get(response_format.json_schema)
             # if body.response_format.type == "json_schema":
             #     grammar = llama_cpp.LlamaGrammar.from_json_schema(json.dumps(body.response_format.json_schema))
         else:
@@ -430,13 +521,7 @@ class LlamaCPP():
 
         if thinking_grammar and will_think:
             print("Thinking grammar detected")
-            if type(thinking_grammar) == dict:
-                thinking_grammar = llama_cpp.LlamaGrammar.from_json_schema(json.dumps(thinking_grammar))
-            elif type(thinking_grammar) == str:
-                thinking_grammar = llama_cpp.LlamaGrammar.from_string(thinking_grammar)
-            else:
-                print("Error: Thinking grammar is not a valid type")
-                thinking_grammar = None
+            thinking_grammar = grammar_cache.get(thinking_grammar)
         else:
             thinking_grammar = None
         print("Thinking Grammar:",thinking_grammar)
@@ -769,6 +854,7 @@ default_settings = {
     "llama_cpp_python_n_threads_batch": 1,
     "llama_cpp_python_offload_kqv": True,
     "llama_cpp_python_thought_infill": True,
+    "llama_cpp_python_grammar_cache_path": "./data/grammar_cache.json",
     "llama_cpp_python_verbose": False,
 }
 settings_description = {
@@ -786,6 +872,7 @@ settings_description = {
     "llama_cpp_python_use_mlock": "Whether to use mlock to lock the model in memory. This is used to speed up the model inference. If you are using a single GPU, this should be False.",
     "llama_cpp_python_n_threads_batch": "The number of threads to use for the batch processing. This is used to speed up the model inference. If you are using a single GPU, this should be 1.",
     "llama_cpp_python_offload_kqv": "Whether to offload the key-value pairs to the CPU. This is used to speed up the model inference. If you are using a single GPU, this should be True.",
+    "llama_cpp_python_grammar_cache_path": "The file the GBNF grammars compiled from the thought process and character generator JSON schemas are saved to, so they don't have to be converted again the next time Pantella starts. Leave empty to only cache grammars in memory.",
     "llama_cpp_python_verbose": "Whether to enable verbose logging for llama-cpp-python. This can be useful for debugging issues with the model, but it can also slow down the inference. If you are using a single GPU, this should be False.",
 }
 options = {
@@ -1019,10 +1106,11 @@ class LLM(base_LLM): # Uses llama-cpp-python as the LLM inference engine
         #         input("Press Enter to exit.")
         #         raise Exception("Llama-cpp-python not installed, install llama-cpp-python to use llama-cpp-python.")
             
+        grammar_cache.load(self.config.llama_cpp_python_grammar_cache_path)
         if self.cot_enabled:
             logging.info("COT is enabled for llama-cpp-python")
             if self.cot_enabled and self.conversation_manager.thought_process is not None: # If COT is enabled, we need to use the JSON schema for the response format
-                grammar = llama_cpp.LlamaGrammar.from_json_schema(json.dumps(TestCoT.model_json_schema()))
+                grammar = grammar_cache.from_model(TestCoT)
                 completion = self.llm.completions("",
                     max_tokens=512,
                     stream=False,
@@ -1041,6 +1129,16 @@ class LLM(base_LLM): # Uses llama-cpp-python as the LLM inference engine
                     # input("Press Enter to exit.")
         loaded = True
 
+    def post_initialization(self):
+        """Compile the grammars for the thought process and character generator schemas before the first conversation needs them"""
+        try:
+            if self.cot_enabled and self.cot_supported and self.conversation_manager.thought_process is not None:
+                grammar_cache.from_model(self.conversation_manager.thought_process)
+            if self.character_generation_supported and self.conversation_manager.character_generator_schema is not None:
+                grammar_cache.from_model(self.conversation_manager.character_generator_schema)
+        except Exception as e:
+            logging.warning(f"Could not pre-compile grammars for llama-cpp-python, they will be compiled when they're first used instead: {e}")
+
     def generate_character(self, character_name, character_ref_id, character_base_id, character_in_game_race, character_in_game_gender, character_is_guard=False, character_is_ghost=False, in_game_voice_model=None, location=None):
         """Generate a character based on the prompt provided"""
         if not self.character_generation_supported:
@@ -1063,8 +1161,7 @@ class LLM(base_LLM): # Uses llama-cpp-python as the LLM inference engine
             }
         ]
         logging.info(f"Messages:", messages)
-        json_schema = self.conversation_manager.character_generator_schema.model_json_schema()
-        grammar = llama_cpp.LlamaGrammar.from_json_schema(json.dumps(json_schema))
+        grammar = grammar_cache.from_model(self.conversation_manager.character_generator_schema)
         character = None
         tries = 5
         while character is None and tries > 0:
@@ -1204,7 +1301,7 @@ class LLM(base_LLM): # Uses llama-cpp-python as the LLM inference engine
                     prompt = self.multimodal_prompt_format(prompt)
 
                 if self.cot_enabled and self.cot_supported and self.conversation_manager.thought_process is not None: # If COT is enabled, we need to use the JSON schema for the response format
-                    grammar = llama_cpp.LlamaGrammar.from_json_schema(json.dumps(self.conversation_manager.thought_process.model_json_schema()))
+                    grammar = grammar_cache.from_model(self.conversation_manager.thought_process)
                     completion = self.llm.chat_completions(messages=messages,
                         max_tokens=self.max_tokens,
                         top_k=self.top_k,
@@ -1276,7 +1373,7 @@ class LLM(base_LLM): # Uses llama-cpp-python as the LLM inference engine
                 }
                 if self.cot_enabled and self.cot_supported and self.conversation_manager.thought_process is not None: # If COT is enabled, we need to use the JSON schema for the response format
                     print("Using CoT Grammar")
-                    grammar = llama_cpp.LlamaGrammar.from_json_schema(json.dumps(self.conversation_manager.thought_process.model_json_schema()))
+                    grammar = grammar_cache.from_model(self.conversation_manager.thought_process)
                     kwargs["grammar"] = grammar
                 else:
                     kwargs["response_prefill"] = force_speaker.name + self.config.message_signifier + message_prefix if force_speaker is not None else ""
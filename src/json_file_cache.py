@@ -0,0 +1,99 @@
+print("Importing json_file_cache.py")
+from src.logging import logging
+import os
+import json
+import copy
+import atexit
+import threading
+logging.info("Imported required libraries in json_file_cache.py")
+
+class JSONFileCache:
+    """JSON files read through an in-memory cache - a file is only parsed again when its modification time or size changes, and writes are queued and saved to disk in batches.
+
+    Every file has a version number that goes up whenever its contents change, whether that's from write() or from the file being edited outside of Pantella, so anything built from a set of files can tell when it needs to be rebuilt by comparing their versions."""
+    def __init__(self, write_delay=1.0):
+        self.write_delay = write_delay # seconds to wait after a write before saving, so several writes in a row are saved together
+        self.data = {} # path -> parsed contents, or None if the file doesn't exist
+        self.stats = {} # path -> (modification time, size) of the file when it was last read or written
+        self.versions = {} # path -> version number
+        self.pending = set() # paths written to but not saved yet
+        self.unreadable = set() # paths that exist but couldn't be parsed - these are never overwritten, so a typo in a hand edited file doesn't get it replaced with defaults
+        self.lock = threading.RLock()
+        self.timer = None
+        atexit.register(self.flush)
+
+    def _stat(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def version(self, path):
+        """Get the version of a file, reloading it first if it changed on disk"""
+        with self.lock:
+            if path in self.pending: # the copy in memory is newer than the one on disk
+                return self.versions[path]
+            stat = self._stat(path)
+            if path not in self.versions or stat != self.stats.get(path):
+                data = None
+                self.unreadable.discard(path)
+                if stat is not None:
+                    try:
+                        with open(path, "r") as f:
+                            data = json.load(f)
+                    except Exception as e:
+                        logging.error(f"Could not read JSON file {path}: {e}")
+                        data = None
+                        self.unreadable.add(path)
+                self.data[path] = data
+                self.stats[path] = stat
+                self.versions[path] = self.versions.get(path, 0) + 1
+            return self.versions[path]
+
+    def exists(self, path):
+        with self.lock:
+            self.version(path)
+            return self.data[path] is not None
+
+    def read(self, path):
+        """Get a copy of a file's contents, or None if it doesn't exist"""
+        with self.lock:
+            self.version(path)
+            return copy.deepcopy(self.data[path])
+
+    def write(self, path, data):
+        """Replace a file's contents - the file is saved to disk shortly after, or when flush() is called.
+
+        If the file exists but couldn't be parsed, the new contents are only kept in memory until the file is fixed or deleted."""
+        with self.lock:
+            self.version(path)
+            self.data[path] = copy.deepcopy(data)
+            self.versions[path] = self.versions.get(path, 0) + 1
+            if path in self.unreadable:
+                logging.error(f"Not overwriting JSON file {path} because it couldn't be parsed - using the new contents in memory only until the file is fixed or deleted")
+                return
+            self.pending.add(path)
+            if self.timer is None:
+                self.timer = threading.Timer(self.write_delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """Save every file that's been written to since the last flush"""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            for path in list(self.pending):
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    temp_path = path + ".tmp"
+                    with open(temp_path, "w") as f:
+                        json.dump(self.data[path], f, indent=4)
+                    os.replace(temp_path, path) # replace the old file in one step so it's never left half written
+                    self.stats[path] = self._stat(path)
+                except Exception as e:
+                    logging.error(f"Could not save JSON file {path}: {e}")
+                    self.stats[path] = None # try to read it again next time instead of trusting the copy in memory
+                self.pending.discard(path)
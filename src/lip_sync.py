@@ -0,0 +1,271 @@
+print("Importing lip_sync.py")
+from src.logging import logging, time
+import src.utils as utils
+import os
+import shutil
+import hashlib
+import threading
+import subprocess
+import concurrent.futures
+from pathlib import Path
+logging.info("Imported required libraries in lip_sync.py")
+
+def face_fx_game(game_id):
+    """Get the game name FaceFXWrapper expects for a game id"""
+    face_wrapper_game = game_id.lower()
+    if face_wrapper_game == 'fallout4vr' or face_wrapper_game == 'fallout4':
+        face_wrapper_game = 'Fallout4'
+    if face_wrapper_game == 'skyrimvr' or face_wrapper_game == 'skyrim' or face_wrapper_game == 'falloutnv':
+        face_wrapper_game = 'Skyrim'
+    return face_wrapper_game
+
+class base_LipSyncBackend:
+    """Generates a .lip file for a voiceline's wav file"""
+    name = "base"
+    cacheable = True # whether generated lip files are worth keeping in the lip cache
+
+    def __init__(self, config):
+        self.config = config
+
+    def available(self):
+        """Check if the backend can generate lip files on this system"""
+        return True
+
+    def start(self):
+        """Called once before the first lip file is generated, from the lip sync worker thread"""
+        pass
+
+    def generate(self, voiceline, wav_file, lip_file):
+        raise NotImplementedError("Please override this method in your child class!")
+
+class StubBackend(base_LipSyncBackend):
+    """Uses the default lip file for every voiceline - the mouth doesn't follow the audio, but it needs no external tools, so it's what's used when FaceFXWrapper isn't installed or is bypassed"""
+    name = "stub"
+    cacheable = False
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.default_lip_file = os.path.join(utils.resolve_path(), "data", "default.lip")
+
+    def generate(self, voiceline, wav_file, lip_file):
+        shutil.copyfile(self.default_lip_file, lip_file)
+
+class FaceFXBackend(base_LipSyncBackend):
+    """Generates lip files with FaceFXWrapper and FonixData.cdf, through wine on Linux"""
+    name = "facefx"
+
+    def __init__(self, config):
+        super().__init__(config)
+        current_dir = utils.resolve_path() # get current directory
+        self.cdf_path = os.path.join(current_dir, "FaceFXWrapper", "FonixData.cdf")
+        self.face_wrapper_executable = os.path.join(current_dir, "FaceFXWrapper", "FaceFXWrapper.exe")
+        self.face_wrapper_game = face_fx_game(self.config.game_id)
+        logging.info(f'FaceFXWrapper Detected Game: {self.face_wrapper_game}')
+
+    def available(self):
+        """Check if FaceFXWrapper is installed and FonixData.cdf exists in the same directory as the script."""
+        installed = True # both files are needed
+        logging.info(f'Checking if FonixData.cdf exists at: {self.cdf_path}')
+        if os.path.isfile(self.cdf_path):
+            logging.info(f'Found FonixData.cdf at: {self.cdf_path}')
+        else:
+            logging.error(f'Could not find FonixData.cdf in "{Path(self.cdf_path).parent}" required by FaceFXWrapper.')
+            installed = False
+
+        logging.info(f'Checking if FaceFXWrapper.exe exists at: {self.face_wrapper_executable}')
+        if os.path.isfile(self.face_wrapper_executable):
+            logging.info(f'Found FaceFXWrapper.exe at: {self.face_wrapper_executable}')
+        else:
+            logging.error(f'Could not find FaceFXWrapper.exe in "{Path(self.face_wrapper_executable).parent}" with which to create a Lip Sync file, download it from: https://github.com/Haurrus/FaceFXWrapper/releases')
+            installed = False
+        return installed
+
+    def start(self):
+        if self.config.linux_mode: # keep a wineserver running between lines so every FaceFXWrapper call doesn't have to start wine from scratch
+            try:
+                subprocess.Popen(["wineserver", "-p"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                logging.info("Started persistent wineserver for FaceFXWrapper")
+            except Exception as e:
+                logging.warning(f"Could not start a persistent wineserver, every lip file will have to start wine: {e}")
+
+    def generate(self, voiceline, wav_file, lip_file):
+        resampled_wav_file = wav_file.replace(".wav", "_r.wav")
+        if self.config.linux_mode:
+            command = f'wine "{self.face_wrapper_executable}" "{self.face_wrapper_game}" "USEnglish" "{self.cdf_path}" "{wav_file}" "{resampled_wav_file}" "{lip_file}" "{voiceline}"'
+        else:
+            command = f'{self.face_wrapper_executable} "{self.face_wrapper_game}" "USEnglish" "{self.cdf_path}" "{wav_file}" "{resampled_wav_file}" "{lip_file}" "{voiceline}"'
+        logging.info(f'Running command: {command}')
+        self.run_command(command)
+        # remove file created by FaceFXWrapper
+        if os.path.exists(resampled_wav_file):
+            os.remove(resampled_wav_file)
+
+    def run_command(self, command):
+        """Run a command in the command prompt"""
+        if self.config.linux_mode:
+            sp = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+        else:
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            sp = subprocess.Popen(command, startupinfo=startupinfo, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = sp.communicate()
+        stderr = stderr.decode("utf-8", errors="replace")
+        if sp.returncode != 0:
+            logging.warning(f"FaceFXWrapper exited with code {sp.returncode}: {stderr}")
+
+Backends = {
+    "facefx": FaceFXBackend,
+    "stub": StubBackend,
+}
+
+class LipSyncService:
+    """Generates lip files on a long lived worker thread, so lip syncing one voiceline can run while the next one is being synthesized.
+
+    Generated lip files are cached by a hash of the audio and text they were made from, so a voiceline that comes out of the TTS identical to an earlier one reuses its lip file instead of running the backend again."""
+    def __init__(self, backend, cache_dir, max_cache_bytes, workers=1):
+        self.backend = backend
+        self.fallback_backend = StubBackend(backend.config)
+        self.cache_dir = cache_dir
+        self.max_cache_bytes = max_cache_bytes
+        self.cache = {} # hash -> [size in bytes, last used time]
+        self.cache_bytes = 0
+        self.jobs = {} # lip file -> future for the job writing it
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(".lip"):
+                cached_lip_file = os.path.join(self.cache_dir, file_name)
+                size = os.path.getsize(cached_lip_file)
+                self.cache[file_name[:-4]] = [size, os.path.getmtime(cached_lip_file)]
+                self.cache_bytes += size
+        self.workers = max(1, int(workers))
+        self.executor = None # started by the first submit(), stopped by shutdown()
+        logging.config(f"Lip sync service started with the {self.backend.name} backend and {len(self.cache)} cached lip files")
+
+    def audio_hash(self, voiceline, wav_file):
+        digest = hashlib.sha256()
+        digest.update(f"{self.backend.name}\0{self.backend.config.game_id}\0{voiceline}\0".encode("utf-8"))
+        with open(wav_file, "rb") as f:
+            for block in iter(lambda: f.read(1048576), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def submit(self, voiceline, wav_file):
+        """Queue lip generation for a wav file - returns a future that resolves to the seconds spent on it.
+
+        The future's lip_source dict says which backend the lip file came from once it's done, and whether it's "cacheable" - False when it's the default lip file, from a backend that isn't cacheable or from the fallback after the backend failed."""
+        lip_file = wav_file.replace(".wav", ".lip")
+        lip_source = {"backend": None, "cacheable": False}
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pantella_lip", initializer=self.backend.start)
+            executor = self.executor
+        future = executor.submit(self._run, voiceline, wav_file, lip_file, time.time(), lip_source)
+        future.lip_source = lip_source
+        with self.lock:
+            self.jobs[lip_file] = future
+        return future
+
+    def generate(self, voiceline, wav_file):
+        """Generate the lip file for a wav file and wait for it"""
+        return self.submit(voiceline, wav_file).result()
+
+    def pop_job(self, wav_file):
+        """Get the future for the latest lip job queued for a wav file, if there is one"""
+        with self.lock:
+            return self.jobs.pop(wav_file.replace(".wav", ".lip"), None)
+
+    def _run(self, voiceline, wav_file, lip_file, submitted_at, lip_source):
+        start = time.time()
+        logging.info(f'Generating lip file for voiceline: {voiceline} to: {lip_file} (waited {round(start - submitted_at, 5)} seconds in queue)')
+        try:
+            key = self.audio_hash(voiceline, wav_file) if self.backend.cacheable else None
+            entry = None
+            if key is not None: # backends that aren't cacheable never look in the cache
+                cached_lip_file = os.path.join(self.cache_dir, f"{key}.lip")
+                with self.lock:
+                    entry = self.cache.get(key)
+                    if entry is not None:
+                        entry[1] = time.time()
+            if entry is not None and os.path.exists(cached_lip_file):
+                utils.link_or_copy(cached_lip_file, lip_file)
+                logging.info(f'Using cached lip file for voiceline: {voiceline}')
+            else:
+                if os.path.exists(lip_file):
+                    os.remove(lip_file)
+                self.backend.generate(voiceline, wav_file, lip_file)
+                if key is not None and os.path.exists(lip_file):
+                    self._store(key, lip_file)
+            if os.path.exists(lip_file):
+                lip_source["backend"] = self.backend.name
+                lip_source["cacheable"] = self.backend.cacheable
+        except Exception as e:
+            logging.error(f'{self.backend.name} failed to generate lip file at: {lip_file} - Falling back to default lip file:', e)
+            lip_source["backend"] = None
+            lip_source["cacheable"] = False
+        if not os.path.exists(lip_file):
+            logging.error(f'{self.backend.name} failed to generate lip file at: {Path(lip_file)}')
+            lip_source["cacheable"] = False
+            try:
+                self.fallback_backend.generate(voiceline, wav_file, lip_file)
+                lip_source["backend"] = self.fallback_backend.name
+            except Exception as e:
+                logging.error(f'Could not copy the default lip file to: {lip_file}', e)
+        return time.time() - start
+
+    def _store(self, key, lip_file):
+        cached_lip_file = os.path.join(self.cache_dir, key + ".lip")
+        shutil.copyfile(lip_file, cached_lip_file + ".tmp")
+        os.replace(cached_lip_file + ".tmp", cached_lip_file)
+        size = os.path.getsize(cached_lip_file)
+        evicted = []
+        with self.lock:
+            old_entry = self.cache.get(key)
+            if old_entry is not None:
+                self.cache_bytes -= old_entry[0]
+            self.cache[key] = [size, time.time()]
+            self.cache_bytes += size
+            if self.cache_bytes > self.max_cache_bytes: # drop the least recently used lip files
+                for old_key, entry in sorted(self.cache.items(), key=lambda item: item[1][1]):
+                    if self.cache_bytes <= self.max_cache_bytes:
+                        break
+                    evicted.append(old_key)
+                    self.cache_bytes -= entry[0]
+                    del self.cache[old_key]
+        for old_key in evicted:
+            try:
+                os.remove(os.path.join(self.cache_dir, old_key + ".lip"))
+            except OSError:
+                pass
+
+    def shutdown(self):
+        """Drop the lip files still queued and stop the worker threads - the next submit() starts new ones"""
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+            self.jobs = {}
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+services = {} # backend name -> LipSyncService, shared by every synthesizer
+services_lock = threading.Lock()
+
+def get_service(config):
+    """Get the lip sync service for the backend set in the config, creating it the first time it's asked for"""
+    backend_name = config.lip_sync_backend
+    if config.bypass_facefxwrapper and backend_name == "facefx":
+        logging.error('FaceFXWrapper bypassed: Falling back to default lip file in the Pantella mod folder')
+        backend_name = "stub"
+    with services_lock:
+        if backend_name not in services:
+            if backend_name not in Backends:
+                logging.error(f"Unknown lip sync backend '{backend_name}', must be one of {list(Backends.keys())}. Falling back to the default lip file.")
+                backend = StubBackend(config)
+            else:
+                backend = Backends[backend_name](config)
+                if not backend.available():
+                    logging.error(f'{backend.name} not installed: Falling back to default lip file in the Pantella mod folder')
+                    backend = StubBackend(config)
+            cache_dir = os.path.join(utils.resolve_path(), "data", "lip_cache", backend.name)
+            services[backend_name] = LipSyncService(backend, cache_dir, config.lip_cache_max_size_mb * 1048576, workers=config.lip_sync_workers)
+        return services[backend_name]
@@ -1,7 +1,10 @@
 import time
-import inspect
+import sys
+import atexit
+import queue
+import threading
 import faulthandler
-faulthandler.enable() # Enable faulthandler to get better stack traces on crashes with the inspect module in windows
+faulthandler.enable() # Enable faulthandler to get better stack traces on crashes in windows
 import os
 
 bcolors = {
@@ -14,21 +17,139 @@ bcolors = {
     "SUCCESS": '\033[92m',
 }
 
+levels = { # Messages below the logger's level are dropped before they're formatted
+    "DEBUG": 10,
+    "INFO": 20,
+    "CONFIG": 20,
+    "OUTPUT": 25,
+    "SUCCESS": 25,
+    "WARNING": 30,
+    "ERROR": 40,
+}
+
+class LogWriter:
+    """Writes log lines to the log file from a background thread, keeping the file open between writes and flushing whenever the queue runs dry"""
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.file = None
+        self.file_path = None
+        self.thread = threading.Thread(target=self._run, name="pantella_log_writer", daemon=True)
+        self.thread.start()
+
+    def write(self, log_file, line):
+        self.queue.put((log_file, line))
+
+    def _open(self, log_file):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.file_path = log_file
+        self.file = open(log_file, 'a', encoding='utf-8', errors='replace')
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            flushed = []
+            while item is not None and item is not False: # write everything that's queued before flushing
+                if isinstance(item, threading.Event): # flush() is waiting for everything before it to be written
+                    flushed.append(item)
+                else:
+                    log_file, line = item
+                    try:
+                        if log_file != self.file_path or self.file is None:
+                            self._open(log_file)
+                        self.file.write(line + '\n')
+                    except Exception as e:
+                        print(f'Error writing to log file: {e}')
+                item = self._next()
+            if self.file is not None:
+                self.file.flush()
+            for event in flushed:
+                event.set()
+            if item is None: # close() was called
+                break
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _next(self):
+        """Get the next queued item without waiting - returns False if the queue is empty"""
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return False
+
+    def flush(self):
+        """Wait until everything queued so far has been written"""
+        if self.thread.is_alive():
+            flushed = threading.Event()
+            self.queue.put(flushed)
+            flushed.wait(timeout=5)
+
+    def close(self):
+        """Write everything that's still queued and close the log file"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+
 class Logger:
-    def __init__(self, log_file = './logging.log', block_logs_from = []):
+    def __init__(self, log_file = './logging.log', block_logs_from = [], level = "DEBUG"):
         print("Creating Logger")
         self.format = '{time} [{location}] [{level}] {message}'
         self.log_file = log_file
         self.block_logs_from = block_logs_from
+        self.block_log_types = []
+        self.level = level
+        self.module_levels = {} # path prefix relative to the working directory, e.g. "src/tts_types/" -> level for logs from files under it
+        self._relative_paths = {} # absolute file path -> relative path, os.path.relpath is too slow to run on every log
+        self._module_level_numbers = {} # relative path -> minimum level number
+        self._time_second = None
+        self._time_string = ''
+        self.writer = LogWriter()
+        atexit.register(self.writer.close)
+
+    def set_level(self, level, module=None):
+        """Set the minimum level that gets logged, either for everything or for the files under a path prefix like "src/tts_types/" or "src/inference_engines/base_llm.py" """
+        level = level.upper()
+        if level not in levels:
+            raise ValueError(f"Unknown log level '{level}', must be one of {list(levels.keys())}")
+        if module is None:
+            self.level = level
+        else:
+            self.module_levels[module.replace('\\', '/')] = level
+        self._module_level_numbers = {}
+
+    def is_enabled(self, level, filepath):
+        """Check if a message of this level from this file would be logged"""
+        if level in self.block_log_types or filepath in self.block_logs_from:
+            return False
+        minimum = self._module_level_numbers.get(filepath)
+        if minimum is None:
+            minimum = levels[self.level]
+            longest_prefix = -1
+            normalized_path = filepath.replace('\\', '/')
+            for module, module_level in self.module_levels.items():
+                if normalized_path.startswith(module) and len(module) > longest_prefix:
+                    minimum = levels[module_level]
+                    longest_prefix = len(module)
+            self._module_level_numbers[filepath] = minimum
+        return levels[level] >= minimum
 
     def get_message_object(self, *args, level = 'INFO', filepath = None):
         return {
-            'time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
+            'time': self.get_time_string(),
             'level': level,
             'location': filepath,
             'message': ' '.join([str(arg) for arg in args])
         }
 
+    def get_time_string(self):
+        now = int(time.time())
+        if now != self._time_second: # only reformat the timestamp once a second
+            self._time_second = now
+            self._time_string = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+        return self._time_string
+
     def _output(self, message: str, level: str):
         message = message.encode('utf-8', errors='replace').decode('utf-8')
         try:
@@ -38,146 +159,67 @@ class Logger:
                 print(message)
         except UnicodeEncodeError:
             print('Error encoding message')
+        remove_colors = message
+        if '\033' in remove_colors:
+            for color in bcolors.values():
+                remove_colors = remove_colors.replace(color, '')
+        self.writer.write(self.log_file, remove_colors)
+
+    def _log(self, level, args):
+        if levels[level] < levels[self.level] and len(self.module_levels) == 0: # nothing can lower the level for a single file, so skip looking up the caller
+            return
+        # get the caller's file path and line number - _log is always called by one of the level methods below, so the caller is two frames up
         try:
-            with open(self.log_file, 'a') as f:
-                remove_colors = message
-                for color in bcolors.values():
-                    remove_colors = remove_colors.replace(color, '')
-                f.write(remove_colors + '\n')
-        except Exception as e:
-            print(f'Error writing to log file: {e}')
-            # raise e
-
-    def info(self, *args):
-        # get the caller's stack frame and extract its file path
-        try:
-            frame_info = inspect.stack()[1]
-            filepath = frame_info[1]  # in python 3.5+, you can use frame_info.filename
-            del frame_info  # drop the reference to the stack frame to avoid reference cycles
+            frame = sys._getframe(2)
+            filename = frame.f_code.co_filename
+            line = frame.f_lineno
+            del frame # drop the reference to the stack frame to avoid reference cycles
         except Exception as e:
             print(f'Error getting caller information: {e}')
-            filepath = 'unknown'
-
-        # make the path absolute (optional)
-        filepath = os.path.relpath(filepath)
-        if filepath in self.block_logs_from:
+            filename = 'unknown'
+            line = 0
+        filepath = self._relative_paths.get(filename)
+        if filepath is None:
+            try:
+                filepath = os.path.relpath(filename)
+            except ValueError: # on windows, files on another drive can't be made relative
+                filepath = filename
+            self._relative_paths[filename] = filepath
+        if not self.is_enabled(level, filepath):
             return
-        line = inspect.currentframe().f_back.f_lineno
-        message = self.get_message_object(*args, level='INFO', filepath=filepath+":"+str(line))
-        self._output(self.format.format(**message), 'INFO')
+        message = self.get_message_object(*args, level=level, filepath=filepath+":"+str(line))
+        self._output(self.format.format(**message), level)
+
+    def info(self, *args):
+        self._log('INFO', args)
 
     def output(self, *args):
-        # get the caller's stack frame and extract its file path
-        frame_info = inspect.stack()[1]
-        filepath = frame_info[1]  # in python 3.5+, you can use frame_info.filename
-        del frame_info  # drop the reference to the stack frame to avoid reference cycles
-
-        # make the path absolute (optional)
-        filepath = os.path.relpath(filepath)
-        if filepath in self.block_logs_from:
-            return
-        line = inspect.currentframe().f_back.f_lineno
-        message = self.get_message_object(*args, level='OUTPUT', filepath=filepath+":"+str(line))
-        self._output(self.format.format(**message), 'OUTPUT')
-        
+        self._log('OUTPUT', args)
+
     def config(self, *args):
-        # get the caller's stack frame and extract its file path
-        frame_info = inspect.stack()[1]
-        filepath = frame_info[1]  # in python 3.5+, you can use frame_info.filename
-        del frame_info  # drop the reference to the stack frame to avoid reference cycles
-
-        # make the path absolute (optional)
-        filepath = os.path.relpath(filepath)
-        if filepath in self.block_logs_from:
-            return
-        line = inspect.currentframe().f_back.f_lineno
-        message = self.get_message_object(*args, level='CONFIG', filepath=filepath+":"+str(line))
-        self._output(self.format.format(**message), 'CONFIG')
+        self._log('CONFIG', args)
 
     def error(self, *args):
-        # get the caller's stack frame and extract its file path
-        frame_info = inspect.stack()[1]
-        filepath = frame_info[1]  # in python 3.5+, you can use frame_info.filename
-        del frame_info  # drop the reference to the stack frame to avoid reference cycles
-
-        # make the path absolute (optional)
-        filepath = os.path.relpath(filepath)
-        if filepath in self.block_logs_from:
-            return
-        line = inspect.currentframe().f_back.f_lineno
-        message = self.get_message_object(*args, level='ERROR', filepath=filepath+":"+str(line))
-        # message['message'] += '\n\nStack Trace:\n'+traceback.format_exc()
-        self._output(self.format.format(**message), 'ERROR')
+        self._log('ERROR', args)
 
     def warning(self, *args):
-        # get the caller's stack frame and extract its file path
-        frame_info = inspect.stack()[1]
-        filepath = frame_info[1]  # in python 3.5+, you can use frame_info.filename
-        del frame_info  # drop the reference to the stack frame to avoid reference cycles
-
-        # make the path absolute (optional)
-        filepath = os.path.relpath(filepath)
-        if filepath in self.block_logs_from:
-            return
-        line = inspect.currentframe().f_back.f_lineno
-        message = self.get_message_object(*args, level='WARNING', filepath=filepath+":"+str(line))
-        self._output(self.format.format(**message), 'WARNING')
+        self._log('WARNING', args)
 
     def debug(self, *args):
-        # get the caller's stack frame and extract its file path
-        frame_info = inspect.stack()[1]
-        filepath = frame_info[1]  # in python 3.5+, you can use frame_info.filename
-        del frame_info  # drop the reference to the stack frame to avoid reference cycles
-
-        # make the path absolute (optional)
-        filepath = os.path.relpath(filepath)
-        if filepath in self.block_logs_from:
-            return
-        line = inspect.currentframe().f_back.f_lineno
-        message = self.get_message_object(*args, level='DEBUG', filepath=filepath+":"+str(line))
-        self._output(self.format.format(**message), 'DEBUG')
+        self._log('DEBUG', args)
 
     def success(self, *args):
-        # get the caller's stack frame and extract its file path
-        frame_info = inspect.stack()[1]
-        filepath = frame_info[1]  # in python 3.5+, you can use frame_info.filename
-        del frame_info  # drop the reference to the stack frame to avoid reference cycles
-
-        # make the path absolute (optional)
-        filepath = os.path.relpath(filepath)
-        if filepath in self.block_logs_from:
-            return
-        line = inspect.currentframe().f_back.f_lineno
-        message = self.get_message_object(*args, level='SUCCESS', filepath=filepath+":"+str(line))
-        self._output(self.format.format(**message), 'SUCCESS')
+        self._log('SUCCESS', args)
 
     def warn(self, *args):
-        # get the caller's stack frame and extract its file path
-        frame_info = inspect.stack()[1]
-        filepath = frame_info[1]  # in python 3.5+, you can use frame_info.filename
-        del frame_info  # drop the reference to the stack frame to avoid reference cycles
-
-        # make the path absolute (optional)
-        filepath = os.path.relpath(filepath)
-        if filepath in self.block_logs_from:
-            return
-        line = inspect.currentframe().f_back.f_lineno
-        message = self.get_message_object(*args, level='WARNING', filepath=filepath+":"+str(line))
-        self._output(self.format.format(**message), 'WARNING')
-        
+        self._log('WARNING', args)
+
     def out(self, *args):
-        # get the caller's stack frame and extract its file path
-        frame_info = inspect.stack()[1]
-        filepath = frame_info[1]  # in python 3.5+, you can use frame_info.filename
-        del frame_info  # drop the reference to the stack frame to avoid reference cycles
-
-        # make the path absolute (optional)
-        filepath = os.path.relpath(filepath)
-        if filepath in self.block_logs_from:
-            return
-        line = inspect.currentframe().f_back.f_lineno
-        message = self.get_message_object(*args, level='OUTPUT', filepath=filepath+":"+str(line))
-        self._output(self.format.format(**message), 'OUTPUT')
+        self._log('OUTPUT', args)
+
+    def flush(self):
+        """Wait for everything logged so far to be written to the log file"""
+        self.writer.flush()
 
 logging = Logger() # Create a logger object to be used throughout the program
 
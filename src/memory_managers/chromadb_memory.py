@@ -2,6 +2,7 @@ print("Loading chromadb_memory.py...")
 from src.logging import logging
 import os
 import json
+import bisect
 try:
     logging.info("Importing chromadb...")
     import chromadb
@@ -55,6 +56,10 @@ class MemoryManager(base_MemoryManager):
         logging.info(self.torchmoji_model)
         self.messages_memories = self.client.get_or_create_collection(name="messages")
         # self.memory_blocks = self.client.get_or_create_collection(name="memories")
+        self.message_ids = [] # ids of every stored message, sorted by timestamp
+        self.message_timestamps = [] # timestamps matching self.message_ids, used to insert out of order messages
+        self.message_positions = {} # id -> position in self.message_ids
+        self.build_message_index()
         self.current_memories = []
         self.logical_memories = ""
         self.emotional_memories = ""
@@ -64,6 +69,56 @@ class MemoryManager(base_MemoryManager):
         if len(self.get_all_messages()) > 0:
             self.update_memories()
             
+    def build_message_index(self):
+        """Build the ordered message index from the ids and timestamps stored in ChromaDB - Only reads the metadata, not the documents"""
+        stored = self.messages_memories.get(include=["metadatas"])
+        order = sorted(range(len(stored["ids"])), key=lambda i: stored["metadatas"][i]["timestamp"]) # sorted() is stable, so messages with the same timestamp keep their storage order
+        self.message_ids = [stored["ids"][i] for i in order]
+        self.message_timestamps = [stored["metadatas"][i]["timestamp"] for i in order]
+        self.message_positions = {message_id: i for i, message_id in enumerate(self.message_ids)}
+        logging.info(f"Indexed {len(self.message_ids)} messages from ChromaDB")
+        missing_token_counts = [stored["ids"][i] for i in range(len(stored["ids"])) if "token_count" not in stored["metadatas"][i]]
+        if len(missing_token_counts) > 0:
+            self.backfill_token_counts(missing_token_counts)
+
+    def backfill_token_counts(self, ids, batch_size=256):
+        """One time migration for memories saved without a token count - Counts their tokens in batches and stores the counts in ChromaDB"""
+        logging.info(f"Backfilling token counts for {len(ids)} messages in ChromaDB")
+        for i in range(0, len(ids), batch_size):
+            self.get_messages_by_ids(ids[i:i+batch_size])
+
+    def fill_token_counts(self, msgs, metadatas):
+        """Count the tokens of messages stored without a token count in one batch, and write the counts back to ChromaDB so they're only counted once"""
+        missing = [i for i in range(len(msgs)) if "token_count" not in metadatas[i]]
+        if len(missing) == 0:
+            return
+        token_counts = self.conversation_manager.tokenizer.get_token_counts_of_messages([msgs[i] for i in missing])
+        for i, token_count in zip(missing, token_counts):
+            metadatas[i]["token_count"] = token_count
+            msgs[i]["token_count"] = token_count
+        self.messages_memories.update(ids=[msgs[i]["id"] for i in missing], metadatas=[metadatas[i] for i in missing])
+        logging.info(f"Stored token counts for {len(missing)} messages in ChromaDB")
+
+    def index_message(self, message_id, timestamp):
+        """Add a message to the ordered message index"""
+        if message_id in self.message_positions:
+            return
+        position = bisect.bisect_right(self.message_timestamps, timestamp) # almost always the end of the index
+        self.message_ids.insert(position, message_id)
+        self.message_timestamps.insert(position, timestamp)
+        for i in range(position, len(self.message_ids)):
+            self.message_positions[self.message_ids[i]] = i
+
+    def unindex_message(self, message_id):
+        """Remove a message from the ordered message index"""
+        position = self.message_positions.pop(message_id, None)
+        if position is None:
+            return
+        del self.message_ids[position]
+        del self.message_timestamps[position]
+        for i in range(position, len(self.message_ids)):
+            self.message_positions[self.message_ids[i]] = i
+
     def load_messages(self):
         """Load messages from the memory manager - Some memory managers may need to load messages from a file or database, and can also use this method to load old messages into the conversation_manager's messages"""
         if len(self.conversation_manager.messages) == 0:
@@ -178,6 +233,7 @@ class MemoryManager(base_MemoryManager):
             if self.config.empathy or message["role"] == self.name: # if empathy is enabled or the message is from the bot
                 self.emotional_state[emotion] += emotion_data[emotion]
         self.messages_memories.add(documents=[message["content"]], metadatas=[memory_metadata], ids=[message["id"]])
+        self.index_message(message["id"], message["timestamp"])
         # test_memory = self.get_most_related_memories(message["content"],self.config.logical_memories,self.config.chromadb_memory_messages_before,self.config.chromadb_memory_messages_after)
         # logging.info(f"Most Related Memories:", json.dumps(test_memory, indent=2))
         logging.info(f"Added message to ChromaDB: {message}")
@@ -187,6 +243,7 @@ class MemoryManager(base_MemoryManager):
         if len(self.conversation_manager.messages) > 0:
             last_message = self.conversation_manager.messages[-1]
             self.messages_memories.delete(ids=[last_message["id"]])
+            self.unindex_message(last_message["id"])
             self.update_memories()
 
     @property
@@ -234,6 +291,7 @@ class MemoryManager(base_MemoryManager):
         )
         print(message_query)
         msgs = []
+        metadatas = []
         for i in range(len(message_query["documents"][0])):
             msg_doc = message_query["documents"][0][i]
             metadata = message_query["metadatas"][0][i]
@@ -260,19 +318,28 @@ class MemoryManager(base_MemoryManager):
             }
             if "name" in metadata:
                 msg["name"] = metadata["name"]
-            if "token_count" not in metadata:
-                metadata["token_count"] = self.conversation_manager.tokenizer.get_token_count_of_message(msg)
-            msg["token_count"] = metadata["token_count"]
+            if "token_count" in metadata:
+                msg["token_count"] = metadata["token_count"]
             msgs.append(msg)
+            metadatas.append(metadata)
+        self.fill_token_counts(msgs, metadatas)
         return msgs
     
     def get_most_related_memories(self, query_string, n_results=1, messages_before=2, messages_after=2):
         """Get the most related memories to a query string from the memory of this character"""
         logging.info(f"Getting most related memories to query string:", query_string)
         msgs = self.get_related_messages(query_string, n_results)
-        memories = []
+        # Work out the context window of every hit from the index first, so all of them can be fetched with a single get()
+        windows = []
+        window_ids = []
         for msg in msgs:
-            memory = self.get_around_message(msg, messages_before, messages_after)
+            window = self.get_around_message_ids(msg, messages_before, messages_after)
+            windows.append(window)
+            window_ids.extend(window)
+        messages_by_id = self.get_messages_by_ids(window_ids)
+        memories = []
+        for window in windows:
+            memory = [messages_by_id[message_id] for message_id in window if message_id in messages_by_id]
             memories.append(memory)
         # Go through each memory, and if there are overlapping memories, combine them in the correct order without duplicate messages
         combined_memories = []
@@ -293,59 +360,68 @@ class MemoryManager(base_MemoryManager):
         # logging.info(f"Unique Memories:", json.dumps(unique_memories, indent=2)) # Disabled because it's too verbose
         return unique_memories
     
+    def format_message(self, msg_doc, metadata, id):
+        """Turn a document and its metadata from ChromaDB into a message"""
+        emotions = {}
+        for emotion in self.emotion_composition:
+            if emotion in metadata:
+                emotions[emotion] = metadata[emotion]
+        msg = {
+            "role": metadata["role"],
+            "timestamp": metadata["timestamp"],
+            "location": metadata["location"],
+            "type": "memory", # "message" or "memory"
+            "content": msg_doc,
+            "emotions": emotions,
+            "id": id,
+            "conversation_id": metadata["conversation_id"],
+        }
+        if "name" in metadata:
+            msg["name"] = metadata["name"]
+        if "token_count" in metadata: # missing token counts are filled in by fill_token_counts()
+            msg["token_count"] = metadata["token_count"]
+        return msg
+
     def get_all_messages(self):
         """Get all messages in the memory of this character"""
         messages = self.messages_memories.get()
         # print("All Messages:",json.dumps(messages, indent=2)) # Disabled because it's too verbose
         msgs = []
         for i in range(len(messages["documents"])):
-            msg_doc = messages["documents"][i]
-            metadata = messages["metadatas"][i]
-            id = messages["ids"][i]
-            emotions = {}
-            for emotion in self.emotion_composition:
-                if emotion in metadata:
-                    emotions[emotion] = metadata[emotion]
-            msg = {
-                "role": metadata["role"],
-                "timestamp": metadata["timestamp"],
-                "location": metadata["location"],
-                "type": "memory", # "message" or "memory"
-                "content": msg_doc,
-                "emotions": emotions,
-                "id": id,
-                "conversation_id": metadata["conversation_id"],
-            }
-            if "name" in metadata:
-                msg["name"] = metadata["name"]
-            if "token_count" not in metadata:
-                metadata["token_count"] = self.conversation_manager.tokenizer.get_token_count_of_message(msg)
-            msg["token_count"] = metadata["token_count"]
-            msgs.append(msg)
+            msgs.append(self.format_message(messages["documents"][i], messages["metadatas"][i], messages["ids"][i]))
+        self.fill_token_counts(msgs, messages["metadatas"])
+        return msgs
+
+    def get_messages_by_ids(self, ids):
+        """Get specific messages from the memory of this character - Returns a dict of id -> message"""
+        ids = list(dict.fromkeys(ids)) # remove duplicates, keeping the order
+        if len(ids) == 0:
+            return {}
+        messages = self.messages_memories.get(ids=ids)
+        msgs = {}
+        for i in range(len(messages["documents"])):
+            msgs[messages["ids"][i]] = self.format_message(messages["documents"][i], messages["metadatas"][i], messages["ids"][i])
+        self.fill_token_counts(list(msgs.values()), messages["metadatas"])
         return msgs
 
     def get_message_index(self, message):
         """Get the index of a message"""
-        messages = self.get_all_messages()
-        for i in range(len(messages)):
-            if messages[i]["id"] == message["id"]:
-                return i # Message found
-        return -1 # Message not found
+        return self.message_positions.get(message["id"], -1)
 
-    def get_around_message(self, message, messages_before=2, messages_after=2):
-        """Get the messages around a message"""
-        logging.info(f"Getting messages around message:", json.dumps(message, indent=2))
+    def get_around_message_ids(self, message, messages_before=2, messages_after=2):
+        """Get the ids of the messages around a message, in timestamp order"""
         message_index = self.get_message_index(message)
-        messages = self.get_all_messages()
         if message_index == -1:
             logging.error("Message not found in memory, cannot get messages around it.")
             return []
-        around_messages = []
-        for i in range(message_index-messages_before, message_index+messages_after+1):
-            if i >= 0 and i < len(messages):
-                around_messages.append(messages[i])
-        # sort by timestamp
-        around_messages = sorted(around_messages, key=lambda x: x["timestamp"])
+        return self.message_ids[max(0, message_index-messages_before):message_index+messages_after+1]
+
+    def get_around_message(self, message, messages_before=2, messages_after=2):
+        """Get the messages around a message"""
+        logging.info(f"Getting messages around message:", json.dumps(message, indent=2))
+        around_ids = self.get_around_message_ids(message, messages_before, messages_after)
+        messages_by_id = self.get_messages_by_ids(around_ids)
+        around_messages = [messages_by_id[message_id] for message_id in around_ids if message_id in messages_by_id]
         return around_messages
 
     @property
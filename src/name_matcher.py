@@ -0,0 +1,85 @@
+print("Importing name_matcher.py")
+from src.logging import logging
+from collections import deque
+logging.info("Imported required libraries in name_matcher.py")
+
+def is_word_char(char):
+    return char.isalnum() or char == "_"
+
+def is_whole_word(text, start, end):
+    """Check that text[start:end] isn't part of a longer word"""
+    if start > 0 and is_word_char(text[start-1]):
+        return False
+    if end < len(text) and is_word_char(text[end]):
+        return False
+    return True
+
+def contains_name(text, name):
+    """Case-insensitive whole word check for a single name"""
+    text = text.lower()
+    name = name.lower()
+    if name == "":
+        return False
+    start = text.find(name)
+    while start != -1:
+        if is_whole_word(text, start, start+len(name)):
+            return True
+        start = text.find(name, start+1)
+    return False
+
+class NameMatcher:
+    """Aho-Corasick automaton over a list of names - Finds every name in a message in a single pass over the message, including names with spaces in them.
+
+    Matching is case-insensitive and only counts whole words, so "Ulfric Stormcloak" matches "ulfric stormcloak's army" but "Ra" doesn't match "Rattles"."""
+    def __init__(self, names):
+        self.goto = [{}] # state -> {char: next state}
+        self.fail = [0] # state -> longest proper suffix state
+        self.outputs = [[]] # state -> names ending at this state
+        self.names = {} # lowercase name -> name as written in the first place it was added
+        for name in names:
+            if name is None or name.strip() == "":
+                continue
+            lower_name = name.lower()
+            if lower_name in self.names:
+                continue
+            self.names[lower_name] = name
+            self._add(lower_name)
+        self._build_fail_links()
+        logging.info(f"Built name matcher for {len(self.names)} names with {len(self.goto)} states")
+
+    def _add(self, lower_name):
+        state = 0
+        for char in lower_name:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.outputs[state].append(lower_name)
+
+    def _build_fail_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail != 0 and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]] # names that are suffixes of this one end here too
+
+    def find(self, text):
+        """Return the names found in text, in the order they first appear"""
+        text = text.lower()
+        found = {}
+        state = 0
+        for i, char in enumerate(text):
+            while state != 0 and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for lower_name in self.outputs[state]:
+                if lower_name not in found and is_whole_word(text, i+1-len(lower_name), i+1):
+                    found[lower_name] = self.names[lower_name]
+        return list(found.values())
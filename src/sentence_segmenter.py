@@ -0,0 +1,145 @@
+print("Importing sentence_segmenter.py")
+from src.logging import logging
+import unicodedata
+logging.info("Imported required libraries in sentence_segmenter.py")
+
+class ChunkEvent:
+    """What the segmenter found in one chunk of the LLM's output"""
+    def __init__(self, content, end_of_sentence, roleplay_symbol, eos):
+        self.content = content # the chunk with the prompt style's replacements applied
+        self.end_of_sentence = end_of_sentence # the chunk contains an end of sentence character
+        self.roleplay_symbol = roleplay_symbol # the chunk contains a roleplay prefix/suffix or one of their aliases
+        self.eos = eos # the EOS token has been seen in the reply so far
+
+class SentenceSegmenter:
+    """Incrementally scans a streamed LLM reply for the markers process_response() reacts to - EOS tokens, stop strings, replacements, the message signifier after the author's name, end of sentence characters and roleplay symbols.
+
+    Every check only looks at the characters added since the last check (plus enough of the old text to catch a marker split across two chunks), so the work per response grows linearly with its length instead of rescanning the whole reply for every token."""
+    def __init__(self, end_of_sentence_chars, roleplay_symbols, replacements, stop, eos_token, message_signifier):
+        self.end_of_sentence_chars = tuple(char for char in end_of_sentence_chars if char != '')
+        self.roleplay_symbols = tuple(symbol for symbol in roleplay_symbols if symbol != '')
+        self.replacements = [(replacement["char"], replacement["replacement"]) for replacement in replacements if replacement["char"] != '']
+        self.longest_replacement = max([len(char) for char, _ in self.replacements], default=1)
+        self.stop = list(stop)
+        self.longest_stop = max([len(char) for char in self.stop], default=1)
+        self.eos_token = eos_token
+        self.lower_eos_token = eos_token.lower()
+        self.message_signifier = message_signifier
+        self.reset()
+
+    def reset(self):
+        """Forget the reply so far - called at the start of every retry"""
+        self._raw_parts = [] # the raw reply, joined lazily so appending a token doesn't copy the whole reply
+        self._raw_tail = '' # the end of the raw reply, long enough to catch an EOS token split across chunks
+        self.eos = False
+        self.proposed_next_author = ''
+
+    @property
+    def raw_reply(self):
+        if len(self._raw_parts) > 1:
+            self._raw_parts = [''.join(self._raw_parts)]
+        return self._raw_parts[0] if len(self._raw_parts) > 0 else ''
+
+    @raw_reply.setter
+    def raw_reply(self, raw_reply):
+        self._raw_parts = [raw_reply]
+        self._raw_tail = raw_reply[-len(self.eos_token)+1:] if len(self.eos_token) > 1 else ''
+
+    def feed(self, content):
+        """Add the next chunk of the LLM's output to the raw reply and scan it"""
+        self._raw_parts.append(content)
+        if not self.eos:
+            window = self._raw_tail + content
+            if self.eos_token in window:
+                logging.info(f"Sentence contains EOS token. Stopping generation.")
+                self.eos = True
+            elif self.lower_eos_token in window.lower():
+                logging.info(f"Sentence probably contains EOS token(determined by lower() checking.). Stopping generation.")
+                self.eos = True
+            self._raw_tail = window[-len(self.eos_token)+1:] if len(self.eos_token) > 1 else ''
+
+        normalized_content = unicodedata.normalize('NFKC', content)
+        end_of_sentence = any(char in normalized_content for char in self.end_of_sentence_chars)
+        roleplay_symbol = any(symbol in normalized_content for symbol in self.roleplay_symbols)
+        for char, replacement_char in self.replacements:
+            if char in content:
+                logging.debug(f"Replacement character '{char}' found in sentence: '{content}'")
+                content = content.replace(char, replacement_char)
+        return ChunkEvent(content, end_of_sentence, roleplay_symbol, self.eos)
+
+    def propose_author(self, content):
+        """Add content to the proposed author name - returns True once the message signifier that ends the name has been generated"""
+        window_start = max(0, len(self.proposed_next_author) - len(self.message_signifier) + 1)
+        self.proposed_next_author += content
+        return self.message_signifier in self.proposed_next_author[window_start:]
+
+    def author_found(self):
+        """Drop the author's name and the message signifier from the start of the raw reply"""
+        self.raw_reply = self.raw_reply.split(self.message_signifier, 1)[1]
+
+    def append_to_sentence(self, sentence, content):
+        """Add content to the sentence in progress, applying replacements and cutting the sentence (and the raw reply) off at the first stop string"""
+        replacement_start = max(0, len(sentence) - self.longest_replacement + 1)
+        stop_start = max(0, len(sentence) - self.longest_stop + 1)
+        sentence += content
+        logging.debug(f"Sentence in progress: {sentence}")
+        if len(self.replacements) > 0:
+            tail = sentence[replacement_start:]
+            for char, replacement_char in self.replacements:
+                if char in tail:
+                    logging.debug(f"Replacement character '{char}' found in sentence: {sentence}")
+                    tail = tail.replace(char, replacement_char)
+            sentence = sentence[:replacement_start] + tail
+        for char in self.stop:
+            if char in sentence[stop_start:]:
+                logging.debug(f"Banned character '{char}' found in sentence: {sentence}")
+                self.eos = True
+                sentence = sentence.split(char)[0]
+                self.raw_reply = self.raw_reply.split(char)[0]
+                logging.info(f"Trimming last sentence to: {sentence}")
+        return sentence
+
+    def trim_to_eos(self, sentence):
+        """Cut the sentence and the raw reply off at the EOS token"""
+        self.raw_reply = self.raw_reply.split(self.eos_token)[0]
+        return sentence.split(self.eos_token)[0]
+
+class ReplyBuilder:
+    """Builds the full reply out of sentences without copying everything generated so far every time a sentence is added.
+
+    append() behaves like `full_reply = full_reply.strip() + "".join(pieces)`, and str() gives the stripped result."""
+    def __init__(self):
+        self.parts = []
+
+    def _rstrip(self):
+        while len(self.parts) > 0:
+            last_part = self.parts[-1].rstrip()
+            if last_part != '':
+                self.parts[-1] = last_part
+                return
+            self.parts.pop()
+
+    def append(self, *pieces):
+        self._rstrip()
+        self.parts.extend([piece for piece in pieces if piece != ''])
+
+    def endswith(self, suffix):
+        """Same as str(self).endswith(suffix)"""
+        self._rstrip()
+        tail = ''
+        i = len(self.parts) - 1
+        while len(tail) < len(suffix) and i >= 0:
+            tail = self.parts[i] + tail
+            i -= 1
+        if i < 0: # the whole reply is in tail, so strip it like str() would
+            tail = tail.lstrip()
+        return tail.endswith(suffix)
+
+    def is_empty(self):
+        self._rstrip()
+        return len(self.parts) == 0
+
+    def __str__(self):
+        if len(self.parts) > 1:
+            self.parts = [''.join(self.parts)]
+        return self.parts[0].strip() if len(self.parts) > 0 else ''
@@ -0,0 +1,237 @@
+print("Importing streaming_json.py")
+from src.logging import logging
+import json
+import re
+logging.info("Imported required libraries in streaming_json.py")
+
+plain_string_characters = re.compile(r'[^"\\]+') # everything in a string up to the next quote or escape
+whitespace = " \t\r\n"
+escapes = {
+    '"': '"',
+    '\\': '\\',
+    '/': '/',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+}
+
+# parser states
+START = 0 # before the opening bracket of the root object, anything here is ignored
+OBJECT_START = 1 # after "{" - expecting a key or "}"
+KEY_START = 2 # after "," in an object - expecting a key
+KEY = 3 # inside a key
+COLON = 4 # after a key - expecting ":"
+ARRAY_START = 5 # after "[" - expecting a value or "]"
+VALUE = 6 # expecting a value
+STRING = 7 # inside a string value
+ESCAPE = 8 # after a backslash in a string
+UNICODE = 9 # inside a \uXXXX escape
+LITERAL = 10 # inside a number, true, false or null
+AFTER_VALUE = 11 # expecting "," or a closing bracket
+DONE = 12 # the root object has been closed, anything after it is ignored
+
+class StreamingJSONParser:
+    """Parses a JSON object as it's streamed from the LLM, one chunk at a time, without ever re-parsing what came before.
+
+    feed() returns what changed in that chunk, shaped like the object itself - text appended to a string is returned as just the new text, new keys and finished numbers/literals are returned as their value, and changes inside lists are returned as a dict of {index: change}. For example, feeding '{"thoughts": "I wonder' and then ' why", "response_to_user": "Hi' returns {"thoughts": "I wonder"} and then {"thoughts": " why", "response_to_user": "Hi"}.
+
+    `value` is the object parsed so far, with unfinished strings included as far as they've been generated. It is updated in place as more chunks are fed."""
+    def __init__(self):
+        self.value = None
+        self.stack = [] # [container, key or index of the child being parsed] for every open object/array
+        self.state = START
+        self.key_parts = []
+        self.string_parts = [] # text added to the current string value since it was last written into its container
+        self.literal = ''
+        self.unicode = ''
+        self.high_surrogate = ''
+        self.in_key = False
+        self.delta = {}
+
+    def feed(self, text):
+        """Parse the next chunk of the response and return the changes it made"""
+        self.delta = {}
+        i = 0
+        length = len(text)
+        while i < length:
+            state = self.state
+            if state == STRING or state == KEY:
+                match = plain_string_characters.match(text, i)
+                if match is not None:
+                    self._string_text(match.group())
+                    i = match.end()
+                    continue
+                char = text[i]
+                i += 1
+                if char == '"':
+                    self._end_string()
+                else: # backslash
+                    self.state = ESCAPE
+                continue
+            if state == ESCAPE:
+                char = text[i]
+                i += 1
+                if char == 'u':
+                    self.unicode = ''
+                    self.state = UNICODE
+                else:
+                    self._string_text(escapes.get(char, char))
+                    self.state = KEY if self.in_key else STRING
+                continue
+            if state == UNICODE:
+                take = min(4 - len(self.unicode), length - i)
+                self.unicode += text[i:i+take]
+                i += take
+                if len(self.unicode) == 4:
+                    self._unicode_escape()
+                    self.state = KEY if self.in_key else STRING
+                continue
+
+            char = text[i]
+            i += 1
+            if state == START:
+                if char == '{' or char == '[':
+                    self._open(char)
+            elif state == DONE:
+                break
+            elif char in whitespace:
+                if state == LITERAL:
+                    self._end_literal()
+            elif state == LITERAL:
+                if char == ',' or char == '}' or char == ']':
+                    self._end_literal()
+                    self._after_value(char)
+                else:
+                    self.literal += char
+            elif state == AFTER_VALUE:
+                self._after_value(char)
+            elif state == OBJECT_START or state == KEY_START:
+                if char == '"':
+                    self.in_key = True
+                    self.key_parts = []
+                    self.state = KEY
+                elif char == '}':
+                    self._close()
+            elif state == COLON:
+                if char == ':':
+                    self.state = VALUE
+            elif state == ARRAY_START and char == ']':
+                self._close()
+            else: # VALUE or ARRAY_START
+                self._start_value(char)
+        self._flush_string()
+        return self.delta
+
+    def _after_value(self, char):
+        if char == ',':
+            self.state = KEY_START if isinstance(self.stack[-1][0], dict) else VALUE
+        elif char == '}' or char == ']':
+            self._close()
+
+    def _start_value(self, char):
+        if char == '{' or char == '[':
+            self._open(char)
+        elif char == '"':
+            self.in_key = False
+            self.string_parts = []
+            self._set_value('')
+            self._delta_parent()[self.stack[-1][1]] = ''
+            self.state = STRING
+        else:
+            self.literal = char
+            self.state = LITERAL
+
+    def _set_value(self, value):
+        """Put a new value in the innermost open object/array"""
+        frame = self.stack[-1]
+        if isinstance(frame[0], list):
+            frame[1] = len(frame[0])
+            frame[0].append(value)
+        else:
+            frame[0][frame[1]] = value
+
+    def _delta_parent(self):
+        """Get the dict in this chunk's delta that changes to the innermost open object/array go in"""
+        node = self.delta
+        for frame in self.stack[:-1]:
+            child = node.get(frame[1])
+            if not isinstance(child, dict):
+                child = {}
+                node[frame[1]] = child
+            node = child
+        return node
+
+    def _open(self, char):
+        container = {} if char == '{' else []
+        if len(self.stack) == 0:
+            self.value = container
+        else:
+            self._set_value(container)
+            self._delta_parent()[self.stack[-1][1]] = {}
+        self.stack.append([container, None])
+        self.state = OBJECT_START if char == '{' else ARRAY_START
+
+    def _close(self):
+        self.stack.pop()
+        self.state = AFTER_VALUE if len(self.stack) > 0 else DONE
+
+    def _string_text(self, text):
+        if self.high_surrogate != '':
+            high_surrogate = self.high_surrogate
+            self.high_surrogate = ''
+            self._string_text(high_surrogate)
+        if self.in_key:
+            self.key_parts.append(text)
+        else:
+            self.string_parts.append(text)
+
+    def _unicode_escape(self):
+        try:
+            code = int(self.unicode, 16)
+        except ValueError:
+            logging.debug(f"Invalid unicode escape in streamed JSON: \\u{self.unicode}")
+            self._string_text('\\u' + self.unicode)
+            return
+        if 0xDC00 <= code <= 0xDFFF and self.high_surrogate != '': # second half of a surrogate pair
+            code = 0x10000 + ((ord(self.high_surrogate) - 0xD800) << 10) + (code - 0xDC00)
+            self.high_surrogate = ''
+            self._string_text(chr(code))
+        elif 0xD800 <= code <= 0xDBFF: # first half of a surrogate pair, wait to see if the second half follows
+            self._string_text('')
+            self.high_surrogate = chr(code)
+        else:
+            self._string_text(chr(code))
+
+    def _end_string(self):
+        if self.high_surrogate != '':
+            self._string_text('')
+        if self.in_key:
+            self.stack[-1][1] = ''.join(self.key_parts)
+            self.key_parts = []
+            self.state = COLON
+        else:
+            self._flush_string()
+            self.state = AFTER_VALUE
+
+    def _flush_string(self):
+        """Write the text parsed since the last flush into the string value and this chunk's delta"""
+        if self.state not in (STRING, ESCAPE, UNICODE, AFTER_VALUE) or self.in_key or len(self.string_parts) == 0:
+            return
+        text = ''.join(self.string_parts)
+        self.string_parts = []
+        container, key = self.stack[-1]
+        container[key] = container[key] + text
+        delta_parent = self._delta_parent()
+        delta_parent[key] = delta_parent.get(key, '') + text
+
+    def _end_literal(self):
+        self.state = AFTER_VALUE
+        try:
+            value = json.loads(self.literal)
+        except ValueError:
+            logging.debug(f"Invalid value in streamed JSON: {self.literal}")
+            return
+        self._set_value(value)
+        self._delta_parent()[self.stack[-1][1]] = value
@@ -0,0 +1,171 @@
+print("Importing synthesis_executor.py")
+from src.logging import logging, time
+import asyncio
+import concurrent.futures
+import traceback
+logging.info("Imported required libraries in synthesis_executor.py")
+
+class SynthesisJob:
+    """A single voiceline waiting to be synthesized, lip synced and delivered to the game interface"""
+    def __init__(self, index, voiceline, character, file_name):
+        self.index = index
+        self.voiceline = voiceline
+        self.character = character
+        self.file_name = file_name # unique per in-flight job so a line being synthesized never overwrites a line waiting to be delivered
+        self.settings = None # voice model settings, resolved before the job is handed to a worker thread
+        self.future = None
+        self.timings = {} # per-stage latencies in seconds - queued, tts, synthesis, lip, lip_wait, delivery
+        self.submitted_at = time.time()
+
+class SynthesisExecutor:
+    """Runs voiceline synthesis on worker threads so the LLM can keep streaming while earlier lines are synthesized and played.
+
+    process_response() -> submit() -> worker thread (TTS) -> lip sync worker (lip generation) -> _deliver() -> sentence_queue -> send_response()
+
+A TTS worker hands each line's lip generation to the lip sync service and moves straight on to the next line, so lip syncing one line overlaps with synthesizing the next.
+
+    Jobs are delivered to the sentence queue in the order they were submitted, no matter which worker finishes first. At most `depth` jobs can be waiting behind the one currently being delivered, after which submit() waits for room, so the LLM can't run arbitrarily far ahead of playback."""
+    def __init__(self, conversation_manager, workers=None, depth=None):
+        self.conversation_manager = conversation_manager
+        self.config = self.conversation_manager.config
+        self.workers = max(1, int(workers if workers is not None else self.config.synthesis_workers))
+        self.depth = max(1, int(depth if depth is not None else self.config.synthesis_queue_depth))
+        self.ring_size = self.depth + 3 # pending jobs + the job being awaited + the job in the sentence queue + the job being copied to the game
+        self.executor = None # started by the first submit() of a conversation, stopped by shutdown() when it ends
+        self.pending = None
+        self.delivery_task = None
+        self.sentence_queue = None
+        self.event = None
+        self.error = None
+        self.job_count = 0
+        self.start_time = None
+        self.first_audio_time = None
+        self.stage_totals = {}
+        logging.config(f"Synthesis executor started with {self.workers} worker(s) and a queue depth of {self.depth}")
+
+    @property
+    def synthesizer(self):
+        return self.conversation_manager.synthesizer
+
+    def start(self, sentence_queue, event):
+        """Start a new response - must be called from inside the running event loop before submit()"""
+        if self.delivery_task is not None and not self.delivery_task.done(): # a previous response was abandoned by an error
+            self.delivery_task.cancel()
+        self.sentence_queue = sentence_queue
+        self.event = event
+        self.pending = asyncio.Queue(maxsize=self.depth)
+        self.error = None
+        self.job_count = 0
+        self.start_time = time.time()
+        self.first_audio_time = None
+        self.stage_totals = {}
+        self.delivery_task = asyncio.ensure_future(self._deliver())
+
+    def raise_if_failed(self):
+        """Raise the first error a synthesis job hit, if any, on the event loop's side"""
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            logging.error(f"TTS Error: {error}")
+            input('Press enter to continue...')
+            raise error
+
+    async def submit(self, voiceline, character):
+        """Queue a voiceline for synthesis and return once there's room for it in the pipeline"""
+        self.raise_if_failed()
+        job = SynthesisJob(self.job_count, voiceline, character, f"voiceline_{self.job_count % self.ring_size}")
+        self.job_count += 1
+        job.settings = self.synthesizer.prepare_synthesis(character) # resolved here on the event loop's thread, it can open Tk dialogs and those only work on the main thread
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pantella_tts")
+        loop = asyncio.get_running_loop()
+        job.future = loop.run_in_executor(self.executor, self._run_job, job)
+        logging.debug(f"Submitted voiceline {job.index} for synthesis: {voiceline}")
+        await self.pending.put(job) # blocks while the queue is full - backpressure on the LLM stream
+        return job
+
+    def _run_job(self, job):
+        """Synthesize a voiceline - runs on a worker thread"""
+        start = time.time()
+        job.timings["queued"] = start - job.submitted_at
+        audio_file = self.synthesizer.synthesize(job.voiceline, job.character, final_voiceline_file_name=job.file_name, timings=job.timings, wait_for_lip=False, settings=job.settings)
+        job.timings["synthesis"] = time.time() - start
+        return audio_file
+
+    async def _deliver(self):
+        """Hand finished voicelines to the game interface in submission order"""
+        while True:
+            job = await self.pending.get()
+            try:
+                if job is None:
+                    break
+                try:
+                    audio_file = await job.future
+                except Exception as e:
+                    logging.error(f"TTS Error while synthesizing voiceline {job.index}: {e}")
+                    logging.error(traceback.format_exc())
+                    if self.error is None:
+                        self.error = e
+                    continue
+                if self.error is not None: # don't play anything after a line that failed
+                    continue
+                lip_job = self.synthesizer.pop_lip_job(audio_file) if audio_file != '' else None
+                if lip_job is not None: # the lip file has to exist before the game interface copies it
+                    lip_wait_start = time.time()
+                    job.timings["lip"] = await asyncio.wrap_future(lip_job)
+                    job.timings["lip_wait"] = time.time() - lip_wait_start
+                delivery_start = time.time()
+                await self.sentence_queue.put([audio_file, job.voiceline, job.character]) # the character is sent along because active_character may have moved on to the next speaker by the time this line plays
+                self.event.clear() # clear the event for the next line
+                logging.debug("Waiting for event to be set before delivering the next line")
+                await self.event.wait() # wait for send_response() to pick the line up before handing over the next one
+                job.timings["delivery"] = time.time() - delivery_start
+                if self.first_audio_time is None:
+                    self.first_audio_time = delivery_start - self.start_time
+                    logging.info(f"Time to first audio: {round(self.first_audio_time, 5)} seconds")
+                self.log_timings(job)
+            finally:
+                self.pending.task_done()
+
+    def log_timings(self, job):
+        """Log the per-stage latencies of a job and add them to the running totals for this response"""
+        for stage, duration in job.timings.items():
+            self.stage_totals[stage] = self.stage_totals.get(stage, 0) + duration
+        timings = ", ".join([f"{stage}: {round(duration, 5)}s" for stage, duration in job.timings.items()])
+        logging.info(f"Voiceline {job.index} stage timings - {timings}")
+
+    async def flush(self):
+        """Wait until every submitted voiceline has been handed to the game interface"""
+        if self.pending is not None:
+            await self.pending.join()
+        self.raise_if_failed()
+
+    async def finish(self):
+        """Deliver the remaining voicelines and stop the delivery task for this response"""
+        if self.delivery_task is None:
+            return
+        await self.pending.put(None)
+        await self.delivery_task
+        self.delivery_task = None
+        if self.job_count > 0:
+            totals = ", ".join([f"{stage}: {round(duration, 5)}s" for stage, duration in self.stage_totals.items()])
+            logging.info(f"Synthesized {self.job_count} voiceline(s) in {round(time.time() - self.start_time, 5)} seconds - stage totals: {totals}")
+        self.raise_if_failed()
+
+    def shutdown(self):
+        """Drop every voiceline that hasn't been delivered yet and stop the worker threads and the lip sync worker - called when a conversation ends, the next submit() starts new workers"""
+        if self.delivery_task is not None and not self.delivery_task.done():
+            self.delivery_task.cancel()
+        self.delivery_task = None
+        if self.pending is not None:
+            while not self.pending.empty():
+                job = self.pending.get_nowait()
+                if job is not None:
+                    job.future.cancel() # jobs a worker hasn't started yet never run
+                self.pending.task_done()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.synthesizer.lip_sync.shutdown()
+        self.error = None
+        logging.debug("Synthesis executor stopped")
@@ -72,6 +72,19 @@ class base_Tokenizer(): # Tokenizes(only availble for counting the tokens in a s
         if "name" not in message:
             message["name"] = None
         return self.get_token_count(self.new_message(message["content"], message["role"], message["name"]))
+
+    def get_token_counts_of_messages(self, messages): # Returns the number of tokens in each message of a list of messages
+        """Returns the number of tokens in each message of a list of messages"""
+        strings = []
+        for message in messages:
+            if "name" not in message:
+                message["name"] = None
+            strings.append(self.new_message(message["content"], message["role"], message["name"]))
+        return self.get_token_counts(strings)
+
+    def get_token_counts(self, strings):
+        """Returns the number of tokens in each string of a list of strings - Override this in tokenizers that can count a batch of strings faster than one at a time"""
+        return [self.get_token_count(string) for string in strings]
         
     def get_token_count(self, string):
         """Returns the number of tokens in a string"""
@@ -25,4 +25,11 @@ class Tokenizer(tokenizer.base_Tokenizer): # Tokenizes(only availble for countin
         """Returns the number of tokens in the string"""
         tokens = self.tokenizer.encode(string)
         num_tokens = len(tokens)
-        return num_tokens
\ No newline at end of file
+        return num_tokens
+
+    @utils.time_it
+    def get_token_counts(self, strings):
+        """Returns the number of tokens in each string"""
+        if len(strings) == 0:
+            return []
+        return [len(tokens) for tokens in self.tokenizer(strings)["input_ids"]]
\ No newline at end of file
@@ -15,6 +15,7 @@ class Tokenizer(tokenizer.base_Tokenizer): # Gets token count from Kobold's API
             raise ValueError(f"koboldcpp tokenizer only works using OpenAI's API! Please check your {self.config.config_path} file and try again!")
         self.tokenizer_slug = tokenizer_slug
         self.client = client # Unnecessary for this tokenizer, but it's here for compatibility with other openai tokenizers
+        self.session = requests.Session() # keep the connection to koboldcpp alive between token counts
         
     @utils.time_it
     def get_token_count(self, string):
@@ -22,13 +23,13 @@ class Tokenizer(tokenizer.base_Tokenizer): # Gets token count from Kobold's API
         data = {"prompt": string}
         try:
             url = self.config.alternative_openai_api_base.replace("/v1/","") + "/api/extra/tokencount"
-            r = requests.post(url, json=data)
+            r = self.session.post(url, json=data)
             r.raise_for_status()
             r = r.json()
         except:
             try:
                 url = self.config.alternative_openai_api_base.replace("/v1","") + "/extra/tokencount"
-                r = requests.post(url, json=data)
+                r = self.session.post(url, json=data)
                 r.raise_for_status()
                 r = r.json()
             except Exception as e:
@@ -23,4 +23,9 @@ class Tokenizer(tokenizer.base_Tokenizer): # Tokenizes(only availble for countin
         """Returns the number of tokens in the string"""
         tokens = self.encoding.encode(string)
         num_tokens = len(tokens)
-        return num_tokens
\ No newline at end of file
+        return num_tokens
+
+    @utils.time_it
+    def get_token_counts(self, strings):
+        """Returns the number of tokens in each string"""
+        return [len(tokens) for tokens in self.encoding.encode_batch(strings)]
\ No newline at end of file
@@ -27,6 +27,9 @@ try:
     import chinese
     import soundfile as sf
     import LangSegment
+    import hashlib
+    import threading
+    from collections import OrderedDict
     imported = True
     logging.info("Imported GPT-SoVITS libraries")
 except Exception as e:
@@ -240,6 +243,8 @@ default_settings = {
     "gpt_sovits_trim_long_short_reference_audio": True,
     "is_bigvgan_half": True,
     "gpt_sovits_banned_voice_models": [],
+    "gpt_sovits_prompt_cache_mb": 256,
+    "gpt_sovits_prompt_cache_to_disk": True,
 }
 settings_description = {
     "gpt_sovits_is_half": "Whether to use half precision for the GPT-SoVITS model. This can reduce VRAM usage and speed up inference, but may also reduce audio quality. If you have at least 6GB of VRAM, you can set this to True. If you have less than 6GB of VRAM, you should set this to True.",
@@ -253,7 +258,9 @@ settings_description = {
     "gpt_sovits_default_top_p": "The top-p value of the model. Higher values will make the model more creative, lower values will make the model more conservative.",
     "gpt_sovits_error_on_too_short_or_too_long_audio": "Whether to raise an error if the generated audio is too short or too long. This can be useful to prevent generating audio that is too short or too long, which can be a common issue with TTS models. The default is True, which means that an error will be raised if the generated audio is shorter than 0.5 seconds or longer than 30 seconds.",
     "is_bigvgan_half": "Whether to use half precision for the BigVGAN vocoder. This can reduce VRAM usage and speed up inference, but may also reduce audio quality. If you have at least 6GB of VRAM, you can set this to True. If you have less than 6GB of VRAM, you should set this to True.",
-    "gpt_sovits_banned_voice_models": "A list of voice models to ban from being used by GPT-SoVITS. This can be changed in your [game_id]_config.json. This is useful if you have a voice model that causes issues with GPT-SoVITS, such as extremely long synthesis times or crashes."
+    "gpt_sovits_banned_voice_models": "A list of voice models to ban from being used by GPT-SoVITS. This can be changed in your [game_id]_config.json. This is useful if you have a voice model that causes issues with GPT-SoVITS, such as extremely long synthesis times or crashes.",
+    "gpt_sovits_prompt_cache_mb": "How much memory in megabytes to use for keeping each speaker's prompt (semantic tokens, reference spectrogram, and prompt phones and BERT features), so switching between speakers doesn't have to process their reference audio and transcription again. The least recently used speakers are dropped when it's full.",
+    "gpt_sovits_prompt_cache_to_disk": "Whether to also save each speaker's prompt to data/gpt_sovits_prompts, so it doesn't have to be computed again after Pantella restarts."
 }
 options = {
     "prompt_language": [
@@ -495,6 +502,10 @@ class Synthesizer(base_tts.base_Synthesizer):
         self.hz = 50
         self.max_sec = 10
         self.cache = {}
+        self.prompt_cache = OrderedDict() # prompt key -> (prompt data, size in bytes), least recently used first
+        self.prompt_cache_bytes = 0
+        self.prompt_cache_lock = threading.Lock()
+        self.prompt_cache_dir = os.path.join(self.output_path, "gpt_sovits_prompts")
 
         self.gpt_sovits_sovits_path = sovits_base_dir_path+"s2G488k.pth"
         self.gpt_sovits_gpt_path = sovits_base_dir_path+"s1bert25hz-2kh-longer-epoch=68e-step=50232.ckpt"
@@ -511,6 +522,7 @@ class Synthesizer(base_tts.base_Synthesizer):
 
     def unload(self):
         """Unload the TTS engine and free up any resources it's using. This is called when the TTS engine is changed or when Pantella is closed."""
+        super().unload() # stop the lip sync worker
         global loaded
         if not loaded:
             return
@@ -740,33 +752,16 @@ class Synthesizer(base_tts.base_Synthesizer):
         # with open("./weight.json","w")as f:
         #     f.write(json.dumps(data))
 
-    def get_tts_wav(self, ref_wav_path, prompt_text, text, ref_free=False, speed=1, if_freeze=False, inp_refs=None, top_k=None, top_p=None, temperature=None):
-        # if ref_wav_path:
-        #     pass
-        # else:
-        #     gr.Warning('Please Upload the Reference Audio')
-        # if text:
-        #     pass
-        # else:
-        #     gr.Warning('Please Fill in the Terget Text')
-        t = []
-        if prompt_text is None or len(prompt_text) == 0:
-            ref_free = True
-        t0 = time.time()
-
-        if not ref_free:
-            prompt_text = prompt_text.strip("\n")
-            if (prompt_text[-1] not in splits): prompt_text += "。" if self.config.gpt_sovits_default_prompt_language != "en" else "."
-            print("Actual Input Reference Text:", prompt_text)
-        text = text.strip("\n")
-        # if (text[0] not in splits and len(get_first(text)) < 4): text = "。" + text if text_language != "en" else "." + text
-        
-        print("Actual Input Target Text:", text)
-        zero_wav = np.zeros(
-            int(self.hps.data.sampling_rate * 0.3),
-            dtype=self.np_dtype
-        )
+    def compute_prompt(self, ref_wav_path, prompt_text, ref_free):
+        """Process a speaker's reference audio and transcription into everything synthesis needs from them"""
+        prompt_data = {
+            "refer": self.get_spepc(ref_wav_path).to(self.torch_dtype).to(self.config.gpt_sovits_device),
+        }
         if not ref_free:
+            zero_wav = np.zeros(
+                int(self.hps.data.sampling_rate * 0.3),
+                dtype=self.np_dtype
+            )
             with torch.no_grad():
                 wav16k, sr = librosa.load(ref_wav_path, sr=16000)
                 if (wav16k.shape[0] > 160000 or wav16k.shape[0] < 48000):
@@ -795,7 +790,78 @@ class Synthesizer(base_tts.base_Synthesizer):
                 )  # .float()
                 codes = self.vq_model.extract_latent(ssl_content)
                 prompt_semantic = codes[0, 0]
-                prompt = prompt_semantic.unsqueeze(0).to(self.config.gpt_sovits_device)
+                prompt_data["prompt"] = prompt_semantic.unsqueeze(0).to(self.config.gpt_sovits_device)
+            phones1, bert1, norm_text1 = self.get_phones_and_bert(prompt_text)
+            prompt_data["phones"] = phones1
+            prompt_data["bert"] = bert1
+        return prompt_data
+
+    def get_prompt(self, ref_wav_path, prompt_text, ref_free):
+        """Get a speaker's prompt from memory, then disk, computing it only if it isn't cached in either"""
+        stat = os.stat(ref_wav_path)
+        # everything that changes the prompt - editing the reference audio changes its modification time, so stale prompts are never used
+        key = (os.path.abspath(ref_wav_path), stat.st_mtime_ns, stat.st_size, prompt_text, ref_free, self.config.gpt_sovits_default_prompt_language, self.config.gpt_sovits_version, self.gpt_sovits_sovits_path, self.config.gpt_sovits_is_half, self.config.gpt_sovits_trim_long_short_reference_audio)
+        with self.prompt_cache_lock:
+            if key in self.prompt_cache:
+                self.prompt_cache.move_to_end(key)
+                return self.prompt_cache[key][0]
+        prompt_file = os.path.join(self.prompt_cache_dir, hashlib.sha256(repr(key).encode('utf-8')).hexdigest() + ".pt")
+        prompt_data = None
+        if self.config.gpt_sovits_prompt_cache_to_disk and os.path.exists(prompt_file):
+            try:
+                prompt_data = torch.load(prompt_file, map_location=self.config.gpt_sovits_device, weights_only=True)
+                logging.info(f'{self.tts_slug} - loaded cached prompt for {ref_wav_path}')
+            except Exception as e:
+                logging.warning(f'{self.tts_slug} - could not load cached prompt from {prompt_file}, computing it again: {e}')
+        if prompt_data is None:
+            prompt_data = self.compute_prompt(ref_wav_path, prompt_text, ref_free)
+            if self.config.gpt_sovits_prompt_cache_to_disk:
+                try:
+                    os.makedirs(self.prompt_cache_dir, exist_ok=True)
+                    torch.save(prompt_data, prompt_file + ".tmp")
+                    os.replace(prompt_file + ".tmp", prompt_file)
+                except Exception as e:
+                    logging.warning(f'{self.tts_slug} - could not save prompt to {prompt_file}: {e}')
+        size = sum(value.numel() * value.element_size() for value in prompt_data.values() if torch.is_tensor(value))
+        max_bytes = self.config.gpt_sovits_prompt_cache_mb * 1048576
+        with self.prompt_cache_lock:
+            if key not in self.prompt_cache:
+                self.prompt_cache[key] = (prompt_data, size)
+                self.prompt_cache_bytes += size
+            while self.prompt_cache_bytes > max_bytes and len(self.prompt_cache) > 1: # drop the least recently used speakers, but always keep the one being used
+                _, (_, evicted_size) = self.prompt_cache.popitem(last=False)
+                self.prompt_cache_bytes -= evicted_size
+        return prompt_data
+
+    def get_tts_wav(self, ref_wav_path, prompt_text, text, ref_free=False, speed=1, if_freeze=False, inp_refs=None, top_k=None, top_p=None, temperature=None):
+        # if ref_wav_path:
+        #     pass
+        # else:
+        #     gr.Warning('Please Upload the Reference Audio')
+        # if text:
+        #     pass
+        # else:
+        #     gr.Warning('Please Fill in the Terget Text')
+        t = []
+        if prompt_text is None or len(prompt_text) == 0:
+            ref_free = True
+        t0 = time.time()
+
+        if not ref_free:
+            prompt_text = prompt_text.strip("\n")
+            if (prompt_text[-1] not in splits): prompt_text += "。" if self.config.gpt_sovits_default_prompt_language != "en" else "."
+            print("Actual Input Reference Text:", prompt_text)
+        text = text.strip("\n")
+        # if (text[0] not in splits and len(get_first(text)) < 4): text = "。" + text if text_language != "en" else "." + text
+        
+        print("Actual Input Target Text:", text)
+        zero_wav = np.zeros(
+            int(self.hps.data.sampling_rate * 0.3),
+            dtype=self.np_dtype
+        )
+        prompt_data = self.get_prompt(ref_wav_path, prompt_text, ref_free)
+        if not ref_free:
+            prompt = prompt_data["prompt"]
 
         t1 = time.time()
         t.append(t1-t0)
@@ -818,7 +884,7 @@ class Synthesizer(base_tts.base_Synthesizer):
         texts = merge_short_text_in_array(texts, 5)
         audio_opt = []
         if not ref_free:
-            phones1, bert1, norm_text1 = self.get_phones_and_bert(prompt_text)
+            phones1, bert1 = prompt_data["phones"], prompt_data["bert"]
 
         for i_text,text in enumerate(texts):
             # 解决输入目标文本的空行导致报错的问题
@@ -866,7 +932,7 @@ class Synthesizer(base_tts.base_Synthesizer):
                     except:
                         traceback.print_exc()
             if(len(refers)==0):
-                refers = [self.get_spepc(ref_wav_path).to(self.torch_dtype).to(self.config.gpt_sovits_device)]
+                refers = [prompt_data["refer"]]
             audio = (self.vq_model.decode(pred_semantic, torch.LongTensor(phones2).to(self.config.gpt_sovits_device).unsqueeze(0), refers,speed=speed).detach().cpu().numpy()[0, 0])
             max_audio=np.abs(audio).max()#简单防止16bit爆音
             if max_audio>1:audio/=max_audio
@@ -1,14 +1,17 @@
 from src.logging import logging
 logging.info("Importing base_tts.py")
 import src.utils as utils
-import subprocess
 import os
 from pathlib import Path
-import soundfile as sf
 import time
-import numpy as np
-import json
+import threading
 from src.ui import root, OptionDialog, StringInputPopup
+from src.voice_catalog import VoiceCatalog
+from src.json_file_cache import JSONFileCache
+from src.audio_buffer import AudioBuffer
+import src.voiceline_cache as voiceline_cache
+import src.lip_sync as lip_sync
+import copy
 try:
     logging.info("Trying to import winsound")
     import winsound
@@ -34,6 +37,8 @@ logging.info("Imported required libraries in base_tts.py")
 class VoiceModelNotFound(Exception):
     pass
 
+settings_files = JSONFileCache() # Shared by every synthesizer, multi_tts engines all read the same default settings files
+
 tts_slug = "base_Synthesizer"
 default_settings = {
     "transcription": "",
@@ -66,13 +71,22 @@ class base_Synthesizer:
         # last active voice model
         self.crashable = self.config.continue_on_voice_model_error
         self._voices = None
+        self._speaker_wav_listings = {} # speaker wavs folder -> (modification time, voices in the folder)
+        self._voice_catalog = None
+        self._voice_catalog_signature = None
+        self._voice_model_settings_cache = {} # (tts slug, game id, language code, voice model, character name) -> (settings file versions, transcription checked, merged settings)
+        self.voiceline_cache = None
+        if self.config.voiceline_cache_enabled:
+            self.voiceline_cache = voiceline_cache.get_cache(os.path.join(self.output_path, "voiceline_cache"), self.config.voiceline_cache_max_size_mb * 1048576)
+        self.lip_sync = lip_sync.get_service(self.config)
         self.last_voice = ''
+        self.synthesis_lock = threading.RLock() # change_voice() and _synthesize() share the TTS's loaded voice, so synthesis workers take turns with it
         loaded = True
 
 
     def unload(self):
         """Unload the TTS engine and free up any resources it's using. This is called when the TTS engine is changed or when Pantella is closed."""
-        pass
+        self.lip_sync.shutdown()
 
     @property
     def tts_engines(self):
@@ -131,38 +145,79 @@ class base_Synthesizer:
         } # TODO: Fix this to get the language from the config
     
     def convert_to_16bit(self, input_file, output_file=None, override_sample_rate=None):
+        """Write audio to output_file as a 16-bit PCM wav - input_file can be an AudioBuffer, or a path or file-like object to read the audio from"""
         if output_file is None:
             output_file = input_file
-        # Read the audio file
-        data, samplerate = sf.read(input_file)
-        if override_sample_rate is not None:
-            samplerate = override_sample_rate
-
-        # Directly convert to 16-bit if data is in float format and assumed to be in the -1.0 to 1.0 range
-        if np.issubdtype(data.dtype, np.floating):
-            # Ensure no value exceeds the -1.0 to 1.0 range before conversion (optional, based on your data's characteristics)
-            # data = np.clip(data, -1.0, 1.0)  # Uncomment if needed
-            data_16bit = np.int16(data * 32767)
-        elif not np.issubdtype(data.dtype, np.int16):
-            # If data is not floating-point or int16, consider logging or handling this case explicitly
-            # For simplicity, this example just converts to int16 without scaling
-            data_16bit = data.astype(np.int16)
+        if isinstance(input_file, AudioBuffer):
+            audio = input_file
+            if override_sample_rate is not None:
+                audio.sample_rate = override_sample_rate
         else:
-            # If data is already int16, no conversion is necessary
-            data_16bit = data
-
-        # Write the 16-bit audio data back to a file
-        sf.write(output_file, data_16bit, samplerate, subtype='PCM_16')
+            audio = AudioBuffer.from_file(input_file, override_sample_rate)
+            if not hasattr(input_file, "read") and output_file == input_file and audio.encoded is not None: # converting a file in place that's already 16-bit
+                return
+        audio.write(output_file)
     
+    def speaker_wav_listings(self):
+        """Return (folder, modification time, voices) for each speaker wavs folder - folders are only listed again when their modification time changes, which happens whenever a file is added to, removed from or renamed in them"""
+        listings = []
+        for speaker_wavs_folder in self.speaker_wavs_folders:
+            try:
+                modified_time = os.stat(speaker_wavs_folder).st_mtime_ns
+            except OSError:
+                logging.debug(f"Speaker wavs folder not found: {speaker_wavs_folder}")
+                continue
+            listing = self._speaker_wav_listings.get(speaker_wavs_folder)
+            if listing is None or listing[0] != modified_time:
+                speakers = []
+                for speaker_wav_file in os.listdir(speaker_wavs_folder):
+                    if speaker_wav_file.endswith(".wav"):
+                        speakers.append(speaker_wav_file.split(".")[0])
+                listing = (modified_time, speakers)
+                self._speaker_wav_listings[speaker_wavs_folder] = listing
+            listings.append((speaker_wavs_folder, listing[0], listing[1]))
+        return listings
+
     def voices(self):
         """"Return a list of available voices"""
-        voices = []
-        for speaker_wavs_folder in self.speaker_wavs_folders:
-            for speaker_wav_file in os.listdir(speaker_wavs_folder):
-                speaker = speaker_wav_file.split(".")[0]
-                if speaker_wav_file.endswith(".wav") and speaker not in voices:
-                    voices.append(speaker)
-        return voices
+        voices = {} # dict instead of list to drop duplicates while keeping the order
+        for _, _, speakers in self.speaker_wav_listings():
+            for speaker in speakers:
+                voices[speaker] = True
+        return list(voices.keys())
+
+    def voice_catalog_signature(self):
+        """Return something that changes whenever voices() would return something different, used to decide when the voice catalog needs to be rebuilt"""
+        return tuple((speaker_wavs_folder, modified_time) for speaker_wavs_folder, modified_time, _ in self.speaker_wav_listings())
+
+    @property
+    def voice_catalog(self):
+        """The available voices indexed by their aliases, rebuilt whenever voice_catalog_signature() changes"""
+        signature = self.voice_catalog_signature()
+        if self._voice_catalog is None or signature != self._voice_catalog_signature:
+            self._voice_catalog = VoiceCatalog(self.voices())
+            self._voice_catalog_signature = signature
+            logging.debug(f"{self.tts_slug} - Rebuilt voice catalog with {len(self._voice_catalog)} voices")
+        return self._voice_catalog
+
+    def voice_model_options(self, character_or_voice_model):
+        """Get the names a character's voice model might be available under, in order of preference"""
+        voice_model_folder = None
+        if type(character_or_voice_model) == str:
+            voice_model = character_or_voice_model
+        else:
+            voice_model = character_or_voice_model.voice_model
+            if "voice_model_folder" in character_or_voice_model.__dict__ and character_or_voice_model.voice_model_folder != None:
+                voice_model_folder = character_or_voice_model.voice_model_folder
+        options = [voice_model] # add the voice model from the character object
+        options.append(voice_model.replace(' ', '')) # add the voice model without spaces
+        options.append(voice_model.lower()) # add the lowercase version of the voice model
+        options.append(voice_model.upper()) # add the uppercase version of the voice model
+        options.append(voice_model.lower().replace(' ', '')) # add the lowercase version of the voice model without spaces
+        options.append(voice_model.upper().replace(' ', '')) # add the uppercase version of the voice model without spaces
+        if voice_model_folder != None:
+            options.append(voice_model_folder) # add the voice model folder from the character object
+        return options
     
     def get_speaker_wav_path(self, voice_model):
         """Get the path to the wav filepath to a voice sample for the specified voice model if it exists"""
@@ -182,58 +237,29 @@ class base_Synthesizer:
         if crashable is None:
             crashable = self.crashable
         # log = True
-        voice_model_folder = None
-        if type(character_or_voice_model) == str:
-            voice_model = character_or_voice_model
-        else:
-            voice_model = character_or_voice_model.voice_model
-            if "voice_model_folder" in character_or_voice_model.__dict__ and character_or_voice_model.voice_model_folder != None:
-                voice_model_folder = character_or_voice_model.voice_model_folder
-        options = [voice_model] # add the voice model from the character object
-        options.append(voice_model.replace(' ', '')) # add the voice model without spaces
-        options.append(voice_model.lower()) # add the lowercase version of the voice model
-        options.append(voice_model.upper()) # add the uppercase version of the voice model
-        options.append(voice_model.lower().replace(' ', '')) # add the lowercase version of the voice model without spaces
-        options.append(voice_model.upper().replace(' ', '')) # add the uppercase version of the voice model without spaces
-        if voice_model_folder != None:
-            options.append(voice_model_folder) # add the voice model folder from the character object
+        voice_model = character_or_voice_model if type(character_or_voice_model) == str else character_or_voice_model.voice_model
+        options = self.voice_model_options(character_or_voice_model)
 
-        available_voices = self.voices()
+        voice_catalog = self.voice_catalog
         if log:
             logging.info("Trying to detect voice model using the following aliases: ", options)
-            logging.config("Available voices: ", available_voices)
-        lower_voices = {}
-        for voice in available_voices:
-            lower_voices[voice.lower()] = voice
-        spaceless_voices = {}
-        for voice in available_voices:
-            spaceless_voices[voice.replace(' ', '').lower()] = voice
-        spaceless_lower_voices = {}
-        for voice in available_voices:
-            spaceless_lower_voices[voice.replace(' ', '').lower()] = voice
+            logging.config("Available voices: ", voice_catalog.voices)
         for option in options:
-            if option in available_voices:
-                if log:
+            voice, match = voice_catalog.resolve(option) # exact, then lowercase, then lowercase without spaces
+            if voice is None:
+                continue
+            if log:
+                if match == "exact":
                     logging.info(f'Voice model "{option}" found!')
-                return option # return the first valid voice model found
-            if option.lower() in lower_voices:
-                if log:
-                    logging.info(f'Voice model "{option}" not found, but "{lower_voices[option.lower()]}" found!')
-                return lower_voices[option.lower()] # return the first valid voice model found
-            if option.replace(' ', '') in spaceless_voices:
-                if log:
-                    logging.info(f'Voice model "{option}" not found, but "{spaceless_voices[option.replace(" ", "").lower()]}" found!')
-                return spaceless_voices[option.replace(' ', '').lower()] # return the first valid voice model found
-            if option.lower().replace(' ', '') in spaceless_lower_voices:
-                if log:
-                    logging.info(f'Voice model "{option}" not found, but "{spaceless_lower_voices[option.lower().replace(" ", "")]}" found!')
-                return spaceless_lower_voices[option.lower().replace(' ', '')]
+                else:
+                    logging.info(f'Voice model "{option}" not found, but "{voice}" found!')
+            return voice # return the first valid voice model found
         # return None # if no valid voice model is found
         if log:
             logging.error(f'Voice model "{voice_model}" not available in {self.tts_slug}! Please add it to the voices list.')
         if crashable:
             if self.continue_on_voice_model_error and voice_model == None:
-                input("Press enter to continue...")
+                utils.wait_for_user()
                 raise VoiceModelNotFound(f'Voice model {voice_model} not available! Please add it to the voices list.')
 
     @utils.time_it
@@ -265,7 +291,6 @@ class base_Synthesizer:
             voice_model_settings_path = os.path.abspath(f"./data/tts_settings/voices/{self.config.game_id}/{character.name}/{self.language['tts_language_code']}/{self.tts_slug}.json")
         else:
             voice_model_settings_path = os.path.abspath(f".\\data\\tts_settings\\voices\\{self.config.game_id}\\{character.name}\\{self.language['tts_language_code']}\\{self.tts_slug}.json")
-        os.makedirs(os.path.dirname(voice_model_settings_path), exist_ok=True) # make sure the directory exists
         return voice_model_settings_path
 
     def default_settings_path(self, voice_model):
@@ -280,16 +305,12 @@ class base_Synthesizer:
         settings = self.default_voice_model_settings.copy()
         save_changes = False
         default_settings_path = self.default_settings_path(voice_model) # Get the default settings path for the voice model (universal for all TTS types)
-        os.makedirs(os.path.dirname(default_settings_path), exist_ok=True) # make sure the directory exists
-        if os.path.exists(default_settings_path):
+        if settings_files.exists(default_settings_path):
             # logging.info(f'Loading default settings for voice model: {voice_model} from {default_settings_path}')
-            with open(default_settings_path, "r") as f:
-                default_Settings = json.load(f)
-                settings.update(default_Settings) # update with specific TTS default settings
+            settings.update(settings_files.read(default_settings_path)) # update with specific TTS default settings
         else:
             logging.info(f'No default settings found for voice model: {voice_model} at {default_settings_path}, creating default settings file with default settings: {settings}')
-            with open(default_settings_path, "w") as f:
-                json.dump(settings, f, indent=4)
+            settings_files.write(default_settings_path, settings)
         
         needs_transcription = "transcription" in settings and settings["transcription"].strip() == ""
         cannot_transcribe = False
@@ -348,23 +369,19 @@ class base_Synthesizer:
             #     logging.info(f'Transcription found for voice model: {voice_model}, no need to generate transcription using STT.')
 
         if save_changes:
-            with open(default_settings_path, "w") as f:
-                json.dump(settings, f, indent=4)
+            settings_files.write(default_settings_path, settings)
 
         return settings
     
     def set_transcription_for_voice_model(self, voice_model, transcription):
         """Set the transcription for the voice model in the default settings file"""
         default_settings_path = self.default_settings_path(voice_model) # Get the default settings path for the voice model (universal for all TTS types)
-        os.makedirs(os.path.dirname(default_settings_path), exist_ok=True) # make sure the directory exists
-        if os.path.exists(default_settings_path):
-            with open(default_settings_path, "r") as f:
-                default_Settings = json.load(f)
+        if settings_files.exists(default_settings_path):
+            default_Settings = settings_files.read(default_settings_path)
         else:
             default_Settings = self.default_voice_model_settings.copy()
         default_Settings["transcription"] = transcription.strip()
-        with open(default_settings_path, "w") as f:
-            json.dump(default_Settings, f, indent=4)
+        settings_files.write(default_settings_path, default_Settings)
 
     def voice_model_settings(self, character_or_voice_model, generate_transcription_if_necessary=True):
         """Return the settings for the specified voice model"""
@@ -372,45 +389,56 @@ class base_Synthesizer:
             voice_model = character_or_voice_model
         else:
             voice_model = self.get_valid_voice_model(character_or_voice_model)
-        
-        settings = self.get_default_voice_model_settings(voice_model, generate_transcription_if_necessary) # Get the default settings for the voice model
+
+        # The settings are merged from up to three files, so the merged result is cached until one of them changes
+        settings_paths = [self.default_settings_path(voice_model), self.voice_model_settings_path(voice_model)]
+        character_name = None
+        if type(character_or_voice_model) != str:
+            character_name = character_or_voice_model.name
+            settings_paths.append(self.character_settings_path(character_or_voice_model))
+        cache_key = (self.tts_slug, self.config.game_id, self.language['tts_language_code'], voice_model, character_name)
+        versions = tuple(settings_files.version(path) for path in settings_paths)
+        cached_settings = self._voice_model_settings_cache.get(cache_key)
+        if cached_settings is not None and cached_settings[0] == versions and (cached_settings[1] or not generate_transcription_if_necessary):
+            settings = copy.deepcopy(cached_settings[2])
+        else:
+            settings = self.merge_voice_model_settings(character_or_voice_model, voice_model, generate_transcription_if_necessary)
+            versions = tuple(settings_files.version(path) for path in settings_paths) # merging can create or update the files
+            self._voice_model_settings_cache[cache_key] = (versions, generate_transcription_if_necessary, copy.deepcopy(settings))
+
+        settings['tts_language_code'] = self.get_language_code_from_character(character_or_voice_model)
+        return settings
+
+    def merge_voice_model_settings(self, character_or_voice_model, voice_model, generate_transcription_if_necessary=True):
+        """Merge the default, voice model and character settings files for the specified voice model, creating any of them that don't exist yet"""
+        settings = copy.deepcopy(self.get_default_voice_model_settings(voice_model, generate_transcription_if_necessary)) # Get the default settings for the voice model
 
         voice_model_settings_path = self.voice_model_settings_path(voice_model) # Get the voice model settings path for the specific TTS type
-        os.makedirs(os.path.dirname(voice_model_settings_path), exist_ok=True) # make sure the directory exists
-        if os.path.exists(voice_model_settings_path):
+        if settings_files.exists(voice_model_settings_path):
             # logging.info(f'Loading settings for voice model: {voice_model} from {voice_model_settings_path}')
-            with open(voice_model_settings_path, "r") as f:
-                tts_default_settings = json.load(f)
-                # settings.update(tts_default_settings) # update with specific voice model settings
-                for key in tts_default_settings:
-                    if key in settings:
-                        if type(settings[key]) == dict and type(tts_default_settings[key]) == dict:
-                            settings[key].update(tts_default_settings[key]) # update nested dictionaries
-                        elif type(settings[key]) == str and type(tts_default_settings[key]) == str:
-                            if tts_default_settings[key].strip() != "":
-                                settings[key] = tts_default_settings[key] # update string settings if the value in the voice model settings is not empty
-                        else:
-                            settings[key] = tts_default_settings[key] # update with specific voice model settings
+            tts_default_settings = settings_files.read(voice_model_settings_path)
+            # settings.update(tts_default_settings) # update with specific voice model settings
+            for key in tts_default_settings:
+                if key in settings:
+                    if type(settings[key]) == dict and type(tts_default_settings[key]) == dict:
+                        settings[key].update(tts_default_settings[key]) # update nested dictionaries
+                    elif type(settings[key]) == str and type(tts_default_settings[key]) == str:
+                        if tts_default_settings[key].strip() != "":
+                            settings[key] = tts_default_settings[key] # update string settings if the value in the voice model settings is not empty
                     else:
-                        settings[key] = tts_default_settings[key] # add new settings from the voice model settings that are not in the default settings
+                        settings[key] = tts_default_settings[key] # update with specific voice model settings
+                else:
+                    settings[key] = tts_default_settings[key] # add new settings from the voice model settings that are not in the default settings
         else:
-            with open(voice_model_settings_path, "w") as f:
-                json.dump(settings, f, indent=4)
-            tts_default_settings = self.default_voice_model_settings
+            settings_files.write(voice_model_settings_path, settings)
 
         if type(character_or_voice_model) != str: # If a character object is passed, load character specific settings
             character_settings_path = self.character_settings_path(character_or_voice_model)
-            os.makedirs(os.path.dirname(character_settings_path), exist_ok=True) # make sure the directory exists
-            if os.path.exists(character_settings_path):
+            if settings_files.exists(character_settings_path):
                 logging.info(f'Loading settings for character: {character_or_voice_model.name} from {character_settings_path}')
-                with open(character_settings_path, "r") as f:
-                    character_settings = json.load(f)
-                    settings.update(character_settings) # update with specific character settings
+                settings.update(settings_files.read(character_settings_path)) # update with specific character settings
             else:
-                with open(character_settings_path, "w") as f:
-                    json.dump(settings, f, indent=4)
-                    
-        settings['tts_language_code'] = self.get_language_code_from_character(character_or_voice_model)
+                settings_files.write(character_settings_path, settings)
         return settings
     
     @utils.time_it
@@ -423,7 +451,7 @@ class base_Synthesizer:
         logging.warn('Wav file not saved, please fix your code.')
         logging.warn('Lip file not saved, please fix your code.')
         logging.error('Voice model not loaded, please fix your code.')
-        input("Press enter to continue...")
+        utils.wait_for_user()
         raise NotImplementedError("synthesize() method not implemented in your tts type.")
     
     def get_language_code_from_character(self, character_or_voice_model):
@@ -434,20 +462,43 @@ class base_Synthesizer:
             language_code = character_or_voice_model.tts_language_code
         return language_code
     
+    def voiceline_cache_fingerprint(self, voice_model):
+        """Anything besides the settings that changes how a voice model sounds, so replacing it invalidates the voice model's cached voicelines - the voice sample's path and modification time by default"""
+        for speaker_wavs_folder, _, speakers in self.speaker_wav_listings():
+            if voice_model in speakers:
+                speaker_wav_path = os.path.join(speaker_wavs_folder, f"{voice_model}.wav")
+                try:
+                    return [speaker_wav_path, os.stat(speaker_wav_path).st_mtime_ns]
+                except OSError:
+                    return None
+        return None
+
+    def get_voiceline_cache_key(self, voiceline, voice_model, settings, aggro=0):
+        """Get the voiceline cache key for a voiceline, or None if the voiceline cache is disabled"""
+        if self.voiceline_cache is None or voiceline.strip() == '':
+            return None
+        return self.voiceline_cache.key(self.tts_slug, voice_model, voiceline, settings, settings.get('tts_language_code'), [aggro, self.voiceline_cache_fingerprint(voice_model), self.lip_sync.backend.name])
+
+    def prepare_synthesis(self, character):
+        """Get the voice model settings synthesize() will use for a character - this can ask the user for a transcription, so when synthesize() runs on a worker thread, call this on the main thread first and pass its result to synthesize()"""
+        return self.voice_model_settings(character)
+
     @utils.time_it
-    def synthesize(self, voiceline, character, aggro=0):
-        """Synthesize the audio for the character specified using TTS"""
+    def synthesize(self, voiceline, character, aggro=0, final_voiceline_file_name='voiceline', timings=None, wait_for_lip=True, settings=None):
+        """Synthesize the audio for the character specified using TTS - timings, if passed, is filled with the seconds spent in each stage
+
+        If wait_for_lip is False, this returns as soon as the audio is ready and the lip file is generated in the background - get its job with pop_lip_job() and wait for it before the voiceline is played."""
         logging.out(f'{self.tts_slug} - Starting voiceline synthesis: {voiceline}')
         if type(character) == str:
             voice_model = character
         else:
             voice_model = character.voice_model
-        settings = self.voice_model_settings(character)
-        self.change_voice(character, settings)
+        if settings is None:
+            settings = self.prepare_synthesis(character)
+        cache_key = self.get_voiceline_cache_key(voiceline, voice_model, settings, aggro)
         if voiceline.strip() == '': # If the voiceline is empty, don't synthesize anything
             logging.info('No voiceline to synthesize.')
             return ''
-        final_voiceline_file_name = 'voiceline'
         # make voice model folder if it doesn't already exist
         if self.config.linux_mode:
             if not os.path.exists(f"{self.output_path}/voicelines/{voice_model}"):
@@ -473,97 +524,59 @@ class base_Synthesizer:
 
         if not os.path.exists(final_voiceline_file):
             os.makedirs(os.path.dirname(final_voiceline_file), exist_ok=True)
+        if cache_key is not None:
+            cache_start = time.time()
+            if self.voiceline_cache.get(cache_key, final_voiceline_file):
+                logging.info(f'{self.tts_slug} - Using cached voiceline for: {voiceline}')
+                if timings is not None:
+                    timings["cache"] = time.time() - cache_start
+                self.debug(final_voiceline_file)
+                return final_voiceline_file
         # Synthesize voicelines using chat_tts to create the new voiceline
-        self._synthesize(voiceline, voice_model, final_voiceline_file, settings, aggro)
+        tts_start = time.time()
+        with self.synthesis_lock: # a cached voiceline doesn't need the voice to be loaded, so it's only changed here - and no other synthesis worker can change it again before this line is done with it
+            self.change_voice(character, settings)
+            self._synthesize(voiceline, voice_model, final_voiceline_file, settings, aggro)
+        if timings is not None:
+            timings["tts"] = time.time() - tts_start
         if not os.path.exists(final_voiceline_file):
             logging.error(f'{self.tts_slug} failed to generate voiceline at: {Path(final_voiceline_file)}')
             raise FileNotFoundError()
 
-        self.lip_gen(voiceline, final_voiceline_file)
+        if wait_for_lip:
+            lip_job = self.lip_gen(voiceline, final_voiceline_file, wait=False)
+            self.lip_sync.pop_job(final_voiceline_file)
+            lip_time = lip_job.result()
+            if timings is not None:
+                timings["lip"] = lip_time
+            if cache_key is not None:
+                self.cache_voiceline(cache_key, final_voiceline_file, lip_job)
+        else:
+            lip_job = self.lip_gen(voiceline, final_voiceline_file, wait=False)
+            if cache_key is not None: # the voiceline can only be cached once its lip file exists
+                lip_job.add_done_callback(lambda future: self.cache_voiceline(cache_key, final_voiceline_file, future))
         self.debug(final_voiceline_file)
 
         return final_voiceline_file
          
-    def run_command(self, command):
-        """Run a command in the command prompt"""
-        if self.config.linux_mode:
-            sp = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-
-            stdout, stderr = sp.communicate()
-            stderr = stderr.decode("utf-8")
-        else:
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-
-            sp = subprocess.Popen(command, startupinfo=startupinfo, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-            stdout, stderr = sp.communicate()
-            stderr = stderr.decode("utf-8")
-
-    def check_face_fx_wrapper(self):
-        """Check if FaceFXWrapper is installed and FonixData.cdf exists in the same directory as the script."""
-        current_dir = os.getcwd() # get current directory
-        if self.config.linux_mode:
-            cdf_path = f'{current_dir}/FaceFXWrapper/FonixData.cdf'
-            face_wrapper_executable = f'{current_dir}/FaceFXWrapper/FaceFXWrapper.exe'
-        else:
-            cdf_path = f'{current_dir}\\FaceFXWrapper\\FonixData.cdf'
-            face_wrapper_executable = f'{current_dir}\\FaceFXWrapper\\FaceFXWrapper.exe'
-        installed = False
-
-        logging.info(f'Checking if FonixData.cdf exists at: {cdf_path}')
-        if os.path.isfile(cdf_path):
-            logging.info(f'Found FonixData.cdf at: {cdf_path}')
-            installed = True
-        else:
-            logging.error(f'Could not find FonixData.cdf in "{Path(cdf_path).parent}" required by FaceFXWrapper.')
-        
-        logging.info(f'Checking if FaceFXWrapper.exe exists at: {face_wrapper_executable}')
-        if os.path.isfile(face_wrapper_executable):
-            logging.info(f'Found FaceFXWrapper.exe at: {face_wrapper_executable}')
-            installed = True
-        else:
-            logging.error(f'Could not find FaceFXWrapper.exe in "{Path(face_wrapper_executable).parent}" with which to create a Lip Sync file, download it from: https://github.com/Haurrus/FaceFXWrapper/releases')
-            
-        return installed
-
-    def lip_gen(self, voiceline, final_voiceline_file):
-        """Generate a lip file using FaceFXWrapper and FonixData.cdf"""
-        current_dir = utils.resolve_path() # get current directory
-        if self.config.linux_mode:
-            cdf_path = f'{current_dir}/FaceFXWrapper/FonixData.cdf'
-            face_wrapper_executable = f'{current_dir}/FaceFXWrapper/FaceFXWrapper.exe'
-        else:
-            cdf_path = f'{current_dir}\\FaceFXWrapper\\FonixData.cdf'
-            face_wrapper_executable = f'{current_dir}\\FaceFXWrapper\\FaceFXWrapper.exe'
-        logging.info(f'Generating lip file for voiceline: {voiceline} to: {final_voiceline_file.replace(".wav", ".lip")}')
-
-        face_wrapper_game = self.game.lower()
-        if face_wrapper_game == 'fallout4vr' or face_wrapper_game == 'fallout4':
-            face_wrapper_game = 'Fallout4'
-        if face_wrapper_game == 'skyrimvr' or face_wrapper_game == 'skyrim' or face_wrapper_game == 'falloutnv':
-            face_wrapper_game = 'Skyrim'
-        logging.info(f'FaceFXWrapper Detected Game: {face_wrapper_game}')
-
-        if self.check_face_fx_wrapper() and not self.config.bypass_facefxwrapper:
-            try:
-                if self.config.linux_mode:
-                    command = f'wine "{face_wrapper_executable}" "{face_wrapper_game}" "USEnglish" "{cdf_path}" "{final_voiceline_file}" "{final_voiceline_file.replace(".wav", "_r.wav")}" "{final_voiceline_file.replace(".wav", ".lip")}" "{voiceline}"'
-                else:
-                    command = f'{face_wrapper_executable} "{face_wrapper_game}" "USEnglish" "{cdf_path}" "{final_voiceline_file}" "{final_voiceline_file.replace(".wav", "_r.wav")}" "{final_voiceline_file.replace(".wav", ".lip")}" "{voiceline}"'
-
-                logging.info(f'Running command: {command}')
-                self.run_command(command)
-                # remove file created by FaceFXWrapper
-                if os.path.exists(final_voiceline_file.replace(".wav", "_r.wav")):
-                    os.remove(final_voiceline_file.replace(".wav", "_r.wav"))
-            except Exception as e:
-                logging.error(f'FaceFXWrapper failed to generate lip file at: {final_voiceline_file} - Falling back to default/last lip file:', e)
-        else:
-            logging.error(f'FaceFXWrapper not installed or bypassed: Falling back to default lip file in the Pantella mod folder')
-
-        if not os.path.exists(final_voiceline_file.replace(".wav", ".lip")):
-            logging.error(f'FaceFXWrapper failed to generate lip file at: {Path(final_voiceline_file).with_suffix(".lip")}')
+    def cache_voiceline(self, cache_key, final_voiceline_file, lip_job):
+        """Store a synthesized voiceline in the voiceline cache once its lip job is done - unless the lip file is just the default one, so the line gets a real lip file the next time it's synthesized"""
+        if lip_job.cancelled() or not lip_job.lip_source["cacheable"]:
+            logging.info(f'{self.tts_slug} - Not caching voiceline {final_voiceline_file} because its lip file came from the {lip_job.lip_source["backend"]} lip sync backend')
+            return
+        self.voiceline_cache.put(cache_key, final_voiceline_file)
+
+    def lip_gen(self, voiceline, final_voiceline_file, wait=True):
+        """Generate the lip file for a voiceline on the lip sync service - if wait is False, returns the job's future without waiting for it"""
+        future = self.lip_sync.submit(voiceline, final_voiceline_file)
+        if wait:
+            self.lip_sync.pop_job(final_voiceline_file)
+            return future.result()
+        return future
+
+    def pop_lip_job(self, final_voiceline_file):
+        """Get the lip sync job started for a voiceline by synthesize(wait_for_lip=False), or None if it didn't need one"""
+        return self.lip_sync.pop_job(final_voiceline_file)
 
     def debug(self, final_voiceline_file):
         """Play the voiceline from the script if debug_mode is enabled."""
@@ -592,14 +605,15 @@ class base_Synthesizer:
         logging.info(f'{self.tts_slug} - _Saying voiceline: {voiceline} with voice model: {voice_model}')
         settings = self.voice_model_settings(voice_model)
         logging.config(f'{self.tts_slug} - Using settings: {settings}')
-        self.change_voice(voice_model, settings)
         voiceline_location = f"{self.output_path}\\voicelines\\{voice_model}\\direct.wav"
         if self.config.linux_mode:
             voiceline_location = f"{self.output_path}/voicelines/{voice_model}/direct.wav"
         logging.config(f'{self.tts_slug} - Voiceline location: {voiceline_location}')
         if not os.path.exists(voiceline_location):
             os.makedirs(os.path.dirname(voiceline_location), exist_ok=True)
-        self._synthesize(voiceline, voice_model, voiceline_location, settings)
+        with self.synthesis_lock:
+            self.change_voice(voice_model, settings)
+            self._synthesize(voiceline, voice_model, voiceline_location, settings)
         if not os.path.exists(voiceline_location):
             logging.error(f'{self.tts_slug} failed to generate voiceline at: {Path(voiceline_location)}')
             raise FileNotFoundError()
@@ -1,10 +1,16 @@
 from src.logging import logging
 logging.info("Importing chatterbox.py...")
 import src.tts_types.base_tts as base_tts
+from src.audio_buffer import AudioBuffer
+import os
+import hashlib
+import threading
+from collections import OrderedDict
 imported = False
 try:
     logging.info("Trying to import chatterbox")
-    from libraries.chatterbox.tts import ChatterboxTTS
+    from libraries.chatterbox.tts import ChatterboxTTS, Conditionals
+    import torch
     # from libraries.chatterbox.vc import ChatterboxVC
     import random
     # import numpy as np
@@ -32,6 +38,8 @@ default_settings = {
     "chatterbox_batch_type": "paragraph", # paragraph, sentence, word
     "chatterbox_volume": 1.0,
     "chatterbox_banned_voice_models": [],
+    "chatterbox_conditionals_cache_mb": 256,
+    "chatterbox_conditionals_cache_to_disk": True,
 }
 settings_description = {
     "chatterbox_device": "The device to run the Chatterbox model on. This can be changed in your [game_id]_config.json. The default is 'cuda', but if you have a compatible NVIDIA GPU, you can set this to 'cuda' to significantly speed up synthesis times. If you don't have a compatible GPU, you can set this to 'cpu', but keep in mind that synthesis times will be significantly longer.",
@@ -43,7 +51,9 @@ settings_description = {
     "chatterbox_batch_size": "The batch size to use for synthesis. Higher values can speed up synthesis times, but can also increase memory usage. The optimal batch size can vary depending on the length of the input text and the available hardware.",
     "chatterbox_batch_type": "The type of batching to use for synthesis. 'paragraph' batches by paragraph, 'sentence' batches by sentence, and 'word' batches by word. Batching by paragraph can be faster for longer inputs, but can also lead to less coherent speech. Batching by sentence can be a good middle ground, while batching by word can produce the most coherent speech but can also be the slowest.",
     "chatterbox_volume": "The volume of the generated audio. This can be used to increase or decrease the volume of the generated audio. The default is 1.0, which means no change in volume. Values greater than 1.0 will increase the volume, while values less than 1.0 will decrease the volume.",
-    "chatterbox_banned_voice_models": "A list of voice models to ban from being used by Chatterbox. This can be changed in your [game_id]_config.json. This is useful if you have a voice model that causes issues with Chatterbox, such as extremely long synthesis times or crashes."
+    "chatterbox_banned_voice_models": "A list of voice models to ban from being used by Chatterbox. This can be changed in your [game_id]_config.json. This is useful if you have a voice model that causes issues with Chatterbox, such as extremely long synthesis times or crashes.",
+    "chatterbox_conditionals_cache_mb": "How much memory in megabytes to use for keeping the conditioning Chatterbox computes from each speaker's reference audio, so it only has to be computed once per speaker instead of for every voiceline. The least recently used speakers are dropped when it's full.",
+    "chatterbox_conditionals_cache_to_disk": "Whether to also save each speaker's conditioning to data/chatterbox_conditionals, so it doesn't have to be computed again after Pantella restarts."
 }
 options = {}
 settings = {}
@@ -59,6 +69,10 @@ class Synthesizer(base_tts.base_Synthesizer):
 
         self.model = None  # Initialize model as None
         self.model_type = "tts"  # Default model type
+        self.conditionals_cache = OrderedDict() # (speaker wav path, modification time, size) -> (Conditionals, size in bytes), least recently used first
+        self.conditionals_cache_bytes = 0
+        self.conditionals_lock = threading.Lock()
+        self.conditionals_dir = os.path.join(self.output_path, "chatterbox_conditionals")
         self.get_or_load_tts_model() # Load TTS model on startup
 
         logging.info(f'{self.tts_slug} speaker wavs folders: {self.speaker_wavs_folders}')
@@ -70,10 +84,14 @@ class Synthesizer(base_tts.base_Synthesizer):
         
     def unload(self):
         """Unload the TTS engine and free up any resources it's using. This is called when the TTS engine is changed or when Pantella is closed."""
+        super().unload() # stop the lip sync worker
         if self.model is not None:
             logging.info(f'Unloading {self.tts_slug} model to free up resources...')
             del self.model
             self.model = None
+            with self.conditionals_lock:
+                self.conditionals_cache.clear()
+                self.conditionals_cache_bytes = 0
             logging.info(f'{self.tts_slug} model unloaded.')
 
     def get_or_load_tts_model(self):
@@ -102,6 +120,44 @@ class Synthesizer(base_tts.base_Synthesizer):
                 voices.remove(banned_voice)
         return voices
     
+    def get_conditionals(self, speaker_wav_path, exaggeration):
+        """Get the conditioning for a speaker's reference audio, from memory, then disk, computing it only if it isn't cached in either"""
+        stat = os.stat(speaker_wav_path)
+        key = (os.path.abspath(speaker_wav_path), stat.st_mtime_ns, stat.st_size) # editing the reference audio changes the key, so stale conditioning is never used
+        with self.conditionals_lock:
+            if key in self.conditionals_cache:
+                self.conditionals_cache.move_to_end(key)
+                return self.conditionals_cache[key][0]
+        conditionals_file = os.path.join(self.conditionals_dir, hashlib.sha256(repr(key).encode('utf-8')).hexdigest() + ".pt")
+        conditionals = None
+        if self.config.chatterbox_conditionals_cache_to_disk and os.path.exists(conditionals_file):
+            try:
+                conditionals = Conditionals.load(conditionals_file, map_location=self.model.device)
+                logging.info(f'{self.tts_slug} - loaded cached conditioning for {speaker_wav_path}')
+            except Exception as e:
+                logging.warning(f'{self.tts_slug} - could not load cached conditioning from {conditionals_file}, computing it again: {e}')
+        if conditionals is None:
+            # exaggeration isn't part of the key, generate() swaps it into cached conditioning without recomputing anything else
+            self.model.prepare_conditionals(speaker_wav_path, exaggeration=exaggeration)
+            conditionals = self.model.conds
+            if self.config.chatterbox_conditionals_cache_to_disk:
+                try:
+                    os.makedirs(self.conditionals_dir, exist_ok=True)
+                    conditionals.save(conditionals_file + ".tmp")
+                    os.replace(conditionals_file + ".tmp", conditionals_file)
+                except Exception as e:
+                    logging.warning(f'{self.tts_slug} - could not save conditioning to {conditionals_file}: {e}')
+        size = sum(value.numel() * value.element_size() for value in list(conditionals.t3.__dict__.values()) + list(conditionals.gen.values()) if torch.is_tensor(value))
+        max_bytes = self.config.chatterbox_conditionals_cache_mb * 1048576
+        with self.conditionals_lock:
+            if key not in self.conditionals_cache:
+                self.conditionals_cache[key] = (conditionals, size)
+                self.conditionals_cache_bytes += size
+            while self.conditionals_cache_bytes > max_bytes and len(self.conditionals_cache) > 1: # drop the least recently used speakers, but always keep the one being used
+                _, (_, evicted_size) = self.conditionals_cache.popitem(last=False)
+                self.conditionals_cache_bytes -= evicted_size
+        return conditionals
+
     @property
     def default_voice_model_settings(self):
         return {
@@ -121,22 +177,20 @@ class Synthesizer(base_tts.base_Synthesizer):
         if self.model is None:
             raise RuntimeError("TTS model is not loaded.")
 
+        exaggeration = settings.get("exaggeration", default_settings["chatterbox_default_exaggeration"])
+        self.model.conds = self.get_conditionals(speaker_wav_path, exaggeration)
         wav = self.model.generate(
             voiceline,
             batch_size=self.config.chatterbox_batch_size,
             batch_type=self.config.chatterbox_batch_type.lower(),
-            audio_prompt_path=speaker_wav_path,
-            exaggeration=settings.get("exaggeration", default_settings["chatterbox_default_exaggeration"]),
+            exaggeration=exaggeration,
             temperature=settings.get("temperature", default_settings["chatterbox_default_temperature"]),
             cfg_weight=settings.get("cfgw", default_settings["chatterbox_default_cfgw"]),
             max_tokens=self.config.chatterbox_max_tokens,  # Limit to 300 characters
             watermark=self.config.chatterbox_watermark,
         )         
         # Save the wav file
-        bytes_io_file = io.BytesIO()
         wav = wav * self.config.chatterbox_volume
         # ta.save(voiceline_location, wav, self.model.sr)
-        ta.save(bytes_io_file, wav, self.model.sr, format='wav')
-        bytes_io_file.seek(0)
-        self.convert_to_16bit(bytes_io_file,voiceline_location, self.model.sr)
+        self.convert_to_16bit(AudioBuffer(wav.detach().cpu().numpy().T, self.model.sr), voiceline_location) # (channels, frames) -> (frames, channels)
         logging.output(f'{self.tts_slug} - synthesized {voiceline} with voice model "{voice_model}"')
\ No newline at end of file
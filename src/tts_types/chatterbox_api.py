@@ -2,6 +2,7 @@ print("Loading chatterbox_api.py...")
 from src.logging import logging
 import src.utils as utils
 import src.tts_types.base_tts as base_tts
+from src.audio_buffer import AudioBuffer
 import os
 from pathlib import Path
 import requests
@@ -96,10 +97,8 @@ class Synthesizer(base_tts.base_Synthesizer):
         # print(data)
         try:
             response = requests.post(self.config.chatterbox_api_base_url+"/synthesize", files=data)
-            with open(Path(voiceline_location), 'wb') as f:
-                f.write(response.content)
             if response.status_code == 200: # if the request was successful, write the wav file to disk at the specified path
-                self.convert_to_16bit(io.BytesIO(response.content), voiceline_location)
+                self.convert_to_16bit(AudioBuffer.from_bytes(response.content), voiceline_location)
             else:
                 logging.error(f'Chatterbox API failed to generate voiceline at: {Path(voiceline_location)}')
                 raise FileNotFoundError()
@@ -12,12 +12,10 @@ try:
         load_model,
         preprocess_ref_audio_text,
         infer_process,
-        remove_silence_for_generated_wav,
     )
     vocoder = load_vocoder()
-    import tempfile
     import soundfile as sf
-    import torchaudio
+    from src.audio_buffer import remove_silence as trim_silence # infer()'s remove_silence flag would shadow it
     from cached_path import cached_path
 
     def load_f5tts(device, ckpt_path=str(cached_path("hf://SWivid/F5-TTS/F5TTS_Base/model_1200000.safetensors"))):
@@ -61,6 +59,7 @@ class Synthesizer(base_tts.base_Synthesizer):
         self._default_settings = default_settings
         self.needs_transcription = True
         logging.info(f"Initializing {self.tts_slug}...")
+        self.reference_cache = {} # (speaker wav path, modification time, size, transcription) -> (preprocessed reference wav path, transcription)
         self.model = load_f5tts(self.config.f5_tts_device)
 
         logging.info(f'{self.tts_slug} speaker wavs folders: {self.speaker_wavs_folders}')
@@ -72,11 +71,13 @@ class Synthesizer(base_tts.base_Synthesizer):
         
     def unload(self):
         """Unload the TTS engine and free up any resources it's using. This is called when the TTS engine is changed or when Pantella is closed."""
+        super().unload() # stop the lip sync worker
         if self.model is not None:
             logging.info(f'Unloading {self.tts_slug} model to free up resources...')
             self.model.cpu()  # Move model to CPU before deleting to free up GPU memory
             del self.model
             self.model = None
+            self.reference_cache.clear()
             logging.info(f'{self.tts_slug} model unloaded.')
 
     @property
@@ -95,6 +96,18 @@ class Synthesizer(base_tts.base_Synthesizer):
                 voices.remove(banned_voice)
         return voices
     
+    def preprocess_reference(self, ref_audio_orig, ref_text, show_info=print):
+        """Clip, normalize and (if there's no transcription) transcribe a speaker wav - done once per speaker wav and transcription, and again only if the speaker wav changes"""
+        stat = os.stat(ref_audio_orig)
+        key = (os.path.abspath(ref_audio_orig), stat.st_mtime_ns, stat.st_size, ref_text)
+        reference = self.reference_cache.get(key)
+        if reference is None or not os.path.exists(reference[0]): # the preprocessed wav is a temp file, so it's made again if it's been cleaned up
+            reference = preprocess_ref_audio_text(ref_audio_orig, ref_text, show_info=show_info)
+            self.reference_cache[key] = reference
+        else:
+            logging.info(f'{self.tts_slug} - using cached preprocessed reference audio for {ref_audio_orig}')
+        return reference
+
     def infer(self,
         ref_audio_orig,
         ref_text,
@@ -113,7 +126,7 @@ class Synthesizer(base_tts.base_Synthesizer):
         if not ref_text.strip():
             raise ValueError("Please enter reference text.")
 
-        ref_audio, ref_text = preprocess_ref_audio_text(ref_audio_orig, ref_text)
+        ref_audio, ref_text = self.preprocess_reference(ref_audio_orig, ref_text)
 
         final_wave, final_sample_rate, combined_spectrogram = infer_process(
             ref_audio,
@@ -130,11 +143,7 @@ class Synthesizer(base_tts.base_Synthesizer):
 
         # Remove silence
         if remove_silence:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-                sf.write(f.name, final_wave, final_sample_rate)
-                remove_silence_for_generated_wav(f.name)
-                final_wave, _ = torchaudio.load(f.name)
-            final_wave = final_wave.squeeze().cpu().numpy() * self.config.f5_tts_volume
+            final_wave = trim_silence(final_wave, final_sample_rate) * self.config.f5_tts_volume
 
         # Save the generated audio
         sf.write(output_path, final_wave, final_sample_rate)
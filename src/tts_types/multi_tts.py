@@ -1,7 +1,9 @@
 print("Loading multi_tts.py...")
 from src.logging import logging
 import random
+import src.utils as utils
 import src.tts_types.base_tts as base_tts
+from src.voice_catalog import spaceless_key
 logging.info("Imported required libraries in multi_tts.py")
 
 tts_slug = "multi_tts"
@@ -19,6 +21,8 @@ class Synthesizer(base_tts.base_Synthesizer):
         self.tts_slug = tts_slug
         self._default_settings = default_settings
         self.ttses = ttses
+        self._routing_table = None
+        self._routing_catalogs = None
         fallback_order = ""
         for tts_index, tts in enumerate(self.tts_engines):
             fallback_order += f"{str(tts_index+1)}. {tts.tts_slug}\n"
@@ -31,6 +35,7 @@ class Synthesizer(base_tts.base_Synthesizer):
 
     def unload(self):
         """Unload the TTS engine and free up any resources it's using. This is called when the TTS engine is changed or when Pantella is closed."""
+        super().unload() # stop the lip sync worker
         for tts in self.tts_engines:
             tts.unload()
             
@@ -46,34 +51,58 @@ class Synthesizer(base_tts.base_Synthesizer):
             voices += tts.voices()
         voices = list(set(voices))
         return voices
+
+    def voice_catalog_signature(self):
+        return tuple(tts.voice_catalog_signature() for tts in self.tts_engines)
+
+    @property
+    def routing_table(self):
+        """Lowercase voice model without spaces -> indexes of the tts engines that have it, in fallback order - rebuilt whenever one of the tts engines' voice catalogs changes"""
+        catalogs = [tts.voice_catalog for tts in self.tts_engines]
+        if self._routing_table is None or len(catalogs) != len(self._routing_catalogs) or any(catalog is not old_catalog for catalog, old_catalog in zip(catalogs, self._routing_catalogs)):
+            routing_table = {}
+            for tts_index, catalog in enumerate(catalogs):
+                for voice_key in catalog.spaceless: # every alias base_Synthesizer.get_valid_voice_model() accepts ends up at one of these keys
+                    routing_table.setdefault(voice_key, []).append(tts_index)
+            self._routing_table = routing_table
+            self._routing_catalogs = catalogs
+            logging.debug(f"Multi_TTS - Rebuilt routing table for {len(routing_table)} voice models")
+        return self._routing_table
+
+    def route(self, character, log=True):
+        """Get the tts engine for the character - the one named by the character's 'tts_override' property if it has the character's voice model, otherwise the first tts engine in the fallback order that does"""
+        tts_override = getattr(character, "tts_override", None) if type(character) != str else None
+        if tts_override:
+            for tts_engine in self.tts_engines:
+                if tts_engine.tts_slug == tts_override and tts_engine.get_valid_voice_model(character, crashable=False, multi_tts=True, log=log) != None:
+                    if log:
+                        logging.info(f"Character {character.name} has tts_override set to {tts_override}.")
+                    return tts_engine
+        routing_table = self.routing_table
+        first_index = len(self.tts_engines)
+        for option in self.voice_model_options(character):
+            tts_indexes = routing_table.get(spaceless_key(option))
+            if tts_indexes is not None and tts_indexes[0] < first_index:
+                first_index = tts_indexes[0]
+        tts = None
+        for tts_engine in self.tts_engines[:first_index]: # engines with their own voice model matching can't be routed by the table, so ask the ones earlier in the fallback order directly
+            if type(tts_engine).get_valid_voice_model is not base_tts.base_Synthesizer.get_valid_voice_model and tts_engine.get_valid_voice_model(character, crashable=False, multi_tts=True, log=log) != None:
+                tts = tts_engine
+                break
+        if tts is None and first_index < len(self.tts_engines):
+            tts = self.tts_engines[first_index]
+        if tts is not None and log:
+            if tts_override:
+                logging.warn(f"Character {character.name} has tts_override set to {tts_override}, but that tts engine does not support the voice model of the character. Falling back to the first tts engine that supports the voice model of the character. TTS engine: {tts.tts_slug}")
+            elif type(character) != str:
+                logging.info(f"Character {character.name} does not have tts_override set. Using the first tts engine that supports the voice model of the character. TTS engine: {tts.tts_slug}")
+            else:
+                logging.info(f"Character for voice model '{character}' cannot have tts_override set. Using the first tts engine that supports the voice model of the character. TTS engine: {tts.tts_slug}")
+        return tts
     
     def get_valid_voice_model(self, character, crashable=False, multi_tts=True, log=True):
         """Synthesize the text for the character specified using either the 'tts_override' property of the character or using the first tts engine that supports the voice model of the character"""
-        tts = None
-        # print(voiceline)
-        # print(character)
-        if type(character) != str and "tts_override" in character.__dict__:
-            if character.tts_override in self.tts_engines:
-                tts = self.tts_engines[character.tts_override]
-                if log:
-                    logging.info(f"Character {character.name} has tts_override set to {character.tts_override}.")
-            else:
-                for tts_engine in self.tts_engines:
-                    if tts_engine.get_valid_voice_model(character, multi_tts=True, log=log) != None:
-                        if log:
-                            logging.warn(f"Character {character.name} has tts_override set to {character.tts_override}, but that tts engine does not support the voice model of the character. Falling back to the first tts engine that supports the voice model of the character. TTS engine: {tts_engine.tts_slug}")
-                        tts = tts_engine
-                        break
-        else:
-            for tts_engine in self.tts_engines:
-                if tts_engine.get_valid_voice_model(character, multi_tts=True, log=log) != None:
-                    if log:
-                        if type(character) != str:
-                            logging.info(f"Character {character.name} does not have tts_override set. Using the first tts engine that supports the voice model of the character. TTS engine: {tts_engine.tts_slug}")
-                        else:
-                            logging.info(f"Character for voice model '{character}' cannot have tts_override set. Using the first tts engine that supports the voice model of the character. TTS engine: {tts_engine.tts_slug}")
-                    tts = tts_engine
-                    break
+        tts = self.route(character, log=log)
         if tts is None:
             if log:
                 if type(character) != str:
@@ -81,7 +110,7 @@ class Synthesizer(base_tts.base_Synthesizer):
                 else:
                     logging.error(f"Could not find tts engine for voice model: {character}! Please check your {self.config.config_path} file and try again!")
             if self.crashable:
-                input("Press enter to continue...")
+                utils.wait_for_user()
                 if type(character) != str:
                     raise ValueError(f"Could not find tts engine for voice model: {character.voice_model}! Please check your {self.config.config_path} file and try again!")
                 else:
@@ -89,38 +118,26 @@ class Synthesizer(base_tts.base_Synthesizer):
         else:
             return tts.get_valid_voice_model(character, crashable=self.crashable, multi_tts=True, log=log)
     
+    def prepare_synthesis(self, character):
+        """Get the voice model settings the tts engine the character is routed to will use"""
+        tts = self.route(character, log=False)
+        if tts is None:
+            return None # synthesize() reports the missing tts engine
+        return tts.prepare_synthesis(character)
+
     def synthesize(self, voiceline, character, **kwargs):
         """Synthesize the text for the character specified using either the 'tts_override' property of the character or using the first tts engine that supports the voice model of the character"""
-        tts = None
-        # print(voiceline)
-        # print(character)
-        if "tts_override" in character.__dict__:
-            for tts_engine in self.tts_engines:
-                if character.tts_override == tts_engine.tts_slug and tts_engine.get_valid_voice_model(character) != None:
-                    tts = tts_engine
-                    break
-                elif tts_engine.get_valid_voice_model(character) != None:
-                    tts = tts_engine
-                    break
-        else:
-            for tts_engine in self.tts_engines:
-                if tts_engine.get_valid_voice_model(character) != None:
-                    tts = tts_engine
-                    break
+        tts = self.route(character, log=False)
         if tts is None:
             logging.error(f"Could not find tts engine for voice model: {character.voice_model}! Please check your {self.config.config_path} file and try again!")
             if self.crashable:
-                input("Press enter to continue...")
+                utils.wait_for_user()
                 raise ValueError(f"Could not find tts engine for voice model: {character.voice_model}! Please check your {self.config.config_path} file and try again!")
         else:
             return tts.synthesize(voiceline, character, **kwargs)
         
     def _say(self, voiceline, voice_model="Female Sultry", volume=0.5):
-        tts = None
-        for tts_engine in self.tts_engines:
-            if tts_engine.get_valid_voice_model(voice_model) != None:
-                tts = tts_engine
-                break
+        tts = self.route(voice_model, log=False)
         if tts is None:
             logging.error(f"Could not find tts engine for voice model: {voice_model}! Please check your {self.config.config_path} file and try again!")
             if self.crashable:
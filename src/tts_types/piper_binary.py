@@ -3,7 +3,12 @@ from src.logging import logging
 import src.tts_types.base_tts as base_tts
 import os
 import json
+import queue
 import random
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
 logging.info("Imported required libraries in piper_binary.py")
 
 tts_slug = "piper_binary"
@@ -12,17 +17,79 @@ default_settings = {
     "piper_binary_dir": ".\\piper\\",
     "piper_models_dir": ".\\data\\models\\piper\\",
     "piper_tts_banned_voice_models": [],
+    "piper_max_loaded_voices": 2,
+    "piper_read_timeout": 60.0,
 }
 settings_description = {
     "piper_binary_dir": "The directory where the Piper binary is located. This can be changed in your [game_id]_config.json. The default is '.\\piper\\', which means that the Piper binary should be located in a folder called 'piper' in the same directory as Pantella.",
     "piper_models_dir": "The directory where the Piper models are located. This can be changed in your [game_id]_config.json. The default is '.\\data\\models\\piper\\', which means that the Piper models should be located in a folder called 'piper' inside the 'models' folder in the 'data' directory.",
-    "piper_tts_banned_voice_models": "A list of voice models to ban from being used by PiperTTS. This can be changed in your [game_id]_config.json. This is useful if you have a voice model that causes issues with PiperTTS, such as extremely long synthesis times or crashes."
+    "piper_tts_banned_voice_models": "A list of voice models to ban from being used by PiperTTS. This can be changed in your [game_id]_config.json. This is useful if you have a voice model that causes issues with PiperTTS, such as extremely long synthesis times or crashes.",
+    "piper_max_loaded_voices": "How many Piper voice models to keep loaded at once. Every loaded voice model is a Piper process that stays running between voicelines, so a voiceline only has to wait for synthesis instead of Piper starting up and loading the model. When a voice model that isn't loaded is needed, the least recently used one is closed.",
+    "piper_read_timeout": "How many seconds to wait for Piper to finish a voiceline. If it takes longer, the Piper process is assumed to be stuck, so it's killed and the voiceline is tried again with a new one.",
 }
 options = {}
 settings = {}
 loaded = False
 imported = True
 description = "PiperTTS is a fast and really easy to run on most computers. It doesn't require special hardware like a CUDA enabled GPU and instead runs on CPU."
+
+class PiperSession:
+    """A piper process with one voice model loaded, kept running between voicelines and fed one JSON line per voiceline on stdin.
+
+    Piper writes each voiceline to the output_file given in its JSON line and then prints the file's path on stdout, which is how a voiceline is known to be done."""
+    def __init__(self, command, model_path):
+        self.model_path = model_path
+        self.lock = threading.Lock()
+        self.output_dir = tempfile.mkdtemp(prefix="pantella_piper_") # piper needs an output directory in JSON input mode, voicelines are never written to it since every line names its own output_file
+        startupinfo = None
+        if os.name == "nt":
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        self.process = subprocess.Popen(command + ["--model", model_path, "--json-input", "--output_dir", self.output_dir], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8", errors="replace", bufsize=1, startupinfo=startupinfo)
+        self.stderr_thread = threading.Thread(target=self._log_stderr, daemon=True, name="pantella_piper_stderr")
+        self.stderr_thread.start()
+        self.responses = queue.Queue() # lines piper prints on stdout, read on their own thread so waiting for one can time out
+        self.stdout_thread = threading.Thread(target=self._read_stdout, daemon=True, name="pantella_piper_stdout")
+        self.stdout_thread.start()
+
+    def _log_stderr(self):
+        for line in self.process.stderr: # read continuously so piper never blocks on a full stderr pipe
+            logging.debug(f"piperTTS - {line.rstrip()}")
+
+    def _read_stdout(self):
+        for line in self.process.stdout:
+            self.responses.put(line)
+        self.responses.put("") # piper exited
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def synthesize(self, voiceline, output_file, timeout=None):
+        """Synthesize a voiceline to output_file and wait for it, for at most timeout seconds - a piper process that takes longer is killed"""
+        with self.lock:
+            self.process.stdin.write(json.dumps({"text": voiceline, "output_file": output_file}) + "\n")
+            self.process.stdin.flush()
+            try:
+                response = self.responses.get(timeout=timeout)
+            except queue.Empty:
+                self.process.kill()
+                self.process.wait()
+                raise TimeoutError(f"Piper process for {self.model_path} didn't finish a voiceline in {timeout} seconds, killed it")
+        if response == "":
+            raise RuntimeError(f"Piper process for {self.model_path} exited with code {self.process.poll()}")
+        return response.strip()
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except Exception:
+            self.process.kill()
+        try:
+            os.rmdir(self.output_dir)
+        except OSError:
+            pass
+
 class Synthesizer(base_tts.base_Synthesizer):
     def __init__(self, conversation_manager, ttses = []):
         global tts_slug, default_settings, loaded
@@ -30,6 +97,8 @@ class Synthesizer(base_tts.base_Synthesizer):
         self.tts_slug = tts_slug
         self._default_settings = default_settings
         self._voice_model_jsons = []
+        self.sessions = OrderedDict() # model path -> PiperSession, least recently used first
+        self.sessions_lock = threading.Lock()
         logging.config(f"Loading piper_binary voices for game_id '{self.config.game_id}' from {self.piper_models_dir}{self.config.game_id}\\")
         models_path = self.piper_models_dir+self.config.game_id+"\\"
         if self.config.linux_mode:
@@ -50,6 +119,15 @@ class Synthesizer(base_tts.base_Synthesizer):
             self._say("Piper T T S is ready to go.",random_voice)
         loaded = True
 
+    def unload(self):
+        """Unload the TTS engine and free up any resources it's using. This is called when the TTS engine is changed or when Pantella is closed."""
+        super().unload() # stop the lip sync worker
+        with self.sessions_lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            session.close()
+
     @property
     def piper_binary_dir(self):
         return self.conversation_manager.config.piper_binary_dir
@@ -72,14 +150,48 @@ class Synthesizer(base_tts.base_Synthesizer):
     def default_voice_model_settings(self):
         return {}
     
+    @property
+    def piper_command(self):
+        """The command that starts piper, without any arguments"""
+        if self.config.linux_mode:
+            return ["wine", os.path.join(self.piper_binary_dir.replace("\\", "/"), "piper.exe")]
+        return [os.path.join(self.piper_binary_dir, "piper.exe")]
+
+    def model_path(self, voice_model):
+        if self.config.linux_mode:
+            return f"{self.piper_models_dir}{self.config.game_id}/{voice_model.lower()}.onnx".replace("\\", "/")
+        return f"{self.piper_models_dir}{self.config.game_id}\\{voice_model.lower()}.onnx"
+
+    def get_session(self, voice_model):
+        """Get the running piper process for a voice model, starting it if it isn't running and closing the least recently used ones if there are too many"""
+        model_path = self.model_path(voice_model)
+        closed = []
+        with self.sessions_lock:
+            session = self.sessions.get(model_path)
+            if session is not None and not session.alive():
+                logging.warning(f"piperTTS - Piper process for {voice_model} exited with code {session.process.poll()}, restarting it")
+                del self.sessions[model_path]
+                closed.append(session)
+                session = None
+            if session is None:
+                logging.info(f"piperTTS - Starting piper process for voice model: {voice_model}")
+                session = PiperSession(self.piper_command, model_path)
+                self.sessions[model_path] = session
+            self.sessions.move_to_end(model_path)
+            while len(self.sessions) > max(1, int(self.config.piper_max_loaded_voices)):
+                _, old_session = self.sessions.popitem(last=False)
+                closed.append(old_session)
+        for old_session in closed:
+            old_session.close()
+        return session
+
     def _synthesize(self, voiceline, voice_model, voiceline_location, settings, aggro=0):
         """Synthesize the audio for the character specified using piper"""
         # make sure directory exists
         os.makedirs(os.path.dirname(voiceline_location), exist_ok=True)
-        if self.config.linux_mode:
-            command = f"echo \"{voiceline}\" | wine {self.piper_binary_dir}piper.exe --model {self.piper_models_dir}{self.config.game_id}/{voice_model.lower()}.onnx --output_file \"{voiceline_location}\""
-        else:
-            command = f"echo \"{voiceline}\" | {self.piper_binary_dir}piper.exe --model {self.piper_models_dir}{self.config.game_id}\\{voice_model.lower()}.onnx --output_file \"{voiceline_location}\""
         logging.output(f"piperTTS - Synthesizing voiceline: {voiceline}")
-        logging.config(f"piperTTS - Synthesizing voiceline with command: {command}")
-        os.system(command)
\ No newline at end of file
+        try:
+            self.get_session(voice_model).synthesize(voiceline, os.path.abspath(voiceline_location), self.config.piper_read_timeout)
+        except Exception as e: # the piper process died or got stuck mid-line, start it again and retry once
+            logging.warning(f"piperTTS - {e}, retrying")
+            self.get_session(voice_model).synthesize(voiceline, os.path.abspath(voiceline_location), self.config.piper_read_timeout)
\ No newline at end of file
@@ -2,6 +2,7 @@ from src.logging import logging
 logging.info("Importing pocket_tts.py...")
 import random
 import src.tts_types.base_tts as base_tts
+from src.audio_buffer import AudioBuffer
 imported = False
 try:
     logging.info("Trying to import pocket_tts")
@@ -13,7 +14,6 @@ try:
     import os
     import soundfile as sf
     from scipy.signal import resample
-    import scipy.io.wavfile
     imported = True
     logging.info("Imported pocket_tts")
 except Exception as e:
@@ -110,9 +110,7 @@ class Synthesizer(base_tts.base_Synthesizer):
         logging.info(f'{self.tts_slug} - generated audio for {voiceline} with voice model "{voice_model}" at sample rate {self.model.sample_rate}')
         # Save the generated audio to a temporary file
         # sf.write(voiceline_location, audio, self.model.sample_rate, subtype='PCM_16')
-        file_io = io.BytesIO()
-        scipy.io.wavfile.write(file_io, self.model.sample_rate, audio.numpy())
-        self.convert_to_16bit(file_io, voiceline_location)
+        self.convert_to_16bit(AudioBuffer(audio.numpy(), self.model.sample_rate), voiceline_location)
         
         if self.model is None:
             raise RuntimeError("TTS model is not loaded.")
@@ -54,6 +54,7 @@ class Synthesizer(base_tts.base_Synthesizer):
         
     def unload(self):
         """Unload the TTS engine and free up any resources it's using. This is called when the TTS engine is changed or when Pantella is closed."""
+        super().unload() # stop the lip sync worker
         if self.model is not None:
             logging.info(f'Unloading {self.tts_slug} model to free up resources...')
             del self.model
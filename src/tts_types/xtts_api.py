@@ -2,9 +2,10 @@ print("Loading xtts_api.py...")
 from src.logging import logging
 import src.utils as utils
 import src.tts_types.base_tts as base_tts
+from src.audio_buffer import AudioBuffer
+from src.http_client import HTTPClient
 import os
 from pathlib import Path
-import requests
 import time
 import subprocess
 import threading
@@ -54,6 +55,8 @@ class Synthesizer(base_tts.base_Synthesizer):
         super().__init__(conversation_manager)
         self.tts_slug = tts_slug
         self._default_settings = default_settings
+        self.http = HTTPClient(self.tts_slug, self.config) # one pooled keep-alive session for every request to the xTTS API server
+        self.voices_version = 0 # goes up whenever the voice list fetched from the server changes
         if not self.xtts_api_dir == "" or not self.xtts_api_dir == None or not self.xtts_api_dir.lower() == "none":
             if conversation_manager.config.linux_mode:
                 if not os.path.exists(self.xtts_api_dir+"/xtts_api_server/__init__.py"):
@@ -92,7 +95,6 @@ class Synthesizer(base_tts.base_Synthesizer):
         self.default_model = self.conversation_manager.config.default_xtts_api_model
         self.current_model = self.default_model
         self.set_model(self.default_model)
-        self._voices = None
         # self.official_model_list = ["main","v2.0.3","v2.0.2","v2.0.1","v2.0.0"]
         logging.config(f'xTTS_api - Available xTTS_api models: {self.available_models()}')
         logging.config(f'xTTS_api - Available xTTS_api voices: {self.voices()}')
@@ -215,49 +217,63 @@ class Synthesizer(base_tts.base_Synthesizer):
         # make all the paths absolute
         return [os.path.abspath(folder) for folder in voice_latent_folders]
 
-    def voices(self):
-        """Return a list of available voices"""
-        # Code to request and return the list of available models
-        if self._voices == None:
-            response = requests.get(self.xtts_get_speakers_list)
+    def fetch_voices(self):
+        """Request the list of available voices from the server - if the request fails, the last list the server gave is kept, or None if it never gave one"""
+        try:
+            response = self.http.get(self.xtts_get_speakers_list)
             if response.status_code != 200:
                 logging.error(f'Failed to get xTTS voices list: {response.status_code}')
-                return []
+                return getattr(self, "_fetched_voices", None)
             response = response.json()
-            if type(response) == dict:
-                base_lang = self.language["tts_language_code"]
-                if base_lang in response:
-                    response = response[base_lang]["speakers"]
-                    response.sort()
-            response = [voice for voice in response if voice not in self.config.xtts_api_banned_voice_models] 
-            self._voices = response
-        for banned_voice in self.config.xtts_api_banned_voice_models:
-            if banned_voice in self._voices:
-                self._voices.remove(banned_voice)
-        return self._voices
+        except Exception as e:
+            logging.error(f'Failed to get xTTS voices list, keeping the last voice list: {e}')
+            return getattr(self, "_fetched_voices", None)
+        if type(response) == dict:
+            base_lang = self.language["tts_language_code"]
+            if base_lang in response:
+                response = response[base_lang]["speakers"]
+                response.sort()
+        if response != getattr(self, "_fetched_voices", None):
+            self._fetched_voices = response
+            self.voices_version += 1
+        return response
+
+    def voices(self):
+        """Return a list of available voices"""
+        voices = self.http.cached("voices", self.fetch_voices) # only asks the server again once the cached list is older than tts_http_list_cache_ttl
+        if voices is None:
+            return []
+        return [voice for voice in voices if voice not in self.config.xtts_api_banned_voice_models]
+
+    def voice_catalog_signature(self):
+        self.voices() # refresh the voice list if it's expired, so the catalog is rebuilt if the server's voices changed
+        return (super().voice_catalog_signature(), self.voices_version)
     
     def available_models(self):
         """Return a list of available models"""
-        # Code to request and return the list of available models
-        response = requests.get(self.xtts_get_models_list)
-        return response.json() if response.status_code == 200 else []
+        def fetch_models():
+            response = self.http.get(self.xtts_get_models_list)
+            return response.json() if response.status_code == 200 else None
+        models = self.http.cached("models", fetch_models)
+        return models if models is not None else []
     
     def set_model(self, model):
         """Set the voice model"""
         if model not in self.available_models(): # if the model is not available, log an error and raise an exception
             logging.error(f"xTTS Model {model} not available but was specifically assigned to this NPC! Please add it to the xTTS models directory for this to work. Normal users shouldn't see this error, if you do, let someone know in the Discord server. <3")
-            input("Press enter to continue...")
+            utils.wait_for_user()
             raise FileNotFoundError()
         if self.current_model == model: # if the model is already set, do nothing
             return
         self.current_model = model # else: set the current model to the new model
-        requests.post(self.switch_model_url, json={"model_name": model}) # Request to switch the voice model
+        self.http.post(self.switch_model_url, json={"model_name": model}) # Request to switch the voice model
+        self.http.invalidate("voices", "models") # what the server lists can change with the model
     
     def is_running(self):
         """Check if the xTTS server is running"""
         try:
             print("Checking if xTTS server is running...", self.default_voice_model_settings)
-            response = requests.post(self.xtts_set_tts_settings, json=self.default_voice_model_settings)
+            response = self.http.post(self.xtts_set_tts_settings, json=self.default_voice_model_settings)
             response.raise_for_status()  # If the response contains an HTTP error status code, 
             return True
         except:
@@ -266,7 +282,7 @@ class Synthesizer(base_tts.base_Synthesizer):
     def set_settings(self, settings):
         """Set the xTTS settings"""
         try:
-            response = requests.post(self.xtts_set_tts_settings, json=settings)
+            response = self.http.post(self.xtts_set_tts_settings, json=settings)
             response.raise_for_status()  # If the response contains an HTTP error status code, raise an exception
             logging.info(f'Successfully set xTTS settings: {settings}')
             return True
@@ -305,6 +321,9 @@ class Synthesizer(base_tts.base_Synthesizer):
         
     def unload(self):
         """Unload the TTS engine and free up any resources it's using. This is called when the TTS engine is changed or when Pantella is closed."""
+        super().unload() # stop the lip sync worker
+        self.http.log_stats()
+        self.http.close()
         if self.active_PID is not None:
             logging.info(f'Terminating xTTS API server with PID: {self.active_PID}')
             try:
@@ -375,8 +394,9 @@ class Synthesizer(base_tts.base_Synthesizer):
             if log:
                 logging.info(f'Checking for valid voice model for "{character}" amongst:', options)
         voice_model = None
+        voice_catalog = self.voice_catalog
         for option in options:
-            if option in self.voices():
+            if option in voice_catalog:
                 if log:
                     logging.info(f'Voice model \'{option}\' is available for xTTS_api!')
                 voice_model = option
@@ -385,7 +405,7 @@ class Synthesizer(base_tts.base_Synthesizer):
             if log:
                 logging.error(f'Voice model \'{basic_voice_model}\' not available in xtts_api! Please add it to the xTTS latents directory, or put a sample of the voice in the speakers directory then restart the xTTS server and Pantella.')
         if crashable and voice_model == None:
-            input("Press enter to continue...")
+            utils.wait_for_user()
             raise FileNotFoundError()
         
         return voice_model
@@ -402,9 +422,9 @@ class Synthesizer(base_tts.base_Synthesizer):
         }
         # print(data)
         try:
-            response = requests.post(self.synthesize_url_xtts, json=data)
+            response = self.http.post(self.synthesize_url_xtts, json=data)
             if response.status_code == 200: # if the request was successful, write the wav file to disk at the specified path
-                self.convert_to_16bit(io.BytesIO(response.content), voiceline_location)
+                self.convert_to_16bit(AudioBuffer.from_bytes(response.content), voiceline_location) # xtts-api-server already sends 16-bit wavs, those are written without being decoded
             else:
                 logging.error(f'xTTS failed to generate voiceline at: {Path(voiceline_location)}')
                 raise FileNotFoundError()
@@ -2,6 +2,7 @@ print("Loading xvasynth.py")
 from src.logging import logging, time
 import src.utils as utils
 import src.tts_types.base_tts as base_tts
+from src.http_client import HTTPClient
 import requests
 import subprocess
 import os
@@ -14,6 +15,7 @@ import threading
 import traceback
 import random
 import sys
+import concurrent.futures
 from src.ui import root, FolderSelectionDialog
 logging.info("Imported required libraries in xVASynth TTS")
 
@@ -73,6 +75,7 @@ default_settings = {
     "xvasynth_default_use_sr": False,
     "xvasynth_banned_voice_models": [],
     "xvasynth_base_url": "http://127.0.0.1:8008",
+    "xvasynth_phrase_workers": 1,
 }
 settings_description = {
     "xvasynth_path": "The path to the xVASynth installation folder. This is required for Pantella to work with xVASynth. Please ensure that this path is correct and that xVASynth is installed in this location.",
@@ -82,6 +85,7 @@ settings_description = {
     "xvasynth_default_use_sr": "Whether to use super resolution on the generated audio. This can improve the quality of the audio, but may take longer to generate.",
     "xvasynth_banned_voice_models": "A list of voice models that are banned from being used. This can be used to prevent certain voice models from being used.",
     "xvasynth_base_url": "The base URL for the xVASynth API. This is used to communicate with the xVASynth server.",
+    "xvasynth_phrase_workers": "The number of phrases of a long voiceline that can be sent to xVASynth at the same time. Finished phrases are merged while the rest are still being synthesized. Only raise this if your xVASynth server can handle more than one request at a time.",
 }
 options = {
     "tts_language_code": [
@@ -314,6 +318,9 @@ class Synthesizer(base_tts.base_Synthesizer):
         super().__init__(conversation_manager)
         self.tts_slug = tts_slug
         self._default_settings = default_settings
+        self.http = HTTPClient(self.tts_slug, self.config, pool_size=max(4, int(self.config.xvasynth_phrase_workers))) # one pooled keep-alive session for every request to xVASynth, big enough for the phrase workers
+        self.voices_version = 0 # goes up whenever the voice list fetched from xVASynth changes
+        self.available_voices_set = False # setAvailableVoices is only sent with the first voice list request
         self.xvasynth_path = self.config.xvasynth_path
         if self.xvasynth_path == "":
             def select_xvasynth_directory():
@@ -377,13 +384,13 @@ class Synthesizer(base_tts.base_Synthesizer):
                 raise FileNotFoundError(f"xVASynth path invalid: {self.xvasynth_path}")
             
 
-        self._voices = None
 
         self.synthesize_url = f'{self.config.xvasynth_base_url}/synthesize'
         self.synthesize_simple_url = f'{self.config.xvasynth_base_url}/synthesizeSimple'
         self.synthesize_batch_url = f'{self.config.xvasynth_base_url}/synthesize_batch'
         self.loadmodel_url = f'{self.config.xvasynth_base_url}/loadModel'
         self.setvocoder_url = f'{self.config.xvasynth_base_url}/setVocoder'
+        self.phrase_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(self.config.xvasynth_phrase_workers)), thread_name_prefix="pantella_xvasynth")
         logging.config(f'xVASynth - Available voices: {self.voices()}')
         logging.config(f"Total xVASynth Voices: {len(self.voices())}")
         if len(self.voices()) > 0:
@@ -421,7 +428,7 @@ class Synthesizer(base_tts.base_Synthesizer):
         try:
             # contact local xVASynth server; ~2 second timeout
             logging.info(f'Checking if xVASynth is already running...')
-            response = requests.get(f'{self.config.xvasynth_base_url}/')
+            response = self.http.get(f'{self.config.xvasynth_base_url}/')
             response.raise_for_status()  # If the response contains an HTTP error status code, raise an exception
             return True
         except requests.exceptions.RequestException as err:
@@ -446,54 +453,61 @@ class Synthesizer(base_tts.base_Synthesizer):
             input('\nPress any key to stop Pantella...')
             raise e
     
-    def voices(self): # Send API request to xvasynth to get a list of characters
-        """Return a list of available voices"""
-        if self._voices is None:
-            self._voices = []
+    def set_available_voices(self):
+        """Point xVASynth at the models folder for the game (and Fallout 3's for TTW) - only needed once, refreshing the voice list after that just asks for it again"""
+        models_paths = {self.game: self.model_path}
+        if self.game == "falloutnv":
+            models_paths["fallout3"] = f"{self.xvasynth_path}/resources/app/models/fallout3/"
+        self.http.post(self.set_available_voices_url, json={'modelsPaths': json.dumps(models_paths)}) # Set the available voices to the ones in the models folders
+        self.available_voices_set = True
+
+    def fetch_voices(self):
+        """Ask xVASynth for the voices in the models folder - if it can't be reached, the last list it gave is kept, or None if it never gave one"""
+        try:
+            if not self.available_voices_set: # first fetch at startup
+                self.set_available_voices()
             logging.config(f"Getting available voices from {self.get_available_voices_url}...")
-            requests.post(self.set_available_voices_url, json={'modelsPaths': json.dumps({self.game: self.model_path})}) # Set the available voices to the ones in the models folder
-            available_voices_request = requests.post(self.get_available_voices_url) # Get the available voices
-            if available_voices_request.status_code == 200:
-                logging.config(f"Got available voices from {self.get_available_voices_url}...")
-                # logging.info(f"Response code: {r.status_code}")
-                # logging.info(f"Response text: {r.text}")
-                data = available_voices_request.json()
-                for character in data[self.game]:
-                    if self.game == "falloutnv" and character['voiceName'] in ttw_voice_mapping:
-                        self._voices.append(ttw_voice_mapping[character['voiceName']])
-                    else:
-                        self._voices.append(character['voiceName'])
+            available_voices_request = self.http.post(self.get_available_voices_url) # Get the available voices
+            available_voices_request.raise_for_status()
+            data = available_voices_request.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logging.error(f"Could not get available voices from {self.get_available_voices_url}, keeping the last voice list: {e}")
+            return getattr(self, "_fetched_voices", None)
+        logging.config(f"Got available voices from {self.get_available_voices_url}...")
+        voices = []
+        for character in data.get(self.game, []):
+            if self.game == "falloutnv" and character['voiceName'] in ttw_voice_mapping:
+                voices.append(ttw_voice_mapping[character['voiceName']])
             else:
-                logging.info(f"Could not get available voices from {self.get_available_voices_url}...")
-                # logging.info(f"Response code: {r.status_code}")
-                # logging.info(f"Response text: {r.text}")
-                data = None
-
-            if self.game == "falloutnv":
-                logging.config(f"Getting more available voices from {self.get_available_voices_url}...")
-                requests.post(self.set_available_voices_url, json={'modelsPaths': json.dumps({"fallout3": f"{self.xvasynth_path}/resources/app/models/fallout3/"})}) # Set the available voices to the ones in the models folder
-                available_voices_request = requests.post(self.get_available_voices_url) # Get the available voices
-                if available_voices_request.status_code == 200:
-                    logging.config(f"Got available voices from {self.get_available_voices_url}...")
-                    # logging.info(f"Response code: {r.status_code}")
-                    # logging.info(f"Response text: {r.text}")
-                    data = available_voices_request.json()
-                    for character in data["fallout3"]:
-                        if character['voiceName'] not in ttw_voice_mapping:
-                            self._voices.append(character['voiceName'])
-                        else:
-                            self._voices.append(ttw_voice_mapping[character['voiceName']])
+                voices.append(character['voiceName'])
+        if self.game == "falloutnv":
+            for character in data.get("fallout3", []):
+                if character['voiceName'] not in ttw_voice_mapping:
+                    voices.append(character['voiceName'])
                 else:
-                    logging.info(f"Could not get available voices from {self.get_available_voices_url}...")
-                    # logging.info(f"Response code: {r.status_code}")
-                    # logging.info(f"Response text: {r.text}")
-                    data = None
+                    voices.append(ttw_voice_mapping[character['voiceName']])
+        if voices != getattr(self, "_fetched_voices", None):
+            self._fetched_voices = voices
+            self.voices_version += 1
+        return voices
 
-            self._voices = [voice for voice in self._voices if voice not in self.config.xvasynth_banned_voice_models] 
-        for banned_voice in self.config.xvasynth_banned_voice_models:
-            if banned_voice in self._voices:
-                self._voices.remove(banned_voice)
-        return self._voices
+    def voices(self): # Send API request to xvasynth to get a list of characters
+        """Return a list of available voices"""
+        voices = self.http.cached("voices", self.fetch_voices) # only asks xVASynth again once the cached list is older than tts_http_list_cache_ttl
+        if voices is None:
+            return []
+        return [voice for voice in voices if voice not in self.config.xvasynth_banned_voice_models]
+
+    def voice_catalog_signature(self):
+        self.voices() # refresh the voice list if it's expired, so the catalog is rebuilt if xVASynth's voices changed
+        return (super().voice_catalog_signature(), self.voices_version)
+
+    def unload(self):
+        """Unload the TTS engine and free up any resources it's using. This is called when the TTS engine is changed or when Pantella is closed."""
+        super().unload() # stop the lip sync worker
+        self.phrase_executor.shutdown(wait=False, cancel_futures=True) # drop phrases that haven't been sent to xVASynth yet
+        self.http.log_stats()
+        self.http.close()
 
     @property
     def default_voice_model_settings(self):
@@ -535,7 +549,7 @@ class Synthesizer(base_tts.base_Synthesizer):
         logging.config(f'Pace: {self.pace}')
         logging.config(f'Use SR: {self.use_sr}')
         logging.config(f'Use Cleanup: {self.use_cleanup}')
-        requests.post(self.synthesize_url, json=data)
+        self.http.post(self.synthesize_url, json=data)
 
     @utils.time_it
     def _batch_synthesize(self, grouped_sentences, voiceline_files, settings):
@@ -558,7 +572,7 @@ class Synthesizer(base_tts.base_Synthesizer):
             'useSR': settings.get('use_sr', self.default_voice_model_settings["use_sr"]),
             'useCleanup': settings.get('use_cleanup', self.default_voice_model_settings["use_cleanup"]),
         }
-        requests.post(self.synthesize_batch_url, json=data)
+        self.http.post(self.synthesize_batch_url, json=data)
 
     def _synthesize(self, voiceline, voice_model, voiceline_location, settings, aggro=0):
         voiceline = ' ' + voiceline.strip() + ' ' # xVASynth apparently performs better having spaces at the start and end of the voiceline for some reason
@@ -575,10 +589,10 @@ class Synthesizer(base_tts.base_Synthesizer):
             # TODO: include batch synthesis for v3 models (batch not needed very often)
             if self.model_type != 'xVAPitch':
                 self._batch_synthesize(phrases, voiceline_files, settings)
-            else:
-                for i, voiceline_file in enumerate(voiceline_files):
-                    self._synthesize_line(phrases[i], voiceline_files[i], settings)
-            self.merge_audio_files(voiceline_files, voiceline_location)
+                self.merge_audio_files(voiceline_files, voiceline_location)
+            else: # queue every phrase at once and merge each one as soon as it's done, while the later phrases are still being synthesized
+                phrase_jobs = [self.phrase_executor.submit(self._synthesize_line, phrases[i], voiceline_files[i], settings, aggro) for i in range(len(phrases))]
+                self.merge_audio_files(voiceline_files, voiceline_location, jobs=phrase_jobs)
 
     @utils.time_it
     def _group_sentences(self, voiceline_sentences, max_length=150):
@@ -646,18 +660,26 @@ class Synthesizer(base_tts.base_Synthesizer):
 
         return result
 
-    def merge_audio_files(self, audio_files, voiceline_file_name, retries=3):
-        """Merge multiple audio files into one file"""
+    def merge_audio_files(self, audio_files, voiceline_file_name, retries=3, jobs=None):
+        """Merge multiple audio files into one file - if jobs is passed, each file is read as soon as the job writing it is done"""
         logging.info(f'Merging audio files: {audio_files}')
         logging.info(f'Output file: {voiceline_file_name}')
-        merged_audio = np.array([])
+        audio_parts = []
         
-        for audio_file in audio_files:
+        for i, audio_file in enumerate(audio_files):
+            if jobs is not None:
+                try:
+                    jobs[i].result()
+                except Exception as e:
+                    for job in jobs[i+1:]: # don't synthesize the rest of a line that can't be finished
+                        job.cancel()
+                    logging.error(f'xVASynth failed to synthesize phrase {i} of the voiceline: {e}')
+                    raise e
             tries_left = int(retries)
             while tries_left > 0:
                 try:
                     audio, samplerate = sf.read(audio_file)
-                    merged_audio = np.concatenate((merged_audio, audio))
+                    audio_parts.append(audio)
                     break
                 except:
                     logging.info(f'Could not find voiceline file: {audio_file}')
@@ -667,6 +689,7 @@ class Synthesizer(base_tts.base_Synthesizer):
                         raise FileNotFoundError(f'Could not find voiceline file: {audio_file}')
                     else:
                         time.sleep(0.2)
+        merged_audio = np.concatenate(audio_parts) # allocated once for the whole line, instead of copying everything merged so far for every phrase
         sf.write(voiceline_file_name, merged_audio, samplerate)
   
     @utils.time_it
@@ -684,7 +707,7 @@ class Synthesizer(base_tts.base_Synthesizer):
         if voice is None:
             logging.error(f'Voice model {voice} not available! Please add it to xVASynth voices list.')
         if self.crashable and voice is None:
-            input("Press enter to continue...")
+            utils.wait_for_user()
             raise base_tts.VoiceModelNotFound(f'Voice model {voice} not available! Please add it to xVASynth voices list.')
 
         logging.info(f'Loading voice model {voice}...')
@@ -759,7 +782,7 @@ class Synthesizer(base_tts.base_Synthesizer):
             #     raise Exception(f"Unknown xVASynth model version {voice_model_json.get('version')}. Cannot determine how to set number of speakers for this model. Please ensure that your voice models are up to date with the latest version of xVASynth and that they include a version number in their json file.")
             
         logging.info(f'Loading voice model with data: {json.dumps(model_change, indent=4)}')
-        requests.post(self.loadmodel_url, json=model_change)
+        self.http.post(self.loadmodel_url, json=model_change)
 
         self.last_voice = voice
         logging.info('Voice model loaded.')
@@ -4,7 +4,8 @@ import re
 import string
 import sys
 import os
-from shutil import rmtree
+import threading
+from shutil import rmtree, copyfile
 from charset_normalizer import detect
 logging.info("Imported required libraries in utils.py")
 
@@ -40,6 +41,29 @@ def resolve_path():
     return resolved_path
 
 
+def wait_for_user(prompt="Press enter to continue..."):
+    """Wait for the user to press enter before an error is raised - only on the main thread, on worker threads the error is raised straight away and the user is asked when it reaches the main thread"""
+    if threading.current_thread() is threading.main_thread():
+        input(prompt)
+
+
+def link_or_copy(source, destination):
+    """Hard link source to destination, or copy it if linking isn't possible (different drives, filesystems without hard links, etc.)"""
+    if os.path.exists(destination): # never write through an existing link, it could be sharing its data with another file
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        copyfile(source, destination)
+
+
+def copy_file(source, destination):
+    """Copy source to destination, replacing destination rather than writing into it in case it's a hard link shared with other files"""
+    if os.path.exists(destination):
+        os.remove(destination)
+    copyfile(source, destination)
+
+
 def get_file_encoding(file_path):
     """Get the encoding of a file using charset_normalizer"""
     with open(file_path,'rb') as f:
@@ -0,0 +1,37 @@
+print("Importing voice_catalog.py")
+from src.logging import logging
+logging.info("Imported required libraries in voice_catalog.py")
+
+def spaceless_key(voice_model):
+    return voice_model.replace(' ', '').lower()
+
+class VoiceCatalog:
+    """The voices a synthesizer has available, indexed by every alias get_valid_voice_model() accepts for them - exact, lowercase and lowercase without spaces.
+
+    Built once from the synthesizer's voices() and replaced whenever the voices change, so resolving a voice model is a few dict lookups instead of rebuilding the lookup tables from a fresh directory listing every time."""
+    def __init__(self, voices):
+        self.voices = list(voices)
+        self.exact = set(self.voices)
+        self.lower = {} # later voices overwrite earlier ones on collisions, same as the lookup tables this replaces
+        self.spaceless = {}
+        for voice in self.voices:
+            self.lower[voice.lower()] = voice
+            self.spaceless[spaceless_key(voice)] = voice
+
+    def __len__(self):
+        return len(self.voices)
+
+    def __contains__(self, voice_model):
+        return voice_model in self.exact
+
+    def resolve(self, voice_model):
+        """Get the available voice that voice_model is an alias of, or None - returns the voice and how it was matched ("exact", "lowercase" or "spaceless")"""
+        if voice_model in self.exact:
+            return voice_model, "exact"
+        lower_voice_model = voice_model.lower()
+        if lower_voice_model in self.lower:
+            return self.lower[lower_voice_model], "lowercase"
+        spaceless_voice_model = lower_voice_model.replace(' ', '')
+        if spaceless_voice_model in self.spaceless:
+            return self.spaceless[spaceless_voice_model], "spaceless"
+        return None, None
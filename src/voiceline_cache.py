@@ -0,0 +1,141 @@
+print("Importing voiceline_cache.py")
+from src.logging import logging, time
+import src.utils as utils
+import os
+import json
+import shutil
+import hashlib
+import threading
+import unicodedata
+logging.info("Imported required libraries in voiceline_cache.py")
+
+def normalize_voiceline(voiceline):
+    """Normalize a voiceline so lines that would sound the same share a cache entry"""
+    return " ".join(unicodedata.normalize('NFKC', voiceline).split())
+
+class VoicelineCache:
+    """On-disk cache of synthesized voicelines and their lip files, addressed by a hash of everything that affects how the line sounds.
+
+    Entries are stored as <hash>.wav and <hash>.lip in two character subfolders of cache_dir. When the cache grows past max_bytes, the least recently used entries are deleted until it's back under budget."""
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.entries = {} # key -> [size in bytes, last used time]
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._scan()
+        logging.info(f"Voiceline cache at {self.cache_dir} holds {len(self.entries)} voicelines ({round(self.total_bytes / 1048576, 2)} MB of {round(self.max_bytes / 1048576, 2)} MB)")
+
+    def _scan(self):
+        for folder in os.listdir(self.cache_dir):
+            folder_path = os.path.join(self.cache_dir, folder)
+            if not os.path.isdir(folder_path):
+                continue
+            for file_name in os.listdir(folder_path):
+                if not file_name.endswith(".wav"):
+                    continue
+                key = file_name[:-4]
+                wav_path, lip_path = self.paths(key)
+                if not os.path.exists(lip_path): # left behind by a crash while storing, not a usable entry
+                    os.remove(wav_path)
+                    continue
+                size = os.path.getsize(wav_path) + os.path.getsize(lip_path)
+                self.entries[key] = [size, os.path.getmtime(wav_path)]
+                self.total_bytes += size
+
+    def key(self, tts_slug, voice_model, voiceline, settings, language, extra=None):
+        """Hash everything that affects the synthesized audio into a cache key"""
+        description = json.dumps([tts_slug, voice_model, normalize_voiceline(voiceline), settings, language, extra], sort_keys=True, default=str)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def contains(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def paths(self, key):
+        folder = os.path.join(self.cache_dir, key[:2])
+        return os.path.join(folder, key + ".wav"), os.path.join(folder, key + ".lip")
+
+    def get(self, key, final_voiceline_file):
+        """Put the cached voiceline and lip file for key at final_voiceline_file - returns False if there's no entry for key"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False
+            entry[1] = time.time()
+        wav_path, lip_path = self.paths(key)
+        try:
+            utils.link_or_copy(wav_path, final_voiceline_file)
+            utils.link_or_copy(lip_path, final_voiceline_file.replace(".wav", ".lip"))
+            os.utime(wav_path) # keep the last used time across restarts
+        except OSError as e:
+            logging.warning(f"Could not use cached voiceline {key}, synthesizing it again: {e}")
+            self.remove(key)
+            return False
+        return True
+
+    def put(self, key, final_voiceline_file):
+        """Store a synthesized voiceline and its lip file under key"""
+        lip_file = final_voiceline_file.replace(".wav", ".lip")
+        if not os.path.exists(final_voiceline_file) or not os.path.exists(lip_file):
+            return
+        wav_path, lip_path = self.paths(key)
+        try:
+            os.makedirs(os.path.dirname(wav_path), exist_ok=True)
+            # the lip file is stored first and the wav last, so an entry only counts once both are complete
+            shutil.copyfile(lip_file, lip_path + ".tmp")
+            os.replace(lip_path + ".tmp", lip_path)
+            shutil.copyfile(final_voiceline_file, wav_path + ".tmp")
+            os.replace(wav_path + ".tmp", wav_path)
+        except OSError as e:
+            logging.warning(f"Could not add voiceline to the voiceline cache: {e}")
+            return
+        size = os.path.getsize(wav_path) + os.path.getsize(lip_path)
+        with self.lock:
+            old_entry = self.entries.get(key)
+            if old_entry is not None:
+                self.total_bytes -= old_entry[0]
+            self.entries[key] = [size, time.time()]
+            self.total_bytes += size
+        self.evict()
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.total_bytes -= entry[0]
+        for path in self.paths(key):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                logging.warning(f"Could not remove cached voiceline file {path}: {e}")
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in its size budget"""
+        with self.lock:
+            if self.total_bytes <= self.max_bytes:
+                return
+            by_last_use = sorted(self.entries.items(), key=lambda item: item[1][1])
+            evicted = []
+            total_bytes = self.total_bytes
+            for key, entry in by_last_use:
+                if total_bytes <= self.max_bytes:
+                    break
+                evicted.append(key)
+                total_bytes -= entry[0]
+        for key in evicted:
+            self.remove(key)
+        logging.debug(f"Evicted {len(evicted)} voicelines from the voiceline cache")
+
+caches = {} # cache directory -> VoicelineCache, so every synthesizer using the same directory shares one index
+caches_lock = threading.Lock()
+
+def get_cache(cache_dir, max_bytes):
+    """Get the voiceline cache for a directory, creating it the first time it's asked for"""
+    cache_dir = os.path.abspath(cache_dir)
+    with caches_lock:
+        if cache_dir not in caches:
+            caches[cache_dir] = VoicelineCache(cache_dir, max_bytes)
+        return caches[cache_dir]
@@ -0,0 +1,68 @@
+print("Loading test_f5_tts.py")
+from src.logging import logging
+import src.tts_types.f5_tts as f5_tts
+import src.tts_types.e2_tts as e2_tts
+from src.audio_buffer import remove_silence
+from types import SimpleNamespace
+from unittest import mock
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import soundfile as sf
+logging.info("Imported required libraries in test_f5_tts.py")
+
+# Run from the Pantella folder: python -m unittest test_f5_tts
+
+SAMPLE_RATE = 24000
+
+def generated_wave():
+    """What the model "generates" - two tones with two seconds of silence between them, so trimming the silence shortens it"""
+    tone = np.full(SAMPLE_RATE // 2, 0.25, dtype=np.float32)
+    return np.concatenate((tone, np.zeros(SAMPLE_RATE * 2, dtype=np.float32), tone))
+
+def fake_synthesizer(module, volume):
+    """An F5/E2 Synthesizer with a stand-in model, without loading anything"""
+    synthesizer = module.Synthesizer.__new__(module.Synthesizer)
+    synthesizer.tts_slug = module.tts_slug
+    synthesizer.config = SimpleNamespace(**{f"{module.tts_slug}_volume": volume})
+    synthesizer.reference_cache = {}
+    synthesizer.model = object()
+    return synthesizer
+
+class TestInfer(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.speaker_wav = os.path.join(self.folder, "speaker.wav")
+        sf.write(self.speaker_wav, np.zeros(SAMPLE_RATE), SAMPLE_RATE)
+        self.output_path = os.path.join(self.folder, "voiceline.wav")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def infer(self, module, remove_silence):
+        synthesizer = fake_synthesizer(module, volume=1.5)
+        with mock.patch.object(module, "preprocess_ref_audio_text", return_value=(self.speaker_wav, "Hello there.")), \
+             mock.patch.object(module, "infer_process", return_value=(generated_wave(), SAMPLE_RATE, None)) as infer_process:
+            synthesizer.infer(ref_audio_orig=self.speaker_wav, ref_text="Hello there.", gen_text="General Kenobi.", output_path=self.output_path, remove_silence=remove_silence)
+        self.assertIs(infer_process.call_args.args[3], synthesizer.model)
+        audio, samplerate = sf.read(self.output_path, dtype='float32')
+        self.assertEqual(samplerate, SAMPLE_RATE)
+        return audio
+
+    def test_remove_silence_trims_and_applies_volume(self):
+        for module in [f5_tts, e2_tts]:
+            with self.subTest(tts=module.tts_slug):
+                audio = self.infer(module, remove_silence=True)
+                expected = remove_silence(generated_wave(), SAMPLE_RATE) * 1.5
+                self.assertLess(len(audio), len(generated_wave()))
+                np.testing.assert_allclose(audio, expected, atol=1e-3)
+
+    def test_without_remove_silence_writes_generated_audio(self):
+        for module in [f5_tts, e2_tts]:
+            with self.subTest(tts=module.tts_slug):
+                np.testing.assert_allclose(self.infer(module, remove_silence=False), generated_wave(), atol=1e-3)
+
+if __name__ == '__main__':
+    unittest.main()
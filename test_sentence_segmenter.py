@@ -0,0 +1,228 @@
+print("Loading test_sentence_segmenter.py")
+from src.logging import logging
+from src.sentence_segmenter import SentenceSegmenter, ReplyBuilder
+import random
+import unicodedata
+import unittest
+logging.info("Imported required libraries in test_sentence_segmenter.py")
+
+# Run from the Pantella folder: python -m unittest test_sentence_segmenter
+
+# The same values base_LLM.process_response() builds from prompt_styles/skyrim_en_gemma4.json
+END_OF_SENTENCE_CHARS = ['.', '?', '!']
+ROLEPLAY_SYMBOLS = ['*', '*', '(', ')']
+REPLACEMENTS = [{'char': '“', 'replacement': ''}, {'char': '”', 'replacement': ''}, {'char': '"', 'replacement': ''}, {'char': '\n', 'replacement': ' '}]
+STOP = ['<|turn>', '<turn|>', '<channel|>', '\n\n', '<|turn>'] # stop strings, message separator, EOS and BOS tokens
+EOS_TOKEN = '<turn|>'
+MESSAGE_SIGNIFIER = ':'
+
+# Replies as the LLM streams them - author prefix, narrator turns, roleplay asides, quotes, stop strings and EOS tokens in all the places they show up in practice
+CORPUS = [
+    "Lydia: I am sworn to carry your burdens.<turn|>",
+    "Lydia: I am sworn to carry your burdens. *She rests a hand on her sword.* Shall we go?<turn|>\n<|turn>user\n",
+    "Narrator: *The wind howls across the pass.* A lone figure approaches from the north.<turn|>",
+    "Narrator: (The innkeeper wipes down the bar.) \"We're closed,\" he says.<turn|>",
+    "Belethor: “Everything's for sale, my friend!” Everything. If I had a sister, I'd sell her in a second.<TURN|>",
+    "Ulfric Stormcloak: Skyrim belongs to the Nords!\nWe will not be ruled by the Thalmor.<turn|>",
+    "Heimskr: Talos is the one true god! Talos the mighty!<channel|>thought\nThe player ignores me again.",
+    "Nazeem: Do you get to the Cloud District very often? Oh, what am I saying, of course you don't.\n\nUser: Excuse me?",
+    "Lydia: ...<turn|>",
+    "Lydia: I'll wait here.",
+    "Arngeir: Ro... Fus... Ro Dah!<turn|>",
+    "Paarthurnax: Drem Yol Lok. Greetings, wunduni.<turn|><turn|>",
+    "Serana:*She glances at the sky.*Another cloudless night. Perfect for hunting.<turn|>",
+]
+
+def split_stream(reply, rng):
+    """Cut a reply into chunks the way tokenizers do - mostly short, occasionally a single character or a long run"""
+    chunks = []
+    i = 0
+    while i < len(reply):
+        size = rng.choice([1, 1, 2, 3, 4, 5, 7, 12])
+        chunks.append(reply[i:i+size])
+        i += size
+    return chunks
+
+def reference_stream(chunks):
+    """The token loop as process_response() ran it before the segmenter, reduced to the parts the segmenter replaced - rescans the whole raw reply and sentence on every chunk"""
+    raw_reply = ''
+    proposed_next_author = ''
+    next_author = None
+    sentence = ''
+    sentences = []
+    eos = False
+    events = []
+    for content in chunks:
+        if eos:
+            break
+        raw_reply += content
+        if EOS_TOKEN in raw_reply:
+            eos = True
+        elif EOS_TOKEN.lower() in raw_reply.lower():
+            eos = True
+        contains_end_of_sentence_character = any(char in unicodedata.normalize('NFKC', content) for char in END_OF_SENTENCE_CHARS)
+        contains_roleplay_symbol = any(char in unicodedata.normalize('NFKC', content) for char in ROLEPLAY_SYMBOLS)
+        for replacement in REPLACEMENTS:
+            char, replacement_char = replacement["char"], replacement["replacement"]
+            if char in content:
+                content = content.replace(char, replacement_char)
+        if next_author is None:
+            proposed_next_author += content
+            if MESSAGE_SIGNIFIER in proposed_next_author:
+                next_author = proposed_next_author.split(MESSAGE_SIGNIFIER)[0]
+                sentence = proposed_next_author[len(next_author)+len(MESSAGE_SIGNIFIER):]
+                raw_reply = raw_reply.split(MESSAGE_SIGNIFIER, 1)[1]
+        else:
+            sentence += content
+            for replacement in REPLACEMENTS:
+                char, replacement_char = replacement["char"], replacement["replacement"]
+                if char in sentence:
+                    sentence = sentence.replace(char, replacement_char)
+            for char in STOP:
+                if char in sentence:
+                    eos = True
+                    sentence = sentence.split(char)[0]
+                    raw_reply = raw_reply.split(char)[0]
+        if eos:
+            sentence = sentence.split(EOS_TOKEN)[0]
+            raw_reply = raw_reply.split(EOS_TOKEN)[0]
+        events.append((content, contains_end_of_sentence_character, contains_roleplay_symbol, eos, next_author))
+        if next_author is not None and (contains_end_of_sentence_character or contains_roleplay_symbol or eos):
+            sentences.append(sentence)
+            sentence = ''
+    return events, sentences, raw_reply, next_author
+
+def segmenter_stream(chunks, segmenter=None):
+    """The same loop driven through SentenceSegmenter, the way process_response() uses it now"""
+    if segmenter is None:
+        segmenter = SentenceSegmenter(END_OF_SENTENCE_CHARS, ROLEPLAY_SYMBOLS, REPLACEMENTS, STOP, EOS_TOKEN, MESSAGE_SIGNIFIER)
+    next_author = None
+    sentence = ''
+    sentences = []
+    events = []
+    for content in chunks:
+        if segmenter.eos:
+            break
+        chunk_event = segmenter.feed(content)
+        content = chunk_event.content
+        if next_author is None:
+            if segmenter.propose_author(content):
+                next_author = segmenter.proposed_next_author.split(MESSAGE_SIGNIFIER)[0]
+                sentence = segmenter.proposed_next_author[len(next_author)+len(MESSAGE_SIGNIFIER):]
+                segmenter.author_found()
+        else:
+            sentence = segmenter.append_to_sentence(sentence, content)
+        if segmenter.eos:
+            sentence = segmenter.trim_to_eos(sentence)
+        events.append((content, chunk_event.end_of_sentence, chunk_event.roleplay_symbol, segmenter.eos, next_author))
+        if next_author is not None and (chunk_event.end_of_sentence or chunk_event.roleplay_symbol or segmenter.eos):
+            sentences.append(sentence)
+            sentence = ''
+    return events, sentences, segmenter.raw_reply, next_author
+
+class TestSentenceSegmenter(unittest.TestCase):
+    def new_segmenter(self):
+        return SentenceSegmenter(END_OF_SENTENCE_CHARS, ROLEPLAY_SYMBOLS, REPLACEMENTS, STOP, EOS_TOKEN, MESSAGE_SIGNIFIER)
+
+    def test_corpus_matches_reference(self):
+        rng = random.Random(0)
+        for reply in CORPUS:
+            chunkings = [list(reply), [reply]] + [split_stream(reply, rng) for _ in range(50)]
+            for chunks in chunkings:
+                with self.subTest(reply=reply, chunks=chunks):
+                    self.assertEqual(segmenter_stream(chunks), reference_stream(chunks))
+
+    def test_author_prefix_split_across_chunks(self):
+        segmenter = self.new_segmenter()
+        self.assertFalse(segmenter.propose_author("Ulfric Storm"))
+        self.assertFalse(segmenter.propose_author("cloak"))
+        self.assertTrue(segmenter.propose_author(": Skyrim"))
+        self.assertEqual(segmenter.proposed_next_author, "Ulfric Stormcloak: Skyrim")
+
+    def test_author_found_keeps_later_signifiers(self):
+        segmenter = self.new_segmenter()
+        for content in ["Lydia", ": Two things", ": steel and", " resolve."]:
+            segmenter.feed(content)
+        segmenter.author_found()
+        self.assertEqual(segmenter.raw_reply, " Two things: steel and resolve.")
+
+    def test_no_author_without_signifier(self):
+        events, sentences, raw_reply, next_author = segmenter_stream(list("I used to be an adventurer like you."))
+        self.assertIsNone(next_author)
+        self.assertEqual(sentences, [])
+
+    def test_eos_split_across_chunks(self):
+        segmenter = self.new_segmenter()
+        segmenter.feed("Lydia: Yes, my Thane.<tu")
+        self.assertFalse(segmenter.eos)
+        segmenter.feed("rn")
+        self.assertFalse(segmenter.eos)
+        self.assertTrue(segmenter.feed("|>\n").eos)
+
+    def test_eos_case_insensitive(self):
+        segmenter = self.new_segmenter()
+        self.assertTrue(segmenter.feed("Lydia: Yes.<TURN|>").eos)
+
+    def test_trim_to_eos(self):
+        segmenter = self.new_segmenter()
+        segmenter.feed("Yes, my Thane.<turn|>model")
+        self.assertEqual(segmenter.trim_to_eos(" Yes, my Thane.<turn|>model"), " Yes, my Thane.")
+        self.assertEqual(segmenter.raw_reply, "Yes, my Thane.")
+
+    def test_stop_string_trims_sentence_and_raw_reply(self):
+        segmenter = self.new_segmenter()
+        sentence = ''
+        for content in ["Talos", " is", " mighty", "!<chan", "nel|>", "thought"]:
+            segmenter.feed(content)
+            sentence = segmenter.append_to_sentence(sentence, content)
+            if segmenter.eos:
+                break
+        self.assertTrue(segmenter.eos)
+        self.assertEqual(sentence, "Talos is mighty!")
+        self.assertEqual(segmenter.raw_reply, "Talos is mighty!")
+
+    def test_replacements_applied_to_chunk_and_sentence(self):
+        segmenter = self.new_segmenter()
+        event = segmenter.feed("“Everything's\nfor sale!”")
+        self.assertEqual(event.content, "Everything's for sale!")
+        self.assertEqual(segmenter.append_to_sentence("I said, ", event.content), "I said, Everything's for sale!")
+
+    def test_narrator_roleplay_symbols(self):
+        segmenter = self.new_segmenter()
+        self.assertTrue(segmenter.feed(" *The wind").roleplay_symbol)
+        self.assertFalse(segmenter.feed(" howls").roleplay_symbol)
+        self.assertTrue(segmenter.feed(".)").roleplay_symbol)
+        self.assertTrue(segmenter.feed("(").roleplay_symbol)
+
+    def test_end_of_sentence_normalized(self):
+        segmenter = self.new_segmenter()
+        self.assertTrue(segmenter.feed("Halt！").end_of_sentence) # fullwidth exclamation mark normalizes to '!'
+        self.assertFalse(segmenter.feed("Halt,").end_of_sentence)
+
+    def test_reset_between_retries(self):
+        segmenter = self.new_segmenter()
+        segmenter.feed("Lydia: Yes.<turn|>")
+        segmenter.propose_author("Lydia:")
+        segmenter.reset()
+        self.assertFalse(segmenter.eos)
+        self.assertEqual(segmenter.raw_reply, '')
+        self.assertEqual(segmenter.proposed_next_author, '')
+
+class TestReplyBuilder(unittest.TestCase):
+    def test_matches_string_concatenation(self):
+        rng = random.Random(0)
+        pieces = ["[s0] ", "[ns1]", "*", " ", "", "Yes, my Thane.", " She nods. ", "  ", "Shall we go?", "\n"]
+        for _ in range(500):
+            full_reply = ''
+            builder = ReplyBuilder()
+            for _ in range(rng.randint(0, 12)):
+                appended = [rng.choice(pieces) for _ in range(rng.randint(1, 2))]
+                full_reply = full_reply.strip() + "".join(appended)
+                builder.append(*appended)
+                for suffix in ["*", " ", "?", "go?", "[s0] "]:
+                    self.assertEqual(builder.endswith(suffix), full_reply.strip().endswith(suffix))
+                self.assertEqual(builder.is_empty(), full_reply.strip() == '')
+            self.assertEqual(str(builder), full_reply.strip())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+print("Loading test_xvasynth.py")
+from src.logging import logging
+import src.tts_types.xvasynth as xvasynth
+from src.http_client import HTTPClient
+from types import SimpleNamespace
+import concurrent.futures
+import http.server
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import numpy as np
+import soundfile as sf
+logging.info("Imported required libraries in test_xvasynth.py")
+
+# Run from the Pantella folder: python -m unittest test_xvasynth
+
+class FakeXVASynthServer:
+    """A stand-in for xVASynth's headless server on localhost, for testing the xVASynth synthesizer without xVASynth installed.
+
+    /synthesize writes a short wav to the requested outfile after a random delay, so phrases sent at the same time finish out of order like they can on a real server. Every sample in a phrase's wav is set to the number the phrase starts with divided by 100, so a test can tell which phrase ended up where in the merged audio."""
+    def __init__(self, max_delay=0.2, seed=0, samplerate=22050):
+        self.max_delay = max_delay
+        self.random = random.Random(seed)
+        self.samplerate = samplerate
+        self.requests = [] # (path, json body) for every POST, in the order they arrived
+        self.in_flight = 0
+        self.max_in_flight = 0 # most /synthesize requests handled at the same time
+        self.fail_voice_lists = False # answer /getAvailableVoices with an error, like a server that's busy or restarting
+        self.lock = threading.Lock()
+        fake_server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def reply(self, status, body):
+                body = json.dumps(body).encode("utf-8") if not isinstance(body, bytes) else body
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.reply(200, b"Enabled")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                data = json.loads(self.rfile.read(length) or b"{}")
+                with fake_server.lock:
+                    fake_server.requests.append((self.path, data))
+                if self.path == "/synthesize":
+                    self.reply(200, fake_server.synthesize(data))
+                elif self.path == "/getAvailableVoices":
+                    if fake_server.fail_voice_lists:
+                        self.reply(500, b"")
+                    else:
+                        self.reply(200, {"skyrim": [{"voiceName": "femalenord"}, {"voiceName": "malenord"}]})
+                else: # /setAvailableVoices, /loadModel, /setVocoder
+                    self.reply(200, b"")
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = None
+
+    def synthesize(self, data):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            delay = self.random.uniform(0, self.max_delay)
+        try:
+            time.sleep(delay)
+            phrase_number = int(data["sequence"].split()[0])
+            os.makedirs(os.path.dirname(data["outfile"]), exist_ok=True)
+            sf.write(data["outfile"], self.phrase_audio(phrase_number), self.samplerate)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        return b""
+
+    def phrase_audio(self, phrase_number):
+        """The audio the server writes for a phrase - phrases get different lengths so a misplaced one also shifts everything after it"""
+        return np.full(1000 + phrase_number * 100, phrase_number / 100)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+def phrase_voiceline(phrases):
+    """A voiceline that xVASynth.Synthesizer splits into one phrase per number - each phrase is long enough that none get grouped together, and has no "and"/"or" for the splitter to move between phrases"""
+    return ", ".join(f"{i} " + "then the dragon flew over the mountain while the guards watched it from the high wall" for i in range(phrases))
+
+def fake_synthesizer(server, output_path, phrase_workers):
+    """An xVASynth Synthesizer connected to the fake server, without starting or loading anything in xVASynth"""
+    synthesizer = xvasynth.Synthesizer.__new__(xvasynth.Synthesizer)
+    synthesizer.config = SimpleNamespace(
+        linux_mode=True,
+        xvasynth_base_url=server.base_url,
+        xvasynth_phrase_workers=phrase_workers,
+        tts_http_connect_timeout=2,
+        tts_http_read_timeout=10,
+        tts_http_list_cache_ttl=0, # every voices() call asks the server again
+        tts_http_retries=0,
+        xvasynth_banned_voice_models=[],
+    )
+    synthesizer.http = HTTPClient("xvasynth", synthesizer.config, pool_size=max(4, phrase_workers))
+    synthesizer.synthesize_url = f"{server.base_url}/synthesize"
+    synthesizer.phrase_executor = concurrent.futures.ThreadPoolExecutor(max_workers=phrase_workers, thread_name_prefix="pantella_xvasynth")
+    synthesizer.output_path = output_path
+    synthesizer.model_type = "xVAPitch"
+    synthesizer.last_voice = "femalenord"
+    synthesizer.base_speaker_emb = ""
+    synthesizer.pace = 1.0
+    synthesizer.use_sr = False
+    synthesizer.use_cleanup = False
+    synthesizer.game = "skyrim"
+    synthesizer.xvasynth_path = output_path
+    synthesizer.voices_version = 0
+    synthesizer.available_voices_set = False
+    return synthesizer
+
+class TestXVASynthPhrases(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeXVASynthServer().start()
+        self.output_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.output_path, ignore_errors=True)
+
+    def synthesize(self, phrases, phrase_workers):
+        synthesizer = fake_synthesizer(self.server, self.output_path, phrase_workers)
+        voiceline_file = os.path.join(self.output_path, "voiceline.wav")
+        try:
+            synthesizer._synthesize(phrase_voiceline(phrases), "femalenord", voiceline_file, {"tts_language_code": "en"})
+        finally:
+            synthesizer.phrase_executor.shutdown()
+            synthesizer.http.close()
+        audio, samplerate = sf.read(voiceline_file)
+        return audio, samplerate
+
+    def expected_audio(self, phrases):
+        return np.concatenate([self.server.phrase_audio(i) for i in range(phrases)])
+
+    def test_phrases_merged_in_order_when_they_finish_out_of_order(self):
+        audio, samplerate = self.synthesize(8, phrase_workers=4)
+        self.assertEqual(samplerate, self.server.samplerate)
+        np.testing.assert_allclose(audio, self.expected_audio(8), atol=1e-3)
+        self.assertGreater(self.server.max_in_flight, 1) # the phrases really were synthesized at the same time
+
+    def test_phrases_merged_in_order_with_default_workers(self):
+        audio, _ = self.synthesize(5, phrase_workers=xvasynth.default_settings["xvasynth_phrase_workers"])
+        np.testing.assert_allclose(audio, self.expected_audio(5), atol=1e-3)
+        self.assertEqual(self.server.max_in_flight, 1)
+        sequences = [int(data["sequence"].split()[0]) for path, data in self.server.requests if path == "/synthesize"]
+        self.assertEqual(sequences, list(range(5)))
+
+    def test_single_phrase_written_directly(self):
+        audio, _ = self.synthesize(1, phrase_workers=4)
+        np.testing.assert_allclose(audio, self.expected_audio(1), atol=1e-3)
+
+class TestXVASynthVoices(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeXVASynthServer().start()
+        self.output_path = tempfile.mkdtemp()
+        self.synthesizer = fake_synthesizer(self.server, self.output_path, 1)
+
+    def tearDown(self):
+        self.synthesizer.phrase_executor.shutdown()
+        self.synthesizer.http.close()
+        self.server.stop()
+        shutil.rmtree(self.output_path, ignore_errors=True)
+
+    def request_paths(self):
+        return [path for path, data in self.server.requests]
+
+    def test_models_folder_only_set_once(self):
+        for _ in range(3):
+            self.assertEqual(self.synthesizer.voices(), ["femalenord", "malenord"])
+        self.assertEqual(self.request_paths(), ["/setAvailableVoices", "/getAvailableVoices", "/getAvailableVoices", "/getAvailableVoices"])
+
+    def test_failed_refresh_keeps_last_voice_list(self):
+        self.assertEqual(self.synthesizer.voices(), ["femalenord", "malenord"])
+        self.server.fail_voice_lists = True
+        self.assertEqual(self.synthesizer.voices(), ["femalenord", "malenord"])
+        self.assertEqual(self.synthesizer.voices_version, 1)
+
+    def test_unreachable_server_keeps_last_voice_list(self):
+        self.assertEqual(self.synthesizer.voices(), ["femalenord", "malenord"])
+        self.server.stop()
+        self.assertEqual(self.synthesizer.voices(), ["femalenord", "malenord"])
+        self.server = FakeXVASynthServer().start() # for tearDown
+
+    def test_no_voices_before_first_successful_fetch(self):
+        self.server.fail_voice_lists = True
+        self.assertEqual(self.synthesizer.voices(), [])
+
+if __name__ == '__main__':
+    unittest.main()
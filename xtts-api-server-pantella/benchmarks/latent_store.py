@@ -0,0 +1,78 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # run from the xtts-api-server-pantella folder: python benchmarks/latent_store.py
+import json
+import time
+import shutil
+import tempfile
+from argparse import ArgumentParser
+import torch
+from loguru import logger
+from xtts_api_server.latent_store import LatentStore
+
+BUNDLED_LATENTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "latent_speaker_folder", "en")
+
+def make_latent_folder(folder, speakers, languages):
+    """Fill a latent speaker folder with copies of the bundled latent JSON files, spread over several languages"""
+    sources = sorted(os.path.join(BUNDLED_LATENTS, file_name) for file_name in os.listdir(BUNDLED_LATENTS) if file_name.endswith('.json'))
+    for language_code in languages:
+        os.makedirs(os.path.join(folder, language_code), exist_ok=True)
+    json_bytes = 0
+    for i in range(speakers):
+        source = sources[i % len(sources)]
+        destination = os.path.join(folder, languages[i % len(languages)], f"speaker{i}.json")
+        shutil.copyfile(source, destination)
+        json_bytes += os.path.getsize(destination)
+    return json_bytes
+
+def load_all_latents_from_json(latent_speaker_folders, device):
+    """How TTSWrapper.load_all_latents() worked before the latent store - json.load every file and turn the lists into tensors"""
+    latents_cache = {}
+    for latent_speaker_folder in latent_speaker_folders:
+        for language_code in os.listdir(latent_speaker_folder):
+            language_path = os.path.join(latent_speaker_folder, language_code)
+            if os.path.isdir(language_path):
+                for file_name in os.listdir(language_path):
+                    if file_name.endswith('.json'):
+                        with open(os.path.join(language_path, file_name), 'r') as json_file:
+                            data = json.load(json_file)
+                        gpt_cond_latent = torch.tensor(data['gpt_cond_latent'], device=device)
+                        speaker_embedding = torch.tensor(data['speaker_embedding'], device=device)
+                        latents_cache[f"{file_name[:-5]}_{language_code}"] = (gpt_cond_latent, speaker_embedding)
+    return latents_cache
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare server startup with the latent store against loading every latent JSON file")
+    parser.add_argument("--speakers", type=int, default=600, help="Number of synthetic speakers")
+    parser.add_argument("--languages", nargs="+", default=["en", "de", "fr"], help="Language folders to spread the speakers over")
+    parser.add_argument("--device", default="cpu", help="Device the latents are loaded to")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING") # the store logs a line per sync
+
+    with tempfile.TemporaryDirectory() as temp_folder:
+        latent_folder = os.path.join(temp_folder, "latent_speaker_folder")
+        store_folder = os.path.join(temp_folder, "latent_store")
+        json_bytes = make_latent_folder(latent_folder, args.speakers, args.languages)
+
+        json_time, latents_cache = timed(load_all_latents_from_json, [latent_folder], args.device)
+        migrate_time, _ = timed(lambda: LatentStore(store_folder).sync([latent_folder]))
+        start_time, store = timed(lambda: LatentStore(store_folder))
+        sync_time, _ = timed(store.sync, [latent_folder])
+        get_time = 0.0
+        for speaker_key, (gpt_cond_latent, speaker_embedding) in latents_cache.items():
+            elapsed, (stored_gpt_cond_latent, stored_speaker_embedding) = timed(store.get, speaker_key, args.device)
+            get_time += elapsed
+            assert torch.equal(stored_gpt_cond_latent, gpt_cond_latent.float()) and torch.equal(stored_speaker_embedding, speaker_embedding.float()), f"latents for {speaker_key} differ from the JSON file"
+
+        print(f"{args.speakers} speakers in {len(args.languages)} languages, {round(json_bytes / 1048576, 1)} MB of latent JSON")
+        print(f"{'loading every latent JSON file':40} {json_time * 1000:10.1f} ms")
+        print(f"{'first start, migrating to the store':40} {migrate_time * 1000:10.1f} ms")
+        print(f"{'later starts':40} {(start_time + sync_time) * 1000:10.1f} ms")
+        print(f"{'first use of a speaker':40} {get_time / len(latents_cache) * 1000:10.3f} ms")
+        print(f"store is {round(os.path.getsize(store.data_path) / 1048576, 1)} MB plus a {round(os.path.getsize(store.index_path) / 1024, 1)} KB index, every speaker's latents match the JSON files")
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import unittest
+from xtts_api_server.inference_worker import InferenceWorker
+
+# Run from the xtts-api-server-pantella folder: python -m unittest test_inference_worker
+
+TIMEOUT = 5
+
+class StubModel:
+    """Stands in for TTSWrapper.process_tts_batch - records every batch it's given and answers each request with its text upper cased, or with the exception a request asks for"""
+    def __init__(self):
+        self.log = [] # batches (lists of request texts) and call() job names, in the order the worker ran them
+        self.lock = threading.Lock()
+
+    def run_batch(self, requests):
+        with self.lock:
+            self.log.append([request["text"] for request in requests])
+        return [request["error"] if "error" in request else request["text"].upper() for request in requests]
+
+    def job(self, name):
+        with self.lock:
+            self.log.append(name)
+        return name
+
+class TestInferenceWorker(unittest.TestCase):
+    def setUp(self):
+        self.model = StubModel()
+
+    def blocked_worker(self, **kwargs):
+        """A worker busy with a call() job until the returned event is set, so everything queued before that gets picked up together"""
+        worker = InferenceWorker(self.model.run_batch, **kwargs)
+        release = threading.Event()
+        worker.call(release.wait, TIMEOUT)
+        return worker, release
+
+    def test_queued_requests_run_as_one_batch(self):
+        worker, release = self.blocked_worker(max_batch_size=8)
+        futures = [worker.submit({"text": text}) for text in ["one", "two", "three"]]
+        release.set()
+        self.assertEqual([future.result(TIMEOUT) for future in futures], ["ONE", "TWO", "THREE"])
+        self.assertEqual(self.model.log, [["one", "two", "three"]])
+        for future in futures:
+            self.assertEqual(future.timings["batch_size"], 3)
+            self.assertGreaterEqual(future.timings["batch_time"], 0)
+        self.assertEqual(worker.stats()["average_batch_size"], 3)
+
+    def test_batches_split_at_max_batch_size(self):
+        worker, release = self.blocked_worker(max_batch_size=2)
+        futures = [worker.submit({"text": str(i)}) for i in range(5)]
+        release.set()
+        self.assertEqual([future.result(TIMEOUT) for future in futures], ["0", "1", "2", "3", "4"])
+        self.assertEqual(self.model.log, [["0", "1"], ["2", "3"], ["4"]])
+
+    def test_exception_only_fails_its_own_request(self):
+        worker, release = self.blocked_worker()
+        ok = worker.submit({"text": "fine"})
+        failed = worker.submit({"text": "broken", "error": ValueError("Speaker not found")})
+        also_ok = worker.submit({"text": "also fine"})
+        release.set()
+        self.assertEqual(ok.result(TIMEOUT), "FINE")
+        with self.assertRaisesRegex(ValueError, "Speaker not found"):
+            failed.result(TIMEOUT)
+        self.assertEqual(also_ok.result(TIMEOUT), "ALSO FINE")
+
+    def test_run_batch_raising_fails_the_whole_batch(self):
+        def run_batch(requests):
+            raise RuntimeError("CUDA out of memory")
+        worker = InferenceWorker(run_batch)
+        futures = [worker.submit({"text": "one"}), worker.submit({"text": "two"})]
+        for future in futures:
+            with self.assertRaisesRegex(RuntimeError, "CUDA out of memory"):
+                future.result(TIMEOUT)
+        self.assertEqual(worker.call(lambda: "still running").result(TIMEOUT), "still running")
+
+    def test_call_jobs_run_alone_in_queue_order(self):
+        worker, release = self.blocked_worker()
+        futures = [
+            worker.submit({"text": "a"}),
+            worker.submit({"text": "b"}),
+            worker.call(self.model.job, "switch model"),
+            worker.submit({"text": "c"}),
+            worker.call(self.model.job, "unload"),
+            worker.call(self.model.job, "reload"),
+            worker.submit({"text": "d"}),
+        ]
+        release.set()
+        self.assertEqual([future.result(TIMEOUT) for future in futures], ["A", "B", "switch model", "C", "unload", "reload", "D"])
+        self.assertEqual(self.model.log, [["a", "b"], "switch model", ["c"], "unload", "reload", ["d"]])
+
+    def test_call_exception_raised_from_its_future(self):
+        worker = InferenceWorker(self.model.run_batch)
+        def fail():
+            raise OSError("model folder missing")
+        with self.assertRaisesRegex(OSError, "model folder missing"):
+            worker.call(fail).result(TIMEOUT)
+        self.assertEqual(worker.submit({"text": "after"}).result(TIMEOUT), "AFTER")
+
+    def test_run_returns_result_and_timings(self):
+        worker = InferenceWorker(self.model.run_batch)
+        result, timings = asyncio.run(asyncio.wait_for(worker.run({"text": "hello"}), TIMEOUT))
+        self.assertEqual(result, "HELLO")
+        self.assertEqual(timings["batch_size"], 1)
+        self.assertLessEqual(timings["queued"], timings["started"])
+        self.assertLessEqual(timings["started"], timings["finished"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,6 +18,9 @@ parser.add_argument("--listen", action='store_true', help="Allows the server to
 parser.add_argument("--lowvram", action='store_true', help="Enable low vram mode which switches the model to RAM when not actively processing.")
 parser.add_argument("--deepspeed", action='store_true', help="Enables deepspeed mode, speeds up processing by several times.")
 parser.add_argument("--use-cache", action='store_true', help="Enables caching of results, your results will be saved and if there will be a repeated request, you will get a file instead of generation.")
+parser.add_argument("--cache-max-size-mb", default=1024, type=int, help="How big the cached results can get in MB before the least recently used ones are deleted, only used with --use-cache.")
+parser.add_argument("--max-batch-size", default=8, type=int, help="How many queued requests the inference worker takes at once.")
+parser.add_argument("--batch-window-ms", default=0, type=float, help="How long the inference worker waits for more requests to arrive before running a batch, 0 only batches requests that are already queued.")
 parser.add_argument("--streaming-mode", action='store_true', help="Enables streaming mode, currently needs a lot of work.")
 parser.add_argument("--streaming-mode-improve", action='store_true', help="Includes an improved streaming mode that consumes 2gb more VRAM and uses a better tokenizer, good for languages such as Chinese")
 parser.add_argument("--stream-play-sync", action='store_true', help="Additional flag for streaming mod that allows you to play all audio one at a time without interruption")
@@ -39,6 +42,9 @@ os.environ['TUNNEL_URL'] = args.tunnel  # it is necessary to correctly return co
 os.environ['MODEL_SOURCE'] = args.model_source  # Set environment variable for the model source
 os.environ["MODEL_VERSION"] = args.version # Specify version of XTTS model
 os.environ["USE_CACHE"] = str(args.use_cache).lower() # Enable caching results
+os.environ["CACHE_MAX_SIZE_MB"] = str(args.cache_max_size_mb) # Size limit of the cached results
+os.environ["MAX_BATCH_SIZE"] = str(args.max_batch_size) # Requests per batch on the inference worker
+os.environ["BATCH_WINDOW_MS"] = str(args.batch_window_ms) # Time to wait for a batch to fill up
 os.environ["DEEPSPEED"] = str(args.deepspeed).lower() # Enable deepspeed
 os.environ["LOWVRAM_MODE"] = str(args.lowvram).lower() # Set lowvram mode
 os.environ["STREAM_MODE"] = str(args.streaming_mode).lower() # Enable Streaming mode
@@ -0,0 +1,128 @@
+import time
+import asyncio
+import threading
+import concurrent.futures
+from collections import deque
+from loguru import logger
+
+class InferenceJob:
+    def __init__(self, request=None, fn=None, args=(), kwargs=None):
+        self.request = request # keyword arguments for the batch function, or None for a job that runs fn on its own
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.future = concurrent.futures.Future()
+        self.timings = {"queued": time.time()}
+
+class InferenceWorker:
+    """Runs everything that uses the model on one dedicated thread, so a synthesis never blocks the event loop and two requests never use the model at the same time.
+
+    Requests that queue up while a batch is running are taken together as the next batch (up to max_batch_size, optionally waiting batch_window seconds for more to arrive) and handed to run_batch, which returns a result or exception for each of them. Jobs submitted with call() run on their own, in queue order, for anything else that touches the model like switching models."""
+    def __init__(self, run_batch, max_batch_size=8, batch_window=0.0, history_size=100):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.batch_window = batch_window
+        self.jobs = deque()
+        self.condition = threading.Condition()
+        self.history = deque(maxlen=history_size) # timings of the most recently finished requests
+        self.running = 0 # requests in the batch being run right now
+        self.thread = threading.Thread(target=self._loop, daemon=True, name="xtts_inference")
+        self.thread.start()
+
+    @property
+    def queue_depth(self):
+        with self.condition:
+            return len(self.jobs)
+
+    def submit(self, request):
+        """Queue a request for run_batch - returns a future for its result, with the request's timings in future.timings once it's done"""
+        return self._queue(InferenceJob(request=request))
+
+    def call(self, fn, *args, **kwargs):
+        """Queue fn to run on the worker thread on its own - returns a future for its result"""
+        return self._queue(InferenceJob(fn=fn, args=args, kwargs=kwargs))
+
+    async def run(self, request):
+        """Submit a request and wait for it without blocking the event loop - returns its result and timings"""
+        future = self.submit(request)
+        result = await asyncio.wrap_future(future)
+        return result, future.timings
+
+    def _queue(self, job):
+        job.future.timings = job.timings
+        with self.condition:
+            self.jobs.append(job)
+            self.condition.notify()
+        return job.future
+
+    def _next_batch(self):
+        with self.condition:
+            while len(self.jobs) == 0:
+                self.condition.wait()
+            batch = [self.jobs.popleft()]
+            if batch[0].request is None:
+                return batch
+            deadline = time.time() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                if len(self.jobs) == 0:
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or not self.condition.wait(remaining) or len(self.jobs) == 0:
+                        break
+                if self.jobs[0].request is None: # jobs that run on their own end the batch, so everything still runs in the order it was queued
+                    break
+                batch.append(self.jobs.popleft())
+            self.running = len(batch)
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            started = time.time()
+            for job in batch:
+                job.timings["started"] = started
+                job.timings["batch_size"] = len(batch)
+            if batch[0].request is None:
+                job = batch[0]
+                try:
+                    result = job.fn(*job.args, **job.kwargs)
+                except BaseException as e:
+                    job.future.set_exception(e)
+                else:
+                    job.future.set_result(result)
+                continue
+            try:
+                results = self.run_batch([job.request for job in batch])
+            except BaseException as e:
+                results = [e] * len(batch)
+            finished = time.time()
+            with self.condition:
+                self.running = 0
+            for job, result in zip(batch, results):
+                job.timings["finished"] = finished
+                job.timings["queue_wait"] = started - job.timings["queued"]
+                job.timings["batch_time"] = finished - started # the whole batch, requests in a batch finish together
+                self.history.append(dict(job.timings))
+                if isinstance(result, BaseException):
+                    job.future.set_exception(result)
+                else:
+                    job.future.set_result(result)
+            logger.info(f"Ran a batch of {len(batch)} requests in {finished - started:.2f} seconds, {self.queue_depth} requests waiting.")
+
+    def stats(self):
+        """Queue depth and the timings of recently finished requests"""
+        with self.condition:
+            queue_depth = len(self.jobs)
+            running = self.running
+        history = list(self.history)
+        stats = {
+            "queue_depth": queue_depth,
+            "running": running,
+            "max_batch_size": self.max_batch_size,
+            "batch_window": self.batch_window,
+            "recent_requests": history,
+        }
+        if len(history) > 0:
+            stats["average_queue_wait"] = sum(timings["queue_wait"] for timings in history) / len(history)
+            stats["average_batch_time"] = sum(timings["batch_time"] for timings in history) / len(history)
+            stats["average_batch_size"] = sum(timings["batch_size"] for timings in history) / len(history)
+        return stats
@@ -0,0 +1,135 @@
+import os
+import json
+import threading
+import numpy as np
+import torch
+from loguru import logger
+
+class LatentStore:
+    """Speaker latents kept in one binary file of float32 values, memory-mapped and read on first use, with a small JSON index of where each speaker's latents are.
+
+    The latent JSON files in the latent speaker folders are still the source of truth, sync() imports any that are new or have changed since they were last imported, so existing latents are migrated automatically and JSON files can still be added or edited by hand. Parsing hundreds of JSON files of floats at every startup is what this replaces."""
+    def __init__(self, folder):
+        self.folder = folder
+        self.data_path = os.path.join(folder, "latent_store.bin")
+        self.index_path = os.path.join(folder, "latent_store.json")
+        self.index = {} # speaker key -> {"offset", "gpt_cond_latent_shape", "speaker_embedding_shape", "source", "mtime_ns", "size"}
+        self.lock = threading.RLock()
+        self._data = None # memory map of the data file, reopened whenever the file grows
+        os.makedirs(folder, exist_ok=True)
+        if os.path.exists(self.index_path) and os.path.exists(self.data_path):
+            try:
+                with open(self.index_path, 'r') as index_file:
+                    self.index = json.load(index_file)
+            except Exception as e:
+                logger.error(f"Could not read the latent store index, rebuilding it from the latent JSON files: {e}")
+                self.index = {}
+        if len(self.index) == 0 and os.path.exists(self.data_path):
+            os.remove(self.data_path)
+
+    def __contains__(self, speaker_key):
+        return speaker_key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def sync(self, latent_speaker_folders):
+        """Import every latent JSON file that isn't in the store or changed since it was imported, and drop speakers whose JSON file is gone - later folders win when the same speaker is in several, like they did when every JSON file was loaded at startup"""
+        with self.lock:
+            sources = {}
+            for latent_speaker_folder in latent_speaker_folders:
+                if not os.path.isdir(latent_speaker_folder):
+                    continue
+                for language_code in os.listdir(latent_speaker_folder):
+                    language_path = os.path.join(latent_speaker_folder, language_code)
+                    if os.path.isdir(language_path):
+                        for file_name in os.listdir(language_path):
+                            if file_name.endswith('.json'):
+                                sources[f"{file_name[:-5]}_{language_code}"] = os.path.join(language_path, file_name)
+            imported = 0
+            for speaker_key, file_path in sources.items():
+                stat = os.stat(file_path)
+                entry = self.index.get(speaker_key)
+                if entry is not None and entry["source"] == os.path.abspath(file_path) and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                    continue
+                try:
+                    with open(file_path, 'r') as json_file:
+                        data = json.load(json_file)
+                    self._append(speaker_key, np.asarray(data['gpt_cond_latent'], dtype=np.float32), np.asarray(data['speaker_embedding'], dtype=np.float32), file_path, stat)
+                    imported += 1
+                except Exception as e:
+                    logger.error(f"Could not import latents from {file_path}: {e}")
+            removed = [speaker_key for speaker_key in self.index if speaker_key not in sources]
+            for speaker_key in removed:
+                del self.index[speaker_key]
+            if imported > 0 or len(removed) > 0:
+                self._compact_if_needed()
+                self._save_index()
+            logger.info(f"Latent store has {len(self.index)} speakers, imported {imported} from latent JSON files and removed {len(removed)}.")
+
+    def get(self, speaker_key, device):
+        """Get a speaker's (gpt_cond_latent, speaker_embedding) tensors on device, or None if the speaker isn't in the store"""
+        with self.lock:
+            entry = self.index.get(speaker_key)
+            if entry is None:
+                return None
+            data = self._memmap()
+            offset = entry["offset"]
+            tensors = []
+            for shape_name in ("gpt_cond_latent_shape", "speaker_embedding_shape"):
+                count = int(np.prod(entry[shape_name]))
+                tensors.append(torch.from_numpy(np.array(data[offset:offset + count]).reshape(entry[shape_name])).to(device))
+                offset += count
+        return tensors[0], tensors[1]
+
+    def put(self, speaker_key, gpt_cond_latent, speaker_embedding, source):
+        """Add latents that were just saved to the JSON file source"""
+        with self.lock:
+            self._append(speaker_key, gpt_cond_latent.detach().cpu().float().numpy(), speaker_embedding.detach().cpu().float().numpy(), source, os.stat(source))
+            self._save_index()
+
+    def _append(self, speaker_key, gpt_cond_latent, speaker_embedding, source, stat):
+        offset = os.path.getsize(self.data_path) // 4 if os.path.exists(self.data_path) else 0
+        with open(self.data_path, 'ab') as data_file:
+            data_file.write(np.ascontiguousarray(gpt_cond_latent, dtype=np.float32).tobytes())
+            data_file.write(np.ascontiguousarray(speaker_embedding, dtype=np.float32).tobytes())
+        self._data = None
+        self.index[speaker_key] = {
+            "offset": offset,
+            "gpt_cond_latent_shape": list(gpt_cond_latent.shape),
+            "speaker_embedding_shape": list(speaker_embedding.shape),
+            "source": os.path.abspath(source),
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+        }
+
+    def _memmap(self):
+        if self._data is None:
+            self._data = np.memmap(self.data_path, dtype=np.float32, mode='r')
+        return self._data
+
+    def _compact_if_needed(self):
+        """Rewrite the data file without the latents of replaced or removed speakers once they take up more than half of it"""
+        if not os.path.exists(self.data_path):
+            return
+        live_count = sum(int(np.prod(entry["gpt_cond_latent_shape"])) + int(np.prod(entry["speaker_embedding_shape"])) for entry in self.index.values())
+        if live_count * 2 >= os.path.getsize(self.data_path) // 4:
+            return
+        data = self._memmap()
+        temp_path = self.data_path + ".tmp"
+        offset = 0
+        with open(temp_path, 'wb') as data_file:
+            for entry in self.index.values():
+                count = int(np.prod(entry["gpt_cond_latent_shape"])) + int(np.prod(entry["speaker_embedding_shape"]))
+                data_file.write(np.array(data[entry["offset"]:entry["offset"] + count]).tobytes())
+                entry["offset"] = offset
+                offset += count
+        self._data = None
+        del data
+        os.replace(temp_path, self.data_path)
+
+    def _save_index(self):
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, 'w') as index_file:
+            json.dump(self.index, index_file)
+        os.replace(temp_path, self.index_path) # written in one step so the index never points past the end of the data file
@@ -0,0 +1,84 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from loguru import logger
+
+class ResultCache:
+    """Generated audio files indexed by a hash of everything that affects how they sound.
+
+    The index is a dict in memory, so a lookup is one hash and one dict access no matter how many results are cached. It's backed by a SQLite database in the output folder so the cache survives restarts, and when the cached files grow past max_size_bytes the least recently used ones are deleted."""
+    def __init__(self, output_folder, max_size_bytes):
+        self.output_folder = output_folder
+        self.max_size_bytes = max_size_bytes
+        self.index = {} # key -> [file name, size in bytes, last used time]
+        self.total_size = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(output_folder, "cache.sqlite3"), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, file_name TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        missing = []
+        for key, file_name, size, last_used in self.db.execute("SELECT key, file_name, size, last_used FROM results"):
+            if os.path.exists(file_name):
+                self.index[key] = [file_name, size, last_used]
+                self.total_size += size
+            else:
+                missing.append((key,))
+        self.db.executemany("DELETE FROM results WHERE key = ?", missing)
+        self.db.commit()
+        logger.info(f"Result cache holds {len(self.index)} results ({round(self.total_size / 1048576, 2)} MB of {round(self.max_size_bytes / 1048576, 2)} MB)")
+
+    def key(self, text_params):
+        """Hash the parameters a result was generated with"""
+        return hashlib.sha256(json.dumps(text_params, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Get the file cached for key, or None"""
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            if not os.path.exists(entry[0]): # deleted from the output folder by something else
+                self._remove(key)
+                self.db.commit()
+                return None
+            entry[2] = time.time()
+            self.db.execute("UPDATE results SET last_used = ? WHERE key = ?", (entry[2], key))
+            self.db.commit()
+            return entry[0]
+
+    def put(self, key, file_name):
+        """Add a generated file to the cache and evict the least recently used files if the cache is over its size limit"""
+        try:
+            size = os.path.getsize(file_name)
+        except OSError as e:
+            logger.error(f"Could not add {file_name} to the result cache: {e}")
+            return
+        with self.lock:
+            old_entry = self.index.get(key)
+            if old_entry is not None:
+                self.total_size -= old_entry[1]
+            self.index[key] = [file_name, size, time.time()]
+            self.total_size += size
+            self.db.execute("INSERT OR REPLACE INTO results (key, file_name, size, last_used) VALUES (?, ?, ?, ?)", (key, file_name, size, self.index[key][2]))
+            evicted = 0
+            if self.total_size > self.max_size_bytes:
+                for old_key, entry in sorted(self.index.items(), key=lambda item: item[1][2]):
+                    if self.total_size <= self.max_size_bytes or old_key == key: # never evict the result that was just added
+                        break
+                    self._remove(old_key, delete_file=True)
+                    evicted += 1
+            self.db.commit()
+        if evicted:
+            logger.info(f"Evicted {evicted} results from the result cache")
+
+    def _remove(self, key, delete_file=False):
+        entry = self.index.pop(key)
+        self.total_size -= entry[1]
+        self.db.execute("DELETE FROM results WHERE key = ?", (key,))
+        if delete_file:
+            try:
+                os.remove(entry[0])
+            except OSError:
+                pass
@@ -9,6 +9,8 @@ from typing import Optional
 
 import os
 import time
+import asyncio
+import threading
 from pathlib import Path
 import shutil
 from loguru import logger
@@ -17,6 +19,7 @@ from pathlib import Path
 from uuid import uuid4
 
 from xtts_api_server.tts_funcs import TTSWrapper,supported_languages,InvalidSettingsError
+from xtts_api_server.inference_worker import InferenceWorker
 from xtts_api_server.RealtimeTTS import TextToAudioStream, CoquiEngine
 from xtts_api_server.modeldownloader import check_stream2sentence_version,install_deepspeed_based_on_python_version
 
@@ -35,6 +38,9 @@ MODEL_VERSION = os.getenv("MODEL_VERSION","v2.0.2")
 LOWVRAM_MODE = os.getenv("LOWVRAM_MODE") == 'true'
 DEEPSPEED = os.getenv("DEEPSPEED") == 'true'
 USE_CACHE = os.getenv("USE_CACHE") == 'true'
+CACHE_MAX_SIZE_MB = int(os.getenv("CACHE_MAX_SIZE_MB", "1024"))
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "8"))
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "0"))
 
 # STREAMING VARS
 STREAM_MODE = os.getenv("STREAM_MODE") == 'true'
@@ -46,7 +52,7 @@ if(DEEPSPEED):
 
 # Create an instance of the TTSWrapper class and server
 app = FastAPI()
-XTTS = TTSWrapper(OUTPUT_FOLDER,SPEAKER_FOLDER,LATENT_SPEAKER_FOLDER,MODEL_FOLDER,LOWVRAM_MODE,MODEL_SOURCE,MODEL_VERSION,DEVICE,DEEPSPEED,USE_CACHE)
+XTTS = TTSWrapper(OUTPUT_FOLDER,SPEAKER_FOLDER,LATENT_SPEAKER_FOLDER,MODEL_FOLDER,LOWVRAM_MODE,MODEL_SOURCE,MODEL_VERSION,DEVICE,DEEPSPEED,USE_CACHE,CACHE_MAX_SIZE_MB)
 
 # Check for old format model version
 XTTS.model_version = XTTS.check_model_version_old_format(MODEL_VERSION)
@@ -77,6 +83,9 @@ else:
   logger.info(f"Model: '{version_string}' starts to load,wait until it loads")
   XTTS.load_model() 
 
+# Everything that uses the model runs on this worker, off the event loop
+INFERENCE = InferenceWorker(XTTS.process_tts_batch, max_batch_size=MAX_BATCH_SIZE, batch_window=BATCH_WINDOW_MS / 1000)
+
 if USE_CACHE:
     logger.info("You have enabled caching, this option enables caching of results, your results will be saved and if there is a repeat request, you will get a file instead of generation")
 
@@ -115,6 +124,14 @@ def play_stream(stream,language):
     else:
       stream.play_async()
 
+def timing_headers(timings):
+  # How long a request waited for the inference worker and how long its batch took, in milliseconds
+  return {
+    "X-Queue-Wait-Ms": str(round(timings["queue_wait"] * 1000)),
+    "X-Batch-Time-Ms": str(round(timings["batch_time"] * 1000)),
+    "X-Batch-Size": str(timings["batch_size"]),
+  }
+
 class OutputFolderRequest(BaseModel):
     output_folder: str
 
@@ -180,6 +197,10 @@ def get_folders():
 def get_models_list():
     return XTTS.get_models_list()
 
+@app.get("/inference_stats")
+def get_inference_stats():
+    return INFERENCE.stats()
+
 @app.get("/get_tts_settings")
 def get_tts_settings():
     settings = {**XTTS.tts_settings,"stream_chunk_size":XTTS.stream_chunk_size}
@@ -219,7 +240,7 @@ def set_speaker_folder(speaker_req: SpeakerFolderRequest):
 @app.post("/switch_model")
 def switch_model(modelReq: ModelNameRequest):
     try:
-        XTTS.switch_model(modelReq.model_name)
+        INFERENCE.call(XTTS.switch_model, modelReq.model_name).result() # waits for the requests queued before it
         return {"message": f"Model switched to {modelReq.model_name}"}
     except InvalidSettingsError as e:  
         logger.error(e)
@@ -228,7 +249,7 @@ def switch_model(modelReq: ModelNameRequest):
 @app.post("/set_tts_settings")
 def set_tts_settings_endpoint(tts_settings_req: TTSSettingsRequest):
     try:
-        XTTS.set_tts_settings(**tts_settings_req.dict())
+        INFERENCE.call(XTTS.set_tts_settings, **tts_settings_req.dict()).result()
         return {"message": "Settings successfully applied"}
     except InvalidSettingsError as e: 
         logger.error(e)
@@ -246,20 +267,51 @@ async def tts_stream(request: TTSStreamRequest):
                             detail="Language code sent is either unsupported or misspelled.")
             
     async def generator():
-        chunks = XTTS.process_tts_to_file(
-            text=request.text,
-            speaker_name_or_path=request.speaker_wav,
-            language=request.language.lower(),
-            stream=True,
-        )
-        # Write file header to the output stream.
-        yield XTTS.get_wav_header()
-        async for chunk in chunks:
-            # Check if the client is still connected.
-            disconnected = await request.is_disconnected()
-            if disconnected:
-                break
-            yield chunk
+        loop = asyncio.get_running_loop()
+        chunk_queue = asyncio.Queue()
+        cancelled = threading.Event() # set once nobody is reading the stream, so the inference thread stops generating it
+
+        def produce():
+            # Runs on the inference worker, so streaming never uses the model at the same time as a batch
+            async def consume():
+                chunks = XTTS.process_tts_to_file(
+                    text=request.text,
+                    speaker_name_or_path=request.speaker_wav,
+                    language=request.language.lower(),
+                    stream=True,
+                )
+                try:
+                    async for chunk in chunks:
+                        if cancelled.is_set():
+                            logger.info("Client disconnected, stopping the stream.")
+                            break
+                        loop.call_soon_threadsafe(chunk_queue.put_nowait, chunk)
+                finally:
+                    await chunks.aclose() # stop inference_stream here rather than in asyncio.run's cleanup
+            if cancelled.is_set(): # the client left while the stream was still queued
+                return
+            try:
+                asyncio.run(consume())
+            finally:
+                loop.call_soon_threadsafe(chunk_queue.put_nowait, None)
+
+        job = INFERENCE.call(produce)
+        try:
+            # Write file header to the output stream.
+            yield XTTS.get_wav_header()
+            while True:
+                chunk = await chunk_queue.get()
+                if chunk is None:
+                    break
+                # Check if the client is still connected.
+                disconnected = await request.is_disconnected()
+                if disconnected:
+                    break
+                yield chunk
+            if job.done():
+                job.result() # raise anything that went wrong while streaming
+        finally:
+            cancelled.set()
 
     return StreamingResponse(generator(), media_type='audio/x-wav')
 
@@ -308,14 +360,15 @@ async def tts_to_audio(request: SynthesisRequest, background_tasks: BackgroundTa
                 raise HTTPException(status_code=400,
                                     detail="Language code sent is either unsupported or misspelled.")
 
-            # Generate an audio file using process_tts_to_file.
-            output_file_path = XTTS.process_tts_to_file(
+            # Generate an audio file using process_tts_to_file, on the inference worker.
+            # Unless the client picked a file, every request gets its own, so a response is never overwritten or deleted by another request batched with it
+            output_file_path, timings = await INFERENCE.run(dict(
                 text=request.text,
                 speaker_name_or_path=request.speaker_wav,
                 language=request.language.lower(),
                 accent=request.accent,
-                file_name_or_path=request.save_path
-            )
+                file_name_or_path=request.save_path if request.save_path else f"{uuid4().hex}_out.wav"
+            ))
             
             if not XTTS.enable_cache_results:
                 background_tasks.add_task(os.unlink, output_file_path)
@@ -325,6 +378,7 @@ async def tts_to_audio(request: SynthesisRequest, background_tasks: BackgroundTa
                 path=output_file_path,
                 media_type='audio/wav',
                 filename="output.wav",
+                headers=timing_headers(timings),
                 )
 
         except Exception as e:
@@ -344,14 +398,14 @@ async def tts_to_file(request: SynthesisFileRequest):
              raise HTTPException(status_code=400,
                                  detail="Language code sent is either unsupported or misspelled.")
 
-        # Now use process_tts_to_file for saving the file.
-        output_file = XTTS.process_tts_to_file(
+        # Now use process_tts_to_file for saving the file, on the inference worker.
+        output_file, timings = await INFERENCE.run(dict(
             text=request.text,
             speaker_name_or_path=request.speaker_wav,
             language=request.language.lower(),
             file_name_or_path=request.file_name_or_path  # The user-provided path to save the file is used here.
-        )
-        return {"message": "The audio was successfully made and stored.", "output_path": output_file}
+        ))
+        return {"message": "The audio was successfully made and stored.", "output_path": output_file, "timings": timings}
 
     except Exception as e:
         logger.error(e)
@@ -9,14 +9,16 @@ from TTS.tts.models.xtts import Xtts
 from pathlib import Path
 
 from xtts_api_server.modeldownloader import download_model # ,check_tts_version
+from xtts_api_server.result_cache import ResultCache
+from xtts_api_server.latent_store import LatentStore
 
 from loguru import logger
-from datetime import datetime
 import os
 import time 
 import re
 import json
 import socket
+from uuid import uuid4
 import io
 import wave
 import numpy as np
@@ -62,7 +64,7 @@ official_model_list_v2 = ["2.0.0","2.0.1","2.0.2","2.0.3"]
 reversed_supported_languages = {name: code for code, name in supported_languages.items()}
 
 class TTSWrapper:
-    def __init__(self,output_folder = "./output", speaker_folder="./speakers",latent_speaker_folders = "./latent_speakers",model_folder="./xtts_folder",lowvram = False,model_source = "local",model_version = "2.0.2",device = "cuda",deepspeed = False,enable_cache_results = True):
+    def __init__(self,output_folder = "./output", speaker_folder="./speakers",latent_speaker_folders = "./latent_speakers",model_folder="./xtts_folder",lowvram = False,model_source = "local",model_version = "2.0.2",device = "cuda",deepspeed = False,enable_cache_results = True,cache_max_size_mb = 1024):
         self.cuda = device # If the user has chosen what to use, we rewrite the value to the value we want to use
         self.device = 'cpu' if lowvram else (self.cuda if torch.cuda.is_available() else "cpu")
         self.lowvram = lowvram  # Store whether we want to run in low VRAM mode.
@@ -92,17 +94,15 @@ class TTSWrapper:
         self.create_directories()
         # check_tts_version()
 
+        # Latents of every speaker with a latent JSON file, in one memory-mapped file kept next to the first latent speaker folder's JSON files
+        self.latent_store = LatentStore(self.latent_speaker_folders[0])
+
         self.enable_cache_results = enable_cache_results
-        self.cache_file_path = os.path.join(output_folder, "cache.json")
+        self.result_cache = ResultCache(output_folder, cache_max_size_mb * 1048576) if enable_cache_results else None
 
         self.is_official_model = True
         
         self.current_model = None
-        
-        if self.enable_cache_results:
-            # Reset the contents of the cache file at each initialization.
-            with open(self.cache_file_path, 'w') as cache_file:
-                json.dump({}, cache_file)
     # HELP FUNC
     def isModelOfficial(self,model_version):
         if model_version in official_model_list:
@@ -137,42 +137,13 @@ class TTSWrapper:
     def check_cache(self, text_params):
         if not self.enable_cache_results:
             return None
-
-        try:
-            with open(self.cache_file_path) as cache_file:
-                cache_data = json.load(cache_file)
-
-            for entry in cache_data.values():
-                if all(entry[key] == value for key, value in text_params.items()):
-                    return entry['file_name']
-
-            return None
-
-        except FileNotFoundError:
-            return None
+        return self.result_cache.get(self.result_cache.key(text_params))
 
     def update_cache(self, text_params, file_name):
         if not self.enable_cache_results:
             return None
-        try:
-            # Check if the file exists and its contents before downloading.
-            if os.path.exists(self.cache_file_path) and os.path.getsize(self.cache_file_path) > 0:
-                with open(self.cache_file_path, 'r') as cache_file:
-                    cache_data = json.load(cache_file)
-            else:
-                cache_data = {}  # Initialization of an empty dictionary if the file does not exist or is empty.
-
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            cache_data[timestamp] = {**text_params, 'file_name': file_name}
-
-            with open(self.cache_file_path, 'w') as cache_file:
-                json.dump(cache_data, cache_file)
-
-            logger.info("Cache updated successfully.")
-        except IOError as e:
-            print("I/O error occurred while updating the cache: ", str(e))
-        except json.JSONDecodeError as e:
-            print("JSON decode error occurred while updating the cache: ", str(e))
+        self.result_cache.put(self.result_cache.key(text_params), file_name)
+        logger.info("Cache updated successfully.")
             
     # LOAD FUNCS
     def load_model(self,load=True):
@@ -268,6 +239,9 @@ class TTSWrapper:
     def get_or_create_latents(self, speaker_name, speaker_wav, language_code):
         speaker_name = speaker_name.lower()
         speaker_key = f"{speaker_name}_{language_code}"
+        if speaker_key not in self.latents_cache and speaker_key in self.latent_store:
+            # Read from the latent store the first time the speaker is used
+            self.latents_cache[speaker_key] = self.latent_store.get(speaker_key, self.device)
         if speaker_key not in self.latents_cache:
             logger.info(f"Creating latents for {speaker_name} in {language_code}: {speaker_wav}")
             gpt_cond_latent, speaker_embedding = self.model.get_conditioning_latents(speaker_wav)
@@ -297,14 +271,8 @@ class TTSWrapper:
                     existing_latents_count = 0
 
                     for speaker in speakers_list:
-                        # Check if the latent JSON already exists
-                        latent_exists = False
-                        for latent_folder in self.latent_speaker_folders:
-                            latent_json_path = os.path.join(latent_folder, language_code, f"{speaker['speaker_name']}.json")
-                            if os.path.exists(latent_json_path):
-                                latent_exists = True
-                                break
-                        if latent_exists:
+                        # Check if the latent JSON already exists, every one of them is in the latent store
+                        if f"{speaker['speaker_name']}_{language_code}" in self.latent_store:
                             # Increment existing latents counter if the file exists
                             existing_latents_count += 1
                         else:
@@ -346,6 +314,7 @@ class TTSWrapper:
             }
             with open(file_path, 'w') as json_file:
                 json.dump(data_to_save, json_file)
+            self.latent_store.put(speaker_key, self.latents_cache[speaker_key][0], self.latents_cache[speaker_key][1], file_path)
             logger.info(f"Latents for {speaker_name} in {language_code} saved to {file_path}")
         else:
             logger.error(f"Latents for {speaker_key} not found in cache.")
@@ -359,33 +328,8 @@ class TTSWrapper:
         return gpt_cond_latent, speaker_embedding
     
     def load_all_latents(self):
-        # Total count for logging purposes
-        total_latents_loaded = 0
-
-        # Iterate over all language subdirectories in the latent speaker folder
-        for latent_speaker_folder in self.latent_speaker_folders:
-            for language_code in os.listdir(latent_speaker_folder):
-                language_path = os.path.join(latent_speaker_folder, language_code)
-                if os.path.isdir(language_path):
-                    # Initialize counter for the current language
-                    current_language_latents_count = 0
-
-                    # Load all json files within this language subfolder
-                    for file_name in os.listdir(language_path):
-                        if file_name.endswith('.json'):
-                            speaker_name = file_name[:-5]  # Remove '.json' to get the speaker name
-                            speaker_key = f"{speaker_name}_{language_code}"
-                            file_path = os.path.join(language_path, file_name)
-                            gpt_cond_latent, speaker_embedding = self.load_latents_from_json(file_path)
-                            self.latents_cache[speaker_key] = (gpt_cond_latent, speaker_embedding)
-                            current_language_latents_count += 1
-
-                    # Log the count of loaded latents for the current language
-                    logger.info(f"Loaded latents for {current_language_latents_count} speakers in '{language_code}' subfolder.")
-                    total_latents_loaded += current_language_latents_count
-
-        # Optionally, log the total count of latents loaded across all languages
-        logger.info(f"Total latents loaded across all languages: {total_latents_loaded}")
+        # Bring the latent store up to date with the latent JSON files, the latents themselves are only read when a speaker is first used
+        self.latent_store.sync(self.latent_speaker_folders)
 
     # DIRICTORIES FUNCS
     def create_directories(self):
@@ -699,6 +643,35 @@ class TTSWrapper:
                 file_path=output_file,
         )
 
+    def speaker_fingerprint(self, speaker_name_or_path, language_code):
+        """Where a speaker's voice comes from and when it last changed, so cached results stop being used when a speaker's latents or wavs are replaced"""
+        speaker_key = f"{speaker_name_or_path.lower()}_{language_code}"
+        entry = self.latent_store.index.get(speaker_key)
+        if entry is not None:
+            try:
+                stat = os.stat(entry["source"])
+            except OSError:
+                stat = None
+            if stat is None or stat.st_mtime_ns != entry["mtime_ns"] or stat.st_size != entry["size"]:
+                # The latent JSON was edited or removed since it was imported, so the latents in memory are stale too
+                self.latent_store.sync(self.latent_speaker_folders)
+                self.latents_cache.pop(speaker_key, None)
+                entry = self.latent_store.index.get(speaker_key)
+            if entry is not None:
+                return [entry["source"], entry["mtime_ns"], entry["size"]]
+        # No latents yet, they'll be made from the speaker's wavs
+        fingerprint = []
+        for speaker_folder in self.speaker_folder:
+            speaker_path = os.path.join(speaker_folder, language_code, speaker_name_or_path)
+            wav_files = [speaker_path + ".wav"]
+            if os.path.isdir(speaker_path):
+                wav_files += sorted(os.path.join(speaker_path, f) for f in os.listdir(speaker_path) if f.endswith('.wav'))
+            for wav_file in wav_files:
+                if os.path.isfile(wav_file):
+                    stat = os.stat(wav_file)
+                    fingerprint.append([wav_file, stat.st_mtime_ns, stat.st_size])
+        return fingerprint
+
     def get_speaker_wav(self, speaker_name_or_path, language_code):
         """Gets the speaker_wav(s) for a given speaker name considering the language."""
         for speaker_folder in self.speaker_folder:
@@ -719,7 +692,30 @@ class TTSWrapper:
         return speaker_wav
 
     # MAIN FUNC
-    def process_tts_to_file(self, text, speaker_name_or_path, language, accent=None, file_name_or_path="out.wav", stream=False):
+    def process_tts_batch(self, requests):
+        """Run several process_tts_to_file requests back to back, returns the output file or the exception for each of them.
+
+        In low VRAM mode the model is moved to the GPU and back once for the whole batch instead of once per request."""
+        results = []
+        used_paths = set()
+        self.switch_model_device() # Load to CUDA if lowram ON
+        try:
+            for request in requests:
+                file_name_or_path = request.get("file_name_or_path") or "out.wav"
+                if file_name_or_path in used_paths: # an earlier request in this batch writes there, and its response isn't sent until the whole batch is done
+                    unique_file_name = f"{uuid4().hex}_{os.path.basename(file_name_or_path)}"
+                    logger.warning(f"Two requests in the same batch want to write to {file_name_or_path}, saving the later one as {unique_file_name} instead.")
+                    request = dict(request, file_name_or_path=os.path.join(os.path.dirname(file_name_or_path), unique_file_name))
+                used_paths.add(file_name_or_path)
+                try:
+                    results.append(self.process_tts_to_file(**request, switch_device=False))
+                except Exception as e:
+                    results.append(e)
+        finally:
+            self.switch_model_device() # Unload to CPU if lowram ON
+        return results
+
+    def process_tts_to_file(self, text, speaker_name_or_path, language, accent=None, file_name_or_path="out.wav", stream=False, switch_device=True):
         if file_name_or_path == '' or file_name_or_path is None:
             file_name_or_path = "out.wav"
         try:
@@ -728,15 +724,48 @@ class TTSWrapper:
             language_code = language.lower()
 
             accent = language if accent is None else accent
+
+            # Check if 'text' is a valid path to a '.txt' file.
+            if os.path.isfile(text) and text.lower().endswith('.txt'):
+                with open(text, 'r', encoding='utf-8') as f:
+                    text = f.read()
+
+            # Replace double quotes with single, asterisks, carriage returns, and line feeds
+            clear_text = self.clean_text(text)
+
+            # Generate a dictionary of the parameters to use for caching, everything that changes how the result sounds.
+            text_params = {
+              'text': clear_text,
+              'speaker_name_or_path': speaker_name_or_path,
+              'language': language,
+              'accent': accent,
+              'model_version': self.model_version,
+              'tts_settings': self.tts_settings,
+              'speaker_source': self.speaker_fingerprint(speaker_name_or_path, language_code),
+            }
+
+            # Check if results are already cached before looking for the speaker or touching the model.
+            # Streams always generate, a cached result is a file path and the stream endpoint needs chunks to yield.
+            cached_result = self.check_cache(text_params) if not stream else None
+
+            if cached_result is not None:
+                logger.info("Using cached result.")
+                return cached_result  # Return the path to the cached result.
             
             speaker_json_path = None
-            # Adjusted path for JSON file in the latent speaker folder to include language
-            for latent_speaker_folder in self.latent_speaker_folders:
-                proposed_path = os.path.join(latent_speaker_folder, language_code, f"{speaker_name}.json")
-                logger.info(f"Checking for speaker JSON at {proposed_path}")
-                if os.path.exists(proposed_path):
-                    speaker_json_path = proposed_path
-                    break
+            speaker_key = f"{speaker_name}_{language_code}"
+            if speaker_key in self.latent_store:
+                speaker_json_path = self.latent_store.index[speaker_key]["source"]
+            else:
+                # Adjusted path for JSON file in the latent speaker folder to include language
+                for latent_speaker_folder in self.latent_speaker_folders:
+                    proposed_path = os.path.join(latent_speaker_folder, language_code, f"{speaker_name}.json")
+                    logger.info(f"Checking for speaker JSON at {proposed_path}")
+                    if os.path.exists(proposed_path):
+                        speaker_json_path = proposed_path
+                        # Added since the latent store was last synced
+                        self.latent_store.sync(self.latent_speaker_folders)
+                        break
             if speaker_json_path is None:
                 raise ValueError(f"Speaker JSON file not found for {speaker_name} for language '{language_code}'.")
             else:
@@ -774,55 +803,33 @@ class TTSWrapper:
                 # Only a filename was provided; prepend with output folder.
                 output_file = os.path.join(self.output_folder, file_name_or_path)
 
-
-            # Check if 'text' is a valid path to a '.txt' file.
-            if os.path.isfile(text) and text.lower().endswith('.txt'):
-                with open(text, 'r', encoding='utf-8') as f:
-                    text = f.read()
-
-            # Generate unic name for cached result
+            # Generate unic name for cached result, from the hash of its parameters so results made in the same second don't overwrite each other
             if self.enable_cache_results:
-                timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                file_name_or_path = timestamp + "_cache_" + file_name_or_path
+                file_name_or_path = self.result_cache.key(text_params)[:32] + "_cache_" + os.path.basename(file_name_or_path)
                 output_file = os.path.join(self.output_folder, file_name_or_path)
 
-            # Replace double quotes with single, asterisks, carriage returns, and line feeds
-            clear_text = self.clean_text(text)
-
-            # Generate a dictionary of the parameters to use for caching.
-            text_params = {
-              'text': clear_text,
-              'speaker_name_or_path': speaker_name_or_path,
-              'language': language,
-              'accent': accent,
-              'file_name_or_path': file_name_or_path
-            }
-
-            # Check if results are already cached.
-            cached_result = self.check_cache(text_params)
-
-            if cached_result is not None:
-                logger.info("Using cached result.")
-                return cached_result  # Return the path to the cached result.
-
-            self.switch_model_device() # Load to CUDA if lowram ON
+            if switch_device:
+                self.switch_model_device() # Load to CUDA if lowram ON
 
             # Define generation if model via api or locally
             if self.model_source == "local":
                 if stream:
                     async def stream_fn():
-                        async for chunk in self.stream_generation(clear_text,speaker_name_or_path,speaker_wav,language,accent,output_file):
-                            yield chunk
-                        self.switch_model_device()
-                        # After generation completes successfully...
-                        self.update_cache(text_params,output_file)
+                        try:
+                            async for chunk in self.stream_generation(clear_text,speaker_name_or_path,speaker_wav,language,accent,output_file):
+                                yield chunk
+                            # After generation completes successfully, a stream cancelled part way isn't cached
+                            self.update_cache(text_params,output_file)
+                        finally:
+                            self.switch_model_device()
                     return stream_fn()
                 else:
                     self.local_generation(clear_text,speaker_name_or_path,speaker_wav,language,accent,output_file)
             else:
                 self.api_generation(clear_text,speaker_wav,language,accent,output_file)
             
-            self.switch_model_device() # Unload to CPU if lowram ON
+            if switch_device:
+                self.switch_model_device() # Unload to CPU if lowram ON
 
             # After generation completes successfully...
             self.update_cache(text_params,output_file)